@@ -0,0 +1,8 @@
+from src.mishri_boutique import create_app
+from src.mishri_boutique.asgi import create_asgi_app
+
+app = create_asgi_app(create_app())
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app)
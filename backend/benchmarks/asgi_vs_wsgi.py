@@ -0,0 +1,116 @@
+"""Compare concurrent-connection throughput of the WSGI and ASGI serving modes.
+
+    python -m benchmarks.asgi_vs_wsgi --products 5000 --concurrency 8 32 128
+    python -m benchmarks.asgi_vs_wsgi --skip-seed --database-url sqlite:////srv/bench.db \\
+        --wsgi-url http://127.0.0.1:8000 --asgi-url http://127.0.0.1:8001
+
+Without URLs both servers (werkzeug threaded and uvicorn) run in this process
+next to the load generator, so absolute numbers are pessimistic; point it at
+real deployments (e.g. gunicorn wsgi:app and uvicorn asgi:app with the same
+worker count) for figures worth comparing.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from .run import run_http, scenarios, start_server
+from .seed import BENCH_PASSWORD, bench_email, seed_catalog
+
+# The endpoints served natively by the ASGI app, plus one it hands to Flask
+DEFAULT_ENDPOINTS = ['get_product', 'featured', 'category', 'filter_products']
+
+
+def start_asgi_server(app):
+    import uvicorn
+    from src.mishri_boutique.asgi import create_asgi_app
+
+    server = uvicorn.Server(uvicorn.Config(create_asgi_app(app), host='127.0.0.1', port=0,
+                                           log_level='warning', lifespan='on'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, 'http://127.0.0.1:%d' % port
+
+
+def login(base_url):
+    body = json.dumps({'email': bench_email(1), 'password': BENCH_PASSWORD}).encode()
+    request = urllib.request.Request(base_url + '/api/auth/login', data=body, method='POST',
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())['access_token']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--database-url', help='defaults to a fresh SQLite file in a temp dir')
+    parser.add_argument('--skip-seed', action='store_true', help='reuse an already seeded database')
+    parser.add_argument('--wsgi-url', help='benchmark this WSGI server instead of starting one')
+    parser.add_argument('--asgi-url', help='benchmark this ASGI server instead of starting one')
+    parser.add_argument('--requests', type=int, default=500, help='requests per endpoint and level')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 32, 128])
+    parser.add_argument('--only', action='append', help='endpoints to run (default: %s)'
+                        % ', '.join(DEFAULT_ENDPOINTS))
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    from src.mishri_boutique import create_app, db
+    from src.mishri_boutique.models import Category, Product
+
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'RESERVATION_SWEEP_INTERVAL': 0,
+                      'LOGIN_RATE_LIMIT_IP': 10 ** 9})
+    with app.app_context():
+        if args.skip_seed:
+            ctx = {
+                'product_ids': [i for i, in db.session.query(Product.id)],
+                'category_ids': [i for i, in db.session.query(Category.id)],
+                'size_names': ['S', 'M', 'L'],
+                'users': 5,
+            }
+        else:
+            ctx = seed_catalog(db, args.products, args.categories)
+            print('Seeded %d products in %.1fs' % (ctx['products'], ctx['seconds']))
+
+    servers = []
+    wsgi_url, asgi_url = args.wsgi_url, args.asgi_url
+    if not wsgi_url:
+        server, wsgi_url = start_server(app)
+        servers.append(server.shutdown)
+    if not asgi_url:
+        server, asgi_url = start_asgi_server(app)
+        servers.append(lambda: setattr(server, 'should_exit', True))
+
+    token = login(wsgi_url)
+    wanted = args.only or DEFAULT_ENDPOINTS
+    rows = []
+    for scenario in scenarios(ctx):
+        if scenario.name not in wanted:
+            continue
+        for concurrency in args.concurrency:
+            wsgi = run_http(wsgi_url, scenario, args.requests, concurrency, token, args.seed)
+            asgi = run_http(asgi_url, scenario, args.requests, concurrency, token, args.seed)
+            rows.append((scenario.name, concurrency, wsgi, asgi))
+    for stop in servers:
+        stop()
+
+    print('%-16s %5s %10s %10s %8s %10s %10s' % (
+        'endpoint', 'conc', 'wsgi req/s', 'asgi req/s', 'speedup', 'wsgi p95', 'asgi p95'))
+    for name, concurrency, wsgi, asgi in rows:
+        print('%-16s %5d %10.1f %10.1f %7.2fx %10.2f %10.2f%s' % (
+            name, concurrency, wsgi['rps'], asgi['rps'],
+            asgi['rps'] / wsgi['rps'] if wsgi['rps'] else 0.0, wsgi['p95_ms'], asgi['p95_ms'],
+            '  (errors: %d/%d)' % (wsgi['errors'], asgi['errors']) if wsgi['errors'] or asgi['errors'] else ''))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""Concurrency stress test for per-size stock reservation.
+
+Many threads keep reserving the same size until it sells out; the run fails
+if more units were reserved than were in stock or the stock counters drift.
+
+    python -m benchmarks.inventory_stress --threads 32 --stock 500
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--stock', type=int, default=500)
+    parser.add_argument('--quantity', type=int, default=1, help='units per reservation')
+    parser.add_argument('--database-url', help='defaults to a throwaway SQLite file')
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'inventory_stress.db')
+        os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    os.environ.setdefault('RESERVATION_SWEEP_INTERVAL', '0')
+
+    from src.mishri_boutique import create_app, db
+    from src.mishri_boutique.models import Category, Product, ProductSize, Reservation, Size
+    from src.mishri_boutique.inventory import InsufficientStock, reserve
+
+    app = create_app()
+    with app.app_context():
+        category = Category(name='Stress')
+        size = Size(name='M')
+        db.session.add_all([category, size])
+        db.session.flush()
+        product = Product(name='Stress kurti', price=1, category_id=category.id, stock=args.stock)
+        product.product_sizes.append(ProductSize(size_id=size.id, stock=args.stock))
+        db.session.add(product)
+        db.session.commit()
+        product_id, size_id = product.id, size.id
+
+    reserved = []
+    lock_retries = [0]
+    start = threading.Barrier(args.threads)
+
+    def worker():
+        mine = 0
+        start.wait()
+        with app.app_context():
+            while True:
+                try:
+                    reserve(product_id, size_id, args.quantity)
+                    db.session.commit()
+                    mine += args.quantity
+                except InsufficientStock:
+                    db.session.rollback()
+                    break
+                except OperationalError:
+                    # SQLite allows one writer at a time; back off and retry
+                    db.session.rollback()
+                    lock_retries[0] += 1
+                    time.sleep(0.001)
+            db.session.remove()
+        reserved.append(mine)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    began = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - began
+
+    with app.app_context():
+        size_stock = ProductSize.query.filter_by(product_id=product_id, size_id=size_id).one().stock
+        product_stock = db.session.get(Product, product_id).stock
+        held = db.session.query(db.func.sum(Reservation.quantity)).scalar() or 0
+
+    total = sum(reserved)
+    print('threads=%d stock=%d reserved=%d held=%d size_stock=%d product_stock=%d '
+          'lock_retries=%d elapsed=%.2fs (%.0f reservations/s)'
+          % (args.threads, args.stock, total, held, size_stock, product_stock,
+             lock_retries[0], elapsed, total / args.quantity / elapsed))
+
+    expected_left = args.stock - total
+    ok = (total <= args.stock and held == total and size_stock == expected_left
+          and product_stock == expected_left and size_stock >= 0
+          and size_stock < args.quantity)
+    print('OK: no oversell' if ok else 'FAILED: stock counters inconsistent')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""Concurrency stress test for loyalty points accrual.
+
+Many threads keep crediting points to the same few users; the run fails if
+any credit is lost, a balance disagrees with the ledger or a tier is wrong.
+--naive runs the old read-modify-write path (User.add_points) instead, to
+show the updates it loses. --bulk N then times crediting N entries with
+accrue_bulk() against one accrue() per entry.
+
+    python -m benchmarks.points_stress --threads 32 --credits 200
+    python -m benchmarks.points_stress --naive
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--credits', type=int, default=200, help='credits per thread')
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--naive', action='store_true', help='use the read-modify-write User.add_points')
+    parser.add_argument('--bulk', type=int, default=5000, help='entries for the bulk timing (0 to skip)')
+    parser.add_argument('--database-url', help='defaults to a throwaway SQLite file')
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'points_stress.db')
+        os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    os.environ.setdefault('RESERVATION_SWEEP_INTERVAL', '0')
+    os.environ.setdefault('JOB_WORKERS', '0')
+
+    from src.mishri_boutique import create_app, db
+    from src.mishri_boutique.points import accrue, accrue_bulk, mismatched_balances, tier_for
+    from src.mishri_boutique.user import PointsEntry, User
+
+    app = create_app()
+    with app.app_context():
+        users = [User(username='stress%d' % i, email='stress%d@example.com' % i, points=0)
+                 for i in range(args.users)]
+        db.session.add_all(users)
+        db.session.commit()
+        user_ids = [u.id for u in users]
+
+    credited = []
+    lock_retries = [0]
+    start = threading.Barrier(args.threads)
+
+    def credit(user_id, points):
+        if args.naive:
+            user = db.session.get(User, user_id)
+            user.add_points(points)
+            db.session.add(PointsEntry(user_id=user_id, points=points, reason='stress'))
+        else:
+            accrue(user_id, points, 'stress')
+        db.session.commit()
+
+    def worker():
+        mine = 0
+        rng = random.Random()
+        start.wait()
+        with app.app_context():
+            for _ in range(args.credits):
+                user_id, points = rng.choice(user_ids), rng.randint(1, 5)
+                while True:
+                    try:
+                        credit(user_id, points)
+                        mine += points
+                        break
+                    except OperationalError:
+                        # SQLite allows one writer at a time; back off and retry
+                        db.session.rollback()
+                        lock_retries[0] += 1
+                        time.sleep(0.001)
+                # Start the next credit from a fresh read, as a new request would
+                db.session.expire_all()
+            db.session.remove()
+        credited.append(mine)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    began = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - began
+
+    with app.app_context():
+        balance = db.session.query(db.func.sum(User.points)).filter(User.id.in_(user_ids)).scalar() or 0
+        mismatched = mismatched_balances()
+        wrong_tier = User.query.filter(User.id.in_(user_ids), User.user_type != tier_for(User.points)).count()
+
+    total = sum(credited)
+    print('mode=%s threads=%d credits=%d credited=%d balance=%d lost=%d mismatched=%d wrong_tier=%d '
+          'lock_retries=%d elapsed=%.2fs (%.0f credits/s)'
+          % ('naive' if args.naive else 'ledger', args.threads, args.threads * args.credits, total,
+             balance, total - balance, len(mismatched), wrong_tier, lock_retries[0], elapsed,
+             args.threads * args.credits / elapsed))
+    ok = balance == total and not mismatched and not wrong_tier
+    print('OK: no lost updates' if ok else 'FAILED: points were lost or drifted from the ledger')
+
+    if args.bulk:
+        with app.app_context():
+            entries = [{'user_id': user_ids[i % len(user_ids)], 'points': 10, 'reason': 'order', 'ref': i}
+                       for i in range(args.bulk)]
+            began = time.perf_counter()
+            for entry in entries:
+                accrue(entry['user_id'], entry['points'], 'order-single', entry['ref'])
+            db.session.commit()
+            single = time.perf_counter() - began
+            began = time.perf_counter()
+            accrue_bulk(entries)
+            db.session.commit()
+            bulk = time.perf_counter() - began
+            print('credit %d entries: accrue() each %.0fms, accrue_bulk() %.0fms (%.1fx)'
+                  % (args.bulk, single * 1000, bulk * 1000, single / bulk))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""Check that catalog endpoints issue O(1) SQL statements per request.
+
+    python -m benchmarks.query_counts
+    python -m benchmarks.query_counts --small 1 --large 200
+
+Each endpoint is requested once (a response cache miss) against a catalog
+of --small and of --large products, all featured and in one category. The
+run fails if any endpoint issues more statements for the larger catalog,
+i.e. if a per-product query (N+1) crept back in.
+"""
+import argparse
+import sys
+
+
+def endpoints(ctx):
+    category_id = ctx['category_ids'][0]
+    return [
+        ('list_products', '/api/products?limit=100'),
+        ('featured', '/api/products/featured'),
+        ('category', '/api/categories/%d/products' % category_id),
+        ('filter_products', '/api/products/filter?min_price=0'),
+        ('get_product', '/api/products/%d' % ctx['product_ids'][-1]),
+    ]
+
+
+def measure(products):
+    """{endpoint: statements} for one request each against a fresh catalog"""
+    from src.mishri_boutique import create_app, db
+    from src.mishri_boutique.auth import issue_access_token
+    from src.mishri_boutique.models import Product
+    from src.mishri_boutique.product_listing import rebuild_listings
+    from src.mishri_boutique.user import User, UserType
+    from .seed import seed_catalog
+    from .statements import count_statements
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'RESERVATION_SWEEP_INTERVAL': 0,
+                      'LAST_LOGIN_FLUSH_INTERVAL': 0, 'JOB_WORKERS': 0, 'METRICS_ENABLED': False})
+    with app.app_context():
+        ctx = seed_catalog(db, products, categories=1, users=3)
+        Product.query.update({Product.is_featured: True}, synchronize_session=False)
+        db.session.commit()
+        rebuild_listings()
+        # Prices are served to PLUS and PREMIUM only, so count that path
+        user = User.query.filter_by(user_type=UserType.PLUS).first()
+        headers = {'Authorization': 'Bearer ' + issue_access_token(user)}
+        engine = db.engine
+
+    client = app.test_client()
+    client.get('/api/sizes')  # first request of the process starts the workers
+    counts = {}
+    for name, path in endpoints(ctx):
+        with count_statements(engine) as statements:
+            response = client.get(path, headers=headers)
+        if response.status_code != 200:
+            sys.exit('%s answered %d' % (path, response.status_code))
+        counts[name] = len(statements)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--small', type=int, default=1, help='products in the small catalog')
+    parser.add_argument('--large', type=int, default=50, help='products in the large catalog')
+    args = parser.parse_args(argv)
+
+    small, large = measure(args.small), measure(args.large)
+    print('%-18s %10s %10s' % ('endpoint', args.small, args.large))
+    failed = []
+    for name in small:
+        print('%-18s %10d %10d' % (name, small[name], large[name]))
+        if large[name] > small[name]:
+            failed.append(name)
+    if failed:
+        print('FAILED: statements grow with the catalog for ' + ', '.join(failed))
+        return 1
+    print('OK: statement counts do not depend on the number of products')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""Benchmark the hot API endpoints against a seeded synthetic catalog.
+
+    python -m benchmarks.run --products 10000 --requests 200
+    python -m benchmarks.run --mode http --concurrency 32 --requests 2000
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json
+
+Reports p50/p95/p99 latency, throughput and SQL statements per request for
+each endpoint. With --baseline the run exits non-zero when an endpoint's p95
+or statement count regressed beyond --tolerance.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from .seed import BENCH_PASSWORD, FABRICS, OCCASIONS, bench_email, seed_catalog
+from .statements import count_statements
+
+
+class Scenario:
+    """One endpoint under test; `build` returns (method, path, json body)"""
+
+    def __init__(self, name, build, auth=False):
+        self.name = name
+        self.build = build
+        self.auth = auth
+
+
+def scenarios(ctx):
+    product_ids = ctx['product_ids']
+    category_ids = ctx['category_ids']
+    sizes = ctx['size_names']
+    return [
+        Scenario('filter_products', lambda rng: ('GET', '/api/products/filter?' + urlencode({
+            'fabric': rng.choice(FABRICS), 'occasion': rng.choice(OCCASIONS), 'size': rng.choice(sizes)
+        }), None), auth=True),
+        Scenario('list_products', lambda rng: ('GET', '/api/products?limit=24&sort=%s' % rng.choice(
+            ['newest', 'price-low-high']), None), auth=True),
+        Scenario('get_product', lambda rng: ('GET', '/api/products/%d' % rng.choice(product_ids), None),
+                 auth=True),
+        Scenario('featured', lambda rng: ('GET', '/api/products/featured', None), auth=True),
+        Scenario('category', lambda rng: ('GET', '/api/categories/%d/products' % rng.choice(category_ids),
+                                          None), auth=True),
+        Scenario('login', lambda rng: ('POST', '/api/auth/login', {
+            'email': bench_email(rng.randrange(ctx['users'])), 'password': BENCH_PASSWORD})),
+    ]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, wall_seconds, statements, errors):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'rps': round(count / wall_seconds, 1) if wall_seconds else 0.0,
+        'statements': round(statements / count, 2) if count and statements is not None else None,
+    }
+
+
+def run_inprocess(app, scenario, requests, token, rng):
+    from src.mishri_boutique import db
+
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer ' + token} if scenario.auth and token else {}
+    latencies, errors = [], 0
+    with app.app_context():
+        engine = db.engine
+    with count_statements(engine) as statements:
+        began = time.perf_counter()
+        for _ in range(requests):
+            method, path, body = scenario.build(rng)
+            start = time.perf_counter()
+            response = client.open(path, method=method, json=body, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+        wall = time.perf_counter() - began
+    return summarize(latencies, wall, len(statements), errors)
+
+
+def _http_call(base_url, method, path, body, headers):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(base_url + path, data=data, method=method,
+                                     headers=dict(headers, **({'Content-Type': 'application/json'}
+                                                              if data else {})))
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+            ok = True
+    except urllib.error.HTTPError as e:
+        e.read()
+        ok = e.code < 400
+    except OSError:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def run_http(base_url, scenario, requests, concurrency, token, seed, engine=None):
+
+    headers = {'Authorization': 'Bearer ' + token} if scenario.auth and token else {}
+    rng = random.Random(seed)
+    calls = [scenario.build(rng) for _ in range(requests)]
+    with count_statements(engine) if engine is not None else _null() as statements:
+        began = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda c: _http_call(base_url, c[0], c[1], c[2], headers), calls))
+        wall = time.perf_counter() - began
+    latencies = [latency for latency, _ in results]
+    errors = sum(1 for _, ok in results if not ok)
+    return summarize(latencies, wall, len(statements) if statements is not None else None, errors)
+
+
+class _null:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+def start_server(app):
+    from werkzeug.serving import make_server
+    # Per-request access logs would dominate the output and the timings
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, 'http://127.0.0.1:%d' % server.server_port
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of human readable regressions against `baseline`"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('endpoints', {}).get(name)
+        if not base:
+            continue
+        if base['p95_ms'] and result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append('%s: p95 %.2fms vs baseline %.2fms' % (name, result['p95_ms'], base['p95_ms']))
+        if (base.get('statements') is not None and result['statements'] is not None
+                and result['statements'] > base['statements']):
+            regressions.append('%s: %.2f statements/request vs baseline %.2f'
+                               % (name, result['statements'], base['statements']))
+    return regressions
+
+
+def print_table(results):
+    print('%-16s %8s %7s %9s %9s %9s %9s %7s' % (
+        'endpoint', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'stmts'))
+    for name, r in results.items():
+        print('%-16s %8d %7d %9.2f %9.2f %9.2f %9.1f %7s' % (
+            name, r['requests'], r['errors'], r['p50_ms'], r['p95_ms'], r['p99_ms'], r['rps'],
+            '-' if r['statements'] is None else '%.2f' % r['statements']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=['inprocess', 'http'], default='inprocess')
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--database-url', help='defaults to a fresh SQLite file in a temp dir')
+    parser.add_argument('--skip-seed', action='store_true', help='reuse an already seeded database')
+    parser.add_argument('--url', help='benchmark a running server instead of an in-process one')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--login-requests', type=int, default=10,
+                        help='requests for the (CPU heavy) login endpoint')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--only', action='append', help='run only the named endpoint(s)')
+    parser.add_argument('--no-cache', action='store_true', help='disable the response cache')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--baseline', help='compare against this baseline file')
+    parser.add_argument('--save-baseline', help='write the results to this baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed p95 slowdown before flagging a regression')
+    args = parser.parse_args(argv)
+
+    from src.mishri_boutique import create_app, db
+    from src.mishri_boutique.models import Category, Product
+
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    # Every benchmark login comes from one address, so lift the per-IP limit
+    config = {'SQLALCHEMY_DATABASE_URI': database_url, 'RESERVATION_SWEEP_INTERVAL': 0,
+              'LOGIN_RATE_LIMIT_IP': 10 ** 9}
+    if args.no_cache:
+        config['CACHE_MAX_ENTRIES'] = 0
+    app = create_app(config)
+
+    with app.app_context():
+        if args.skip_seed:
+            ctx = {
+                'product_ids': [i for i, in db.session.query(Product.id)],
+                'category_ids': [i for i, in db.session.query(Category.id)],
+                'size_names': ['S', 'M', 'L'],
+                'users': 5,
+            }
+        else:
+            ctx = seed_catalog(db, args.products, args.categories)
+            print('Seeded %d products in %.1fs' % (ctx['products'], ctx['seconds']))
+        engine = db.engine
+
+    server = None
+    base_url = args.url
+    if args.mode == 'http' and not base_url:
+        server, base_url = start_server(app)
+
+    # A PLUS user (bench1) so priced responses are exercised
+    login = {'email': bench_email(1), 'password': BENCH_PASSWORD}
+    if args.mode == 'http':
+        request = urllib.request.Request(base_url + '/api/auth/login', data=json.dumps(login).encode(),
+                                         headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(request) as response:
+            token = json.loads(response.read())['access_token']
+    else:
+        token = app.test_client().post('/api/auth/login', json=login).get_json()['access_token']
+
+    results = {}
+    for scenario in scenarios(ctx):
+        if args.only and scenario.name not in args.only:
+            continue
+        count = args.login_requests if scenario.name == 'login' else args.requests
+        if args.mode == 'http':
+            results[scenario.name] = run_http(base_url, scenario, count, args.concurrency, token,
+                                              args.seed, engine if server else None)
+        else:
+            results[scenario.name] = run_inprocess(app, scenario, count, token, random.Random(args.seed))
+    if server:
+        server.shutdown()
+
+    print_table(results)
+    report = {'mode': args.mode, 'products': len(ctx['product_ids']), 'endpoints': results}
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print('Baseline written to %s' % args.save_baseline)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('mode') != args.mode:
+            print('Warning: baseline was recorded in %s mode' % baseline.get('mode'))
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            return 1
+        print('No regressions against %s' % args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
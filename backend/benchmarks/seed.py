@@ -0,0 +1,132 @@
+"""Seed a synthetic catalog for benchmarking.
+
+    python -m benchmarks.seed --products 100000 --database-url sqlite:///bench.db
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+FABRICS = ['Cotton', 'Silk', 'Chiffon', 'Georgette', 'Crepe', 'Rayon', 'Linen']
+STYLES = ['A-line', 'Straight', 'Anarkali', 'Asymmetric', 'High-Low', 'Trail Cut']
+OCCASIONS = ['Casual', 'Party', 'Festival', 'Wedding', 'Office', 'Daily Wear']
+SLEEVES = ['Full', 'Three-quarter', 'Half', 'Sleeveless']
+NECKS = ['V-neck', 'Round', 'Collar', 'Boat', 'Square']
+SIZES = ['XS', 'S', 'M', 'L', 'XL', 'XXL']
+WORDS = ['floral', 'printed', 'embroidered', 'handloom', 'block', 'zari', 'mirror',
+         'pastel', 'festive', 'classic', 'banarasi', 'chanderi', 'ikat', 'bandhani']
+
+# Users created by seed_catalog(); all share BENCH_PASSWORD
+BENCH_PASSWORD = 'bench-password'
+
+
+def bench_email(i):
+    return 'bench%d@example.com' % i
+
+
+def seed_catalog(db, products=10000, categories=20, users=5, batch_size=5000, seed=42):
+    """Insert categories, sizes, users and `products` products with sizes.
+
+    Uses bulk executemany inserts so large catalogs load in reasonable time.
+    Returns a summary dict with the generated ids.
+    """
+    from src.mishri_boutique.models import Category, Product, ProductSize, Size
+    from src.mishri_boutique.passwords import hash_password
+    from src.mishri_boutique.product_listing import mark_stale
+    from src.mishri_boutique.user import User, UserType
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    category_ids = db.session.scalars(
+        insert(Category).returning(Category.id, sort_by_parameter_order=True),
+        [{'name': 'Category %d' % i, 'description': 'Benchmark category %d' % i}
+         for i in range(categories)]
+    ).all()
+    size_ids = db.session.scalars(
+        insert(Size).returning(Size.id, sort_by_parameter_order=True),
+        [{'name': name} for name in SIZES]
+    ).all()
+
+    # One hash shared by every bench user keeps seeding fast
+    password_hash = hash_password(BENCH_PASSWORD)
+    types = [UserType.BASIC, UserType.PLUS, UserType.PREMIUM]
+    db.session.execute(insert(User), [
+        {'username': 'bench%d' % i, 'email': bench_email(i), 'password_hash': password_hash,
+         'user_type': types[i % len(types)], 'points': 0}
+        for i in range(users)
+    ])
+    db.session.commit()
+
+    base = datetime(2024, 1, 1)
+    product_ids = []
+    for start in range(0, products, batch_size):
+        count = min(batch_size, products - start)
+        rows, sizes = [], []
+        for i in range(start, start + count):
+            price = float(rng.randrange(299, 5999))
+            chosen = rng.sample(size_ids, rng.randint(1, len(size_ids)))
+            stock = [rng.randint(0, 20) for _ in chosen]
+            rows.append({
+                'name': '%s %s kurti %d' % (rng.choice(WORDS).title(), rng.choice(WORDS), i),
+                'description': ' '.join(rng.choice(WORDS) for _ in range(12)),
+                'price': price,
+                'sale_price': round(price * 0.8, 2) if rng.random() < 0.2 else None,
+                'fabric': rng.choice(FABRICS),
+                'style': rng.choice(STYLES),
+                'occasion': rng.choice(OCCASIONS),
+                'sleeve_type': rng.choice(SLEEVES),
+                'neck_type': rng.choice(NECKS),
+                'images': ['/images/%d-%d.jpg' % (i, n) for n in range(3)],
+                'stock': sum(stock),
+                'is_featured': rng.random() < 0.01,
+                'category_id': rng.choice(category_ids),
+                'created_at': base + timedelta(minutes=i),
+                'updated_at': base + timedelta(minutes=i),
+            })
+            sizes.append(list(zip(chosen, stock)))
+        ids = db.session.scalars(
+            insert(Product).returning(Product.id, sort_by_parameter_order=True), rows
+        ).all()
+        db.session.execute(insert(ProductSize), [
+            {'product_id': product_id, 'size_id': size_id, 'stock': stock}
+            for product_id, product_sizes in zip(ids, sizes)
+            for size_id, stock in product_sizes
+        ])
+        mark_stale(ids)
+        db.session.commit()
+        product_ids.extend(ids)
+
+    return {
+        'products': len(product_ids),
+        'product_ids': product_ids,
+        'category_ids': category_ids,
+        'size_names': SIZES,
+        'users': users,
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    from src.mishri_boutique import create_app, db
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database_url,
+                      'RESERVATION_SWEEP_INTERVAL': 0})
+    with app.app_context():
+        summary = seed_catalog(db, args.products, args.categories, args.users,
+                               args.batch_size, args.seed)
+    print('Seeded %d products in %.1fs' % (summary['products'], summary['seconds']))
+
+
+if __name__ == '__main__':
+    main()
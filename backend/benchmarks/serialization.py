@@ -0,0 +1,126 @@
+"""Microbenchmark of product serialization: ORM to_dict() against compiled row serializers.
+
+    python -m benchmarks.serialization --products 10000 --repeat 5
+
+Each path loads every product and encodes the list to JSON bytes; the table
+shows the best of --repeat runs split into loading/building the dicts and
+encoding them.
+"""
+import argparse
+import gc
+import time
+
+from .seed import seed_catalog
+
+
+def product_query():
+    """Product query with sizes, per-size stock and images batch-loaded.
+
+    The ORM path the catalog used before product_listing and the compiled row
+    serializers, kept here as the baseline they are measured against.
+    """
+    from src.mishri_boutique.models import Product, ProductSize
+    from sqlalchemy.orm import selectinload
+
+    return Product.query.options(selectinload(Product.product_sizes).joinedload(ProductSize.size),
+                                 selectinload(Product.image_assets))
+
+
+def serialize_product(product, can_view_prices):
+    """Listing representation of a product loaded through product_query()"""
+    from src.mishri_boutique.images import image_variants
+    from src.mishri_boutique.queries import size_with_stock
+
+    return {
+        'id': product.id,
+        'name': product.name,
+        'description': product.description,
+        'price': product.price if can_view_prices else None,
+        'sale_price': product.sale_price if can_view_prices else None,
+        'fabric': product.fabric,
+        'style': product.style,
+        'occasion': product.occasion,
+        'sleeve_type': product.sleeve_type,
+        'neck_type': product.neck_type,
+        'images': product.images,
+        'image_variants': image_variants(product.images, product.image_assets),
+        'category_id': product.category_id,
+        'sizes': [size_with_stock(ps) for ps in product.product_sizes],
+        'stock': product.stock,
+        'is_featured': product.is_featured
+    }
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--database-url', default='sqlite://')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    from flask.json.provider import DefaultJSONProvider
+    from src.mishri_boutique import create_app, db
+    from src.mishri_boutique.listing import PRODUCT_FIELDS, product_serializer
+    from src.mishri_boutique.models import Product, ProductSize
+    from src.mishri_boutique.product_listing import rebuild_listings
+    from src.mishri_boutique.serializers import available_backends, make_encoder
+    from sqlalchemy.orm import joinedload, selectinload
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database_url, 'RESERVATION_SWEEP_INTERVAL': 0,
+                      'LAST_LOGIN_FLUSH_INTERVAL': 0, 'JOB_WORKERS': 0})
+    with app.app_context():
+        started = time.perf_counter()
+        seed_catalog(db, args.products, args.categories, seed=args.seed)
+        rebuild_listings()
+        print('Seeded %d products in %.1fs' % (args.products, time.perf_counter() - started))
+
+        # What jsonify() encoded with before FastJSONProvider
+        stdlib = DefaultJSONProvider(app)
+
+        def to_dict_build():
+            products = Product.query.options(
+                selectinload(Product.product_sizes).joinedload(ProductSize.size)).all()
+            return [p.to_dict() for p in products]
+
+        def serialize_product_build():
+            return [serialize_product(p, True) for p in product_query()]
+
+        serializer = product_serializer(PRODUCT_FIELDS, True)
+
+        def compiled_build():
+            return [serializer.serialize(row) for row in db.session.execute(serializer.select())]
+
+        paths = [
+            ('to_dict + stdlib', to_dict_build, lambda data: stdlib.dumps(data).encode()),
+            ('serialize_product + stdlib', serialize_product_build, lambda data: stdlib.dumps(data).encode()),
+        ]
+        for backend in reversed(available_backends()):
+            paths.append(('compiled rows + %s' % backend, compiled_build, make_encoder(backend)))
+
+        print('%-30s %10s %10s %10s %10s' % ('path', 'build ms', 'encode ms', 'total ms', 'bytes'))
+        baseline = None
+        for name, build, encode in paths:
+            best = None
+            for _ in range(args.repeat):
+                db.session.expunge_all()
+                gc.collect()
+                data, build_ms = timed(build)
+                body, encode_ms = timed(lambda: encode(data))
+                if best is None or build_ms + encode_ms < best[0] + best[1]:
+                    best = (build_ms, encode_ms, len(body))
+            total = best[0] + best[1]
+            baseline = baseline or total
+            print('%-30s %10.1f %10.1f %10.1f %10d  %.1fx' % (name, best[0], best[1], total, best[2],
+                                                               baseline / total))
+
+
+if __name__ == '__main__':
+    main()
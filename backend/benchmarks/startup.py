@@ -0,0 +1,94 @@
+"""Measure cold start: package import, create_app() and the first request.
+
+    python -m benchmarks.startup --runs 10
+    python -m benchmarks.startup --database-url postgresql://localhost/bench --importtime 15
+
+Every run is a fresh interpreter, as a newly forked or autoscaled worker
+would be. Boot is measured with DB_AUTO_UPGRADE on (the default: checks for
+pending migrations) and off (the production path after `flask db upgrade`).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints one JSON line of timings in ms
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+from src.mishri_boutique import create_app
+imported = time.perf_counter()
+app = create_app({'SQLALCHEMY_DATABASE_URI': sys.argv[1], 'DB_AUTO_UPGRADE': sys.argv[2] == '1',
+                  'RESERVATION_SWEEP_INTERVAL': 0, 'LAST_LOGIN_FLUSH_INTERVAL': 0, 'JOB_WORKERS': 0})
+created = time.perf_counter()
+status = app.test_client().get(sys.argv[3]).status_code
+served = time.perf_counter()
+print(json.dumps({'import': (imported - started) * 1000, 'create_app': (created - imported) * 1000,
+                  'first_request': (served - created) * 1000, 'status': status}))
+'''
+
+
+def probe(database_url, auto_upgrade, path):
+    output = subprocess.run([sys.executable, '-c', PROBE, database_url, '1' if auto_upgrade else '0', path],
+                            cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(count):
+    """(self+children ms, module) of the slowest imports of the package"""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import src.mishri_boutique'],
+                            cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]) / 1000, parts[2].rstrip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--database-url', help='defaults to a fresh SQLite file in a temp dir')
+    parser.add_argument('--skip-seed', action='store_true', help='reuse an already seeded database')
+    parser.add_argument('--path', default='/api/products/featured', help='first request to time')
+    parser.add_argument('--importtime', type=int, default=0, metavar='N',
+                        help='also list the N slowest imports')
+    args = parser.parse_args(argv)
+
+    from src.mishri_boutique import create_app, db
+    from .seed import seed_catalog
+
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    if not args.skip_seed:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'RESERVATION_SWEEP_INTERVAL': 0,
+                          'LAST_LOGIN_FLUSH_INTERVAL': 0, 'JOB_WORKERS': 0})
+        with app.app_context():
+            ctx = seed_catalog(db, args.products)
+            print('Seeded %d products in %.1fs' % (ctx['products'], ctx['seconds']))
+
+    phases = ('import', 'create_app', 'first_request')
+    print('%-18s %-14s %10s %10s' % ('boot', 'phase', 'median ms', 'min ms'))
+    for auto_upgrade in (True, False):
+        runs = [probe(database_url, auto_upgrade, args.path) for _ in range(args.runs)]
+        if any(run['status'] != 200 for run in runs):
+            sys.exit('%s answered %s' % (args.path, sorted({run['status'] for run in runs})))
+        label = 'auto-upgrade ' + ('on' if auto_upgrade else 'off')
+        for phase in phases + ('total',):
+            values = [sum(run[p] for p in phases) if phase == 'total' else run[phase] for run in runs]
+            print('%-18s %-14s %10.1f %10.1f' % (label, phase, statistics.median(values), min(values)))
+
+    if args.importtime:
+        print('\nSlowest imports (ms, including their own imports):')
+        for ms, module in slowest_imports(args.importtime):
+            print('%8.1f %s' % (ms, module))
+
+
+if __name__ == '__main__':
+    main()
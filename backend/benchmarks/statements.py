@@ -0,0 +1,24 @@
+"""SQL statement counting shared by the benchmarks."""
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+@contextmanager
+def count_statements(engine):
+    """Count SQL statements executed on `engine` inside the block.
+
+    Yields a list that receives every statement, so callers can use len();
+    query_counts.py uses it to fail when an endpoint's count grows with the
+    number of products.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
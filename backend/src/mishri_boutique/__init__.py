@@ -2,37 +2,117 @@ from flask import Flask, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
-from dotenv import load_dotenv
 import os
-
-# Load environment variables
-load_dotenv()
+from . import database, lifecycle
+from .ratelimit import RateLimiter
+from .response_cache import ResponseCache
 
 # Initialize extensions
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': database.RoutingSession})
 jwt = JWTManager()
+cache = ResponseCache()
+limiter = RateLimiter()
+
+def load_env_file():
+    """Load a .env file into the environment if python-dotenv is installed"""
+    try:
+        from dotenv import load_dotenv
+    except ImportError:  # deployments usually set the environment directly
+        return
+    load_dotenv()
 
-def create_app():
+def create_app(config=None):
+    load_env_file()
     app = Flask(__name__)
     
     # Configure the Flask application
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///mishri_boutique.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['DATABASE_REPLICA_URL'] = os.getenv('DATABASE_REPLICA_URL')
+    app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 10))
+    app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 20))
+    app.config['DB_POOL_TIMEOUT'] = int(os.getenv('DB_POOL_TIMEOUT', 30))
+    app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    app.config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    app.config['DB_STATEMENT_TIMEOUT_MS'] = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
+    app.config['SQLITE_JOURNAL_MODE'] = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+    app.config['SQLITE_SYNCHRONOUS'] = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+    app.config['SQLITE_MMAP_SIZE'] = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
     app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-secret-key')
+    app.config['CACHE_BACKEND'] = os.getenv('CACHE_BACKEND', 'memory')
+    app.config['CACHE_REDIS_URL'] = os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    app.config['CACHE_DEFAULT_TIMEOUT'] = int(os.getenv('CACHE_DEFAULT_TIMEOUT', 300))
+    app.config['CACHE_MAX_ENTRIES'] = int(os.getenv('CACHE_MAX_ENTRIES', 1024))
+    app.config['CACHE_REPLICA_LAG_SECONDS'] = float(os.getenv('CACHE_REPLICA_LAG_SECONDS', 5))
+    app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+    app.config['COMPRESS_LEVEL'] = int(os.getenv('COMPRESS_LEVEL', 6))
+    app.config['RESERVATION_TTL'] = int(os.getenv('RESERVATION_TTL', 900))
+    app.config['RESERVATION_SWEEP_INTERVAL'] = int(os.getenv('RESERVATION_SWEEP_INTERVAL', 60))
+    app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+    app.config['METRICS_ALLOWED_IPS'] = os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1')  # comma-separated
+    app.config['SLOW_QUERY_MS'] = float(os.getenv('SLOW_QUERY_MS', 250))
+    app.config['PASSWORD_SCHEME'] = os.getenv('PASSWORD_SCHEME', 'bcrypt')
+    app.config['BCRYPT_ROUNDS'] = int(os.getenv('BCRYPT_ROUNDS', 12))
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+    app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.getenv('PASSWORD_HASH_MAX_PENDING', 64))
+    app.config['LOGIN_RATE_LIMIT_IP'] = int(os.getenv('LOGIN_RATE_LIMIT_IP', 30))
+    app.config['LOGIN_RATE_LIMIT_ACCOUNT'] = int(os.getenv('LOGIN_RATE_LIMIT_ACCOUNT', 5))
+    app.config['LOGIN_RATE_WINDOW'] = int(os.getenv('LOGIN_RATE_WINDOW', 300))
+    app.config['LAST_LOGIN_FLUSH_INTERVAL'] = int(os.getenv('LAST_LOGIN_FLUSH_INTERVAL', 10))
+    app.config['SLOW_QUERY_EXPLAIN'] = os.getenv('SLOW_QUERY_EXPLAIN', 'false').lower() == 'true'
+    app.config['SLOW_QUERY_LOG_PARAMS'] = os.getenv('SLOW_QUERY_LOG_PARAMS', 'false').lower() == 'true'
+    app.config['IMAGE_STORAGE_DIR'] = os.getenv('IMAGE_STORAGE_DIR', os.path.join(app.instance_path, 'media'))
+    app.config['IMAGE_URL_PREFIX'] = os.getenv('IMAGE_URL_PREFIX', '/media')
+    app.config['IMAGE_SOURCE_ROOT'] = os.getenv('IMAGE_SOURCE_ROOT')
+    app.config['IMAGE_SOURCE_HOSTS'] = os.getenv('IMAGE_SOURCE_HOSTS', '')  # comma-separated
+    app.config['IMAGE_MAX_SOURCE_BYTES'] = int(os.getenv('IMAGE_MAX_SOURCE_BYTES', 20 * 1024 * 1024))
+    app.config['IMAGE_FETCH_TIMEOUT'] = float(os.getenv('IMAGE_FETCH_TIMEOUT', 10))
+    app.config['FRONTEND_URL'] = os.getenv('FRONTEND_URL', 'http://localhost:3000')
+    app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 1))
+    app.config['JOB_POLL_INTERVAL'] = float(os.getenv('JOB_POLL_INTERVAL', 1.0))
+    app.config['JOB_MAX_ATTEMPTS'] = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+    app.config['JOB_RETRY_BACKOFF'] = float(os.getenv('JOB_RETRY_BACKOFF', 10))
+    app.config['JOB_LEASE_SECONDS'] = int(os.getenv('JOB_LEASE_SECONDS', 300))
+    app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER')
+    app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', 587))
+    app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS', 'true').lower() == 'true'
+    app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
+    app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
+    app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER', 'Mishri Boutique <no-reply@mishriboutique.com>')
+    app.config['MAIL_LOG_BODIES'] = os.getenv('MAIL_LOG_BODIES', 'false').lower() == 'true'
+    app.config['PASSWORD_RESET_MAX_AGE'] = int(os.getenv('PASSWORD_RESET_MAX_AGE', 3600))
+    app.config['JSON_BACKEND'] = os.getenv('JSON_BACKEND', 'auto')
+    app.config['JSON_STREAM_THRESHOLD'] = int(os.getenv('JSON_STREAM_THRESHOLD', 1000))
+    app.config['JSON_STREAM_CHUNK'] = int(os.getenv('JSON_STREAM_CHUNK', 500))
+    app.config['DB_AUTO_UPGRADE'] = os.getenv('DB_AUTO_UPGRADE', 'true').lower() == 'true'
+    app.config['CART_MAX_LINES'] = int(os.getenv('CART_MAX_LINES', 100))
+    
+    # Explicit overrides (benchmarks, scripts) win over the environment
+    if config:
+        app.config.update(config)
     
     # Initialize CORS
     CORS(app, resources={
         r"/api/*": {
-            "origins": [os.getenv('FRONTEND_URL', 'http://localhost:3000')],
+            "origins": [app.config['FRONTEND_URL']],
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"]
+            "allow_headers": ["Content-Type", "Authorization", "Idempotency-Key"],
+            "expose_headers": ["X-Next-Cursor", "ETag", "Server-Timing"]
         }
     })
     
-    # Initialize extensions with app
+    # Initialize extensions with app; pool and replica settings must be in
+    # place before db.init_app creates the engines
+    database.configure(app)
     db.init_app(app)
+    database.init_app(app)
+    lifecycle.dispose_engines_after_fork(app)
     jwt.init_app(app)
+    cache.init_app(app)
+    limiter.init_app(app)
 
     # Add a test route
     @app.route('/')
@@ -45,15 +125,33 @@ def create_app():
     with app.app_context():
         # Import routes after db initialization to avoid circular imports
         from .routes import init_routes
+        from . import http_cache, metrics, serializers
+        serializers.init_app(app)
         init_routes(app)
+        # Before http_cache so metrics see the compressed response size
+        metrics.init_app(app)
+        http_cache.init_app(app)
         
-        # Create database tables
-        db.create_all()
+        # Schema changes come from migrations (flask db upgrade)
+        from . import auth, cart, images, inventory, jobs, mail, passwords, points, product_listing, schema
+        schema.init_app(app)
+        product_listing.init_app(app)
+        inventory.init_app(app)
+        passwords.init_app(app)
+        auth.init_app(app)
+        mail.init_app(app)
+        images.init_app(app)
+        points.init_app(app)
+        cart.init_app(app)
+        # Last, so workers only start once every handler is registered
+        jobs.init_app(app)
+        from .catalog_io import catalog_cli
+        app.cli.add_command(catalog_cli)
         
         return app
 
 # Import models after db initialization
-from .models import Category, Product
-from .user import User, UserType
+from .models import CartItem, Category, Job, Order, OrderItem, Product, ProductImage, ProductListing, Reservation
+from .user import PointsEntry, User, UserType
 
-__all__ = ['create_app', 'db', 'jwt', 'User', 'UserType', 'Category', 'Product'] 
\ No newline at end of file
+__all__ = ['create_app', 'db', 'jwt', 'cache', 'limiter', 'User', 'UserType', 'PointsEntry', 'Category', 'Product', 'ProductImage', 'ProductListing', 'Reservation', 'Order', 'OrderItem', 'CartItem', 'Job'] 
\ No newline at end of file
@@ -0,0 +1,399 @@
+"""ASGI serving mode.
+
+    uvicorn asgi:app --workers 4
+
+The hot catalog reads (product detail, featured, category products,
+categories, sizes) are served natively: their queries run on an async
+SQLAlchemy engine, so one worker keeps many of them in flight at once, and
+serialization runs in an executor. Login is native too, so its password
+check awaits the bounded hash pool instead of holding a thread. They execute inside a regular Flask
+request context, so auth, the response cache, ETags, compression, CORS and
+metrics behave exactly as on the WSGI path. Every other request is handed to
+the Flask app on a thread pool.
+
+Needs an ASGI server (e.g. uvicorn), greenlet and the async driver for the
+database (aiosqlite, asyncpg or aiomysql).
+"""
+import asyncio
+import contextvars
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+from flask import current_app, request
+from flask_jwt_extended import get_jwt, verify_jwt_in_request
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from .auth import TIER_PRICES, USER_TYPE_CLAIM, price_tier
+from .database import REPLICA_BIND, apply_sqlite_pragmas, engine_options
+from .http_cache import add_cache_headers, catalog_etag, etag_matches
+from .models import Category, ProductListing, Size
+from .listing import product_serializer
+from .passwords import (HashPoolBusy, dummy_verify_async, hash_password_async, needs_rehash,
+                        verify_password_async)
+from .routes import finish_login, hash_pool_busy, start_login
+from .serializers import encode
+
+# Async drivers used for each database backend
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql',
+    'mariadb': 'mariadb+aiomysql',
+}
+
+
+def async_database_url(url):
+    """The same database as `url`, addressed through its async driver"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError('No async driver known for %s databases' % backend)
+    if backend == 'sqlite' and url.database in (None, '', ':memory:'):
+        raise RuntimeError('ASGI mode needs a database file or server; '
+                           'in-memory SQLite is private to each connection')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def create_async_engine_for(app):
+    """Async engine for the catalog reads, on the replica if one is configured"""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    db = app.extensions['sqlalchemy']
+    with app.app_context():
+        engine = db.engines.get(REPLICA_BIND) or db.engines[None]
+    url = async_database_url(engine.url)
+    options = engine_options(url, app.config)
+    options.pop('connect_args', None)
+    timeout = app.config['DB_STATEMENT_TIMEOUT_MS']
+    if timeout and url.get_backend_name() == 'postgresql':
+        options['connect_args'] = {'server_settings': {'statement_timeout': str(timeout)}}
+    async_engine = create_async_engine(url, **options)
+    apply_sqlite_pragmas(async_engine.sync_engine, app.config)
+    return async_engine
+
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope and its (fully read) body"""
+    root = scope.get('root_path', '')
+    path = scope['path']
+    if root and path.startswith(root):
+        path = path[len(root):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').lower()
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+class TokenNeedsLookup(Exception):
+    """Raised for tokens without a tier claim, which need a DB lookup"""
+
+
+class AsgiApp:
+    """ASGI application wrapping a Flask app created by create_app()"""
+
+    def __init__(self, app):
+        self.app = app
+        app.config.setdefault('ASGI_WSGI_THREADS', 32)
+        self.wsgi_executor = ThreadPoolExecutor(app.config['ASGI_WSGI_THREADS'],
+                                                thread_name_prefix='asgi-wsgi')
+        self.engine = create_async_engine_for(app)
+        self._sessionmaker = None
+        # endpoint -> (handler, whether the response depends on the caller's tier)
+        self.handlers = {
+            'get_product': (self.product_detail, True),
+            'get_featured_products': (self.featured_products, True),
+            'get_category_products': (self.category_products, True),
+            'get_categories': (self.categories, False),
+            'get_sizes': (self.sizes, False),
+            'login': (self.login, False),
+        }
+
+    def session(self):
+        if self._sessionmaker is None:
+            from sqlalchemy.ext.asyncio import async_sessionmaker
+            self._sessionmaker = async_sessionmaker(self.engine, expire_on_commit=False)
+        return self._sessionmaker()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise RuntimeError('Unsupported ASGI scope type: %s' % scope['type'])
+
+        environ = build_environ(scope, await read_body(receive))
+        response = None
+        if scope['method'] in ('GET', 'POST'):
+            response = await self.dispatch(environ)
+        if response is not None:
+            await self.send_response(response, send)
+        else:
+            await self.call_wsgi(environ, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                self.wsgi_executor.shutdown(wait=False)
+                self.app.extensions['password_hash_pool'].shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def dispatch(self, environ):
+        """Serve a native async endpoint, or return None to defer to Flask"""
+        with self.app.request_context(environ):
+            handler, tiered = self.handlers.get(request.endpoint, (None, False))
+            if handler is None:
+                return None
+            try:
+                tier = self.tier() if tiered else None
+            except Exception:
+                # Invalid tokens and old tokens are handled by the Flask view
+                return None
+            # Same error handling as Flask.full_dispatch_request and wsgi_app:
+            # registered error handlers first, then the generic 500
+            try:
+                from_error_handler = False
+                try:
+                    response = self.app.preprocess_request()
+                    if response is None:
+                        response = await handler(tier, **request.view_args)
+                        if response is None:
+                            return None
+                except Exception as e:
+                    response = self.app.handle_user_exception(e)
+                    from_error_handler = True
+                return self.app.finalize_request(response, from_error_handler=from_error_handler)
+            except Exception as e:
+                return self.app.handle_exception(e)
+
+    def tier(self):
+        verify_jwt_in_request(optional=True)
+        claims = get_jwt()
+        if claims and USER_TYPE_CLAIM not in claims:
+            raise TokenNeedsLookup()
+        return price_tier()
+
+    async def run_cpu(self, fn, *args):
+        """Run CPU-bound work in the loop's executor with the request context"""
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(None, context.run, fn, *args)
+
+    def json_response(self, body):
+        return current_app.response_class(body, mimetype=current_app.json.mimetype)
+
+    def dumps(self, data):
+        return encode(data) + b'\n'
+
+    async def cached_body(self, namespaces, tier, generations=None):
+        cache = current_app.extensions['response_cache']
+        if generations is None:
+            generations = await self.run_cpu(cache.generations, namespaces)
+        key = cache.key(namespaces, request.endpoint, tier or 'all', generations)
+        return key, await self.run_cpu(cache.backend.get, key)
+
+    async def store_body(self, key, body):
+        cache = current_app.extensions['response_cache']
+        await self.run_cpu(cache.backend.set, key, body, current_app.config['CACHE_DEFAULT_TIMEOUT'])
+
+    async def catalog_response(self, tier, max_age, namespaces, where, many):
+        """Mirror of @conditional(namespaces=...) over @cache.cached(...) for product views"""
+        serializer = product_serializer(can_view_prices=tier == TIER_PRICES)
+        cache = current_app.extensions['response_cache']
+        generations = await self.run_cpu(cache.generations, namespaces)
+        etag = catalog_etag(tier, generations)
+        if etag_matches(etag):
+            response = current_app.response_class(status=304)
+            add_cache_headers(response, etag, max_age, tier)
+            return response
+
+        key, body = await self.cached_body(namespaces, tier, generations)
+        hit = body is not None
+        if not hit:
+            if await self.run_cpu(cache.settling, namespaces):
+                # Just invalidated and the replica may lag: Flask reads it
+                # from the primary (see ResponseCache.cached)
+                return None
+            statement = serializer.select().where(*where).order_by(ProductListing.product_id)
+            async with self.session() as session:
+                rows = (await session.execute(statement)).all()
+            if not many and not rows:
+                return None
+            body = await self.run_cpu(self._serialize, rows, serializer, many)
+            await self.store_body(key, body)
+
+        response = self.json_response(body)
+        response.headers['X-Cache'] = 'HIT' if hit else 'MISS'
+        add_cache_headers(response, etag, max_age, tier)
+        return response
+
+    def _serialize(self, rows, serializer, many):
+        if many:
+            return self.dumps([serializer.serialize(row) for row in rows])
+        return self.dumps(serializer.serialize(rows[0]))
+
+    async def plain_response(self, max_age, namespaces, statement, to_dict):
+        """Mirror of @conditional() over @cache.cached(...) for small lookup tables"""
+        key, body = await self.cached_body(namespaces, None)
+        hit = body is not None
+        if not hit:
+            if await self.run_cpu(current_app.extensions['response_cache'].settling, namespaces):
+                # As in catalog_response
+                return None
+            async with self.session() as session:
+                rows = (await session.scalars(statement)).all()
+            body = self.dumps([to_dict(row) for row in rows])
+            await self.store_body(key, body)
+
+        response = self.json_response(body)
+        etag = sha1(response.get_data()).hexdigest()
+        if etag_matches(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response.headers['X-Cache'] = 'HIT' if hit else 'MISS'
+        add_cache_headers(response, etag, max_age, None)
+        return response
+
+    async def product_detail(self, tier, product_id):
+        return await self.catalog_response(
+            tier, 60, ['product:%d' % product_id],
+            [ProductListing.product_id == product_id], many=False
+        )
+
+    async def featured_products(self, tier):
+        return await self.catalog_response(
+            tier, 300, ['featured'],
+            [ProductListing.is_featured == True], many=True
+        )
+
+    async def category_products(self, tier, category_id):
+        return await self.catalog_response(
+            tier, 120, ['category:%d' % category_id],
+            [ProductListing.category_id == category_id], many=True
+        )
+
+    async def categories(self, tier):
+        return await self.plain_response(3600, ['categories'], select(Category), lambda c: {
+            'id': c.id,
+            'name': c.name,
+            'description': c.description
+        })
+
+    async def sizes(self, tier):
+        return await self.plain_response(3600, ['sizes'], select(Size), lambda s: s.to_dict())
+
+    async def login(self, tier):
+        """Mirror of the login view that awaits the hash pool's futures"""
+        data = request.get_json()
+        error, user = await self.run_cpu(start_login, data)
+        if error is not None:
+            return error
+        try:
+            if user:
+                future = verify_password_async(user.password_hash, data['password'])
+            else:
+                future = dummy_verify_async(data['password'])
+            valid = await asyncio.wrap_future(future)
+        except HashPoolBusy:
+            return hash_pool_busy()
+
+        new_hash = None
+        if valid and needs_rehash(user.password_hash):
+            try:
+                new_hash = await asyncio.wrap_future(hash_password_async(data['password']))
+            except HashPoolBusy:
+                pass
+        return await self.run_cpu(finish_login, data, user, valid, new_hash)
+
+    async def send_response(self, response, send):
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                        for k, v in response.headers.items()],
+        })
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+    async def call_wsgi(self, environ, send):
+        """Run the Flask app on the thread pool, streaming its body back"""
+        loop = asyncio.get_running_loop()
+        # Calls may land on different threads; sharing one context keeps the
+        # contexts pushed by streamed responses (stream_with_context) intact
+        context = contextvars.Context()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+
+        def call():
+            result = self.app.wsgi_app(environ, start_response)
+            return result, iter(result)
+
+        result, chunks = await loop.run_in_executor(self.wsgi_executor, context.run, call)
+        try:
+            chunk = await loop.run_in_executor(self.wsgi_executor, context.run, next, chunks, None)
+            await send({
+                'type': 'http.response.start',
+                'status': started['status'],
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                            for k, v in started['headers']],
+            })
+            while True:
+                following = None
+                if chunk is not None:
+                    following = await loop.run_in_executor(self.wsgi_executor, context.run, next, chunks, None)
+                await send({'type': 'http.response.body', 'body': chunk or b'',
+                            'more_body': following is not None})
+                if following is None:
+                    break
+                chunk = following
+        finally:
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.wsgi_executor, context.run, result.close)
+
+
+def create_asgi_app(app):
+    return AsgiApp(app)
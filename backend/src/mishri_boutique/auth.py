@@ -0,0 +1,174 @@
+import atexit
+import hashlib
+import threading
+from flask import current_app, g
+from flask_jwt_extended import create_access_token, get_jwt, get_jwt_identity, verify_jwt_in_request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import case
+from . import db
+from .lifecycle import start_in_worker
+from .user import User, UserType
+
+# Price visibility tiers used to key cached catalog responses
+TIER_PUBLIC = 'public'  # BASIC users and anonymous visitors
+TIER_PRICES = 'prices'  # PLUS and PREMIUM users
+
+# JWT claim carrying the user's UserType value
+USER_TYPE_CLAIM = 'user_type'
+
+
+def issue_access_token(user):
+    """Create an access token carrying the user's tier as a claim"""
+    return create_access_token(
+        identity=str(user.id),
+        additional_claims={USER_TYPE_CLAIM: user.user_type.value}
+    )
+
+
+def get_optional_user():
+    """Return the authenticated user if a valid token was sent, else None"""
+    if '_optional_user' not in g:
+        verify_jwt_in_request(optional=True)
+        user_id = get_jwt_identity()
+        g._optional_user = User.query.get(user_id) if user_id else None
+    return g._optional_user
+
+
+def current_tier():
+    """UserType of the caller read from the token claims, None if anonymous.
+
+    Tokens issued before the claim existed fall back to a user lookup. The
+    claim reflects the tier at issue time; routes that change the tier hand
+    out a fresh token.
+    """
+    if '_current_tier' not in g:
+        verify_jwt_in_request(optional=True)
+        claims = get_jwt()
+        if not claims:
+            tier = None
+        elif USER_TYPE_CLAIM in claims:
+            tier = UserType(claims[USER_TYPE_CLAIM])
+        else:
+            user = get_optional_user()
+            tier = user.user_type if user else None
+        g._current_tier = tier
+    return g._current_tier
+
+
+def can_view_prices():
+    tier = current_tier()
+    return bool(tier and tier.can_view_prices)
+
+
+def can_receive_promotions():
+    tier = current_tier()
+    return bool(tier and tier.can_receive_promotions)
+
+
+def price_tier():
+    return TIER_PRICES if can_view_prices() else TIER_PUBLIC
+
+
+def _reset_serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='password-reset')
+
+
+def _password_fingerprint(user):
+    return hashlib.sha256((user.password_hash or '').encode()).hexdigest()[:16]
+
+
+def password_reset_token(user):
+    """Signed token for setting a new password; void once the password changes"""
+    return _reset_serializer().dumps({'id': user.id, 'pw': _password_fingerprint(user)})
+
+
+def user_for_reset_token(token):
+    """User a reset token was issued to, None if it is invalid, expired or used"""
+    try:
+        data = _reset_serializer().loads(token, max_age=current_app.config['PASSWORD_RESET_MAX_AGE'])
+    except BadSignature:
+        return None
+    user = User.query.get(data.get('id'))
+    if user is None or _password_fingerprint(user) != data.get('pw'):
+        return None
+    return user
+
+
+class LastLoginRecorder(threading.Thread):
+    """Buffers last_login timestamps and writes them with one UPDATE.
+
+    Logins only touch memory; the thread flushes every `interval` seconds and
+    once more at exit, so a crash loses at most one interval of timestamps.
+    """
+
+    def __init__(self, app, interval):
+        super().__init__(name='last-login-recorder', daemon=True)
+        self.app = app
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def record(self, user_id, when):
+        with self._lock:
+            self._pending[user_id] = when
+
+    def flush(self):
+        """Write the buffered timestamps in a fresh app context and commit"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        with self.app.app_context():
+            try:
+                write_last_logins(pending)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                with self._lock:
+                    for user_id, when in pending.items():
+                        self._pending.setdefault(user_id, when)
+                raise
+            finally:
+                db.session.remove()
+        return len(pending)
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Flushing last_login timestamps failed')
+
+    def stop(self):
+        self._stopped.set()
+
+
+def write_last_logins(timestamps):
+    """One UPDATE setting last_login for {user_id: datetime}. Does not commit."""
+    User.query.filter(User.id.in_(timestamps)).update(
+        {User.last_login: case(timestamps, value=User.id)}, synchronize_session=False
+    )
+
+
+def record_login(user_id, when):
+    """Note a successful login; written later by the recorder if one runs"""
+    recorder = current_app.extensions.get('last_login_recorder')
+    if recorder is not None:
+        recorder.record(user_id, when)
+    else:
+        write_last_logins({user_id: when})
+        db.session.commit()
+
+
+def init_app(app):
+    app.config.setdefault('LAST_LOGIN_FLUSH_INTERVAL', 10)
+    app.config.setdefault('PASSWORD_RESET_MAX_AGE', 3600)
+    interval = app.config['LAST_LOGIN_FLUSH_INTERVAL']
+    if interval and not app.testing:
+        def start():
+            recorder = LastLoginRecorder(app, interval)
+            recorder.start()
+            atexit.register(recorder.flush)
+            app.extensions['last_login_recorder'] = recorder
+        start_in_worker(app, start)
@@ -0,0 +1,185 @@
+from flask import current_app
+from sqlalchemy import delete, insert, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from . import db
+from .models import CartItem, Product, ProductSize, Size
+from .orders import OrderError, parse_lines
+
+# Per-line outcome of validating a cart
+LINE_OK = 'ok'
+LINE_INSUFFICIENT_STOCK = 'insufficient_stock'  # fewer left than the line asks for
+LINE_UNAVAILABLE = 'unavailable'  # product or size no longer sold
+
+
+def parse_cart(items):
+    """Request items as ({(product_id, size_id): quantity}, {pair: price seen}).
+
+    Items take the same shapes as orders (see orders.parse_lines). The price
+    seen is the line's sale_price or price, when the client sent one, so a
+    change since it was added to the cart can be reported.
+    """
+    if not items:
+        return {}, {}
+    lines = parse_lines(items)
+    if len(lines) > current_app.config['CART_MAX_LINES']:
+        raise OrderError('A cart holds at most %d lines' % current_app.config['CART_MAX_LINES'])
+    seen = {}
+    for item in items:
+        price = item.get('sale_price') or item.get('price')
+        if isinstance(price, (int, float)) and not isinstance(price, bool):
+            size = item.get('size_id', item.get('size'))
+            seen[(int(item.get('product_id', item.get('id'))),
+                  int(size['id'] if isinstance(size, dict) else size))] = price
+    return lines, seen
+
+
+def valid_items(items):
+    """(items parse_cart accepts, number dropped) of a client cart.
+
+    Used where a bad line must not cost the rest of the cart, e.g. a guest
+    cart line added without a size, which is merged at sign-in.
+    """
+    if not isinstance(items, list):
+        return [], 0
+    valid = []
+    for item in items:
+        try:
+            parse_cart([item])
+        except (OrderError, AttributeError):
+            continue
+        valid.append(item)
+    return valid, len(items) - len(valid)
+
+
+def line_rows(pairs):
+    """Stock, size name and product fields of every (product_id, size_id) in one query"""
+    if not pairs:
+        return {}
+    return {
+        (row.product_id, row.size_id): row for row in db.session.execute(
+            select(ProductSize.product_id, ProductSize.size_id, ProductSize.stock,
+                   Size.name.label('size_name'), Product.name, Product.price, Product.sale_price,
+                   Product.images)
+            .join(Product, Product.id == ProductSize.product_id)
+            .join(Size, Size.id == ProductSize.size_id)
+            .where(tuple_(ProductSize.product_id, ProductSize.size_id).in_(list(pairs)))
+        )
+    }
+
+
+def cart_view(lines, rows, can_view_prices, seen=None):
+    """Check every line against `rows` (from line_rows) and describe the cart.
+
+    Prices, the subtotal and price changes are only included when the
+    caller may see prices.
+    """
+    seen = seen or {}
+    items = []
+    subtotal = 0
+    for (product_id, size_id), quantity in lines.items():
+        row = rows.get((product_id, size_id))
+        item = {'product_id': product_id, 'size_id': size_id, 'quantity': quantity}
+        if row is None:
+            item['status'] = LINE_UNAVAILABLE
+            items.append(item)
+            continue
+        stock = row.stock or 0
+        item.update({
+            'name': row.name,
+            'size': row.size_name,
+            'image': row.images[0] if row.images else None,
+            'stock': stock,
+            'status': LINE_OK if stock >= quantity else LINE_INSUFFICIENT_STOCK
+        })
+        if can_view_prices:
+            unit_price = row.price if row.sale_price is None else row.sale_price
+            item.update({'price': row.price, 'sale_price': row.sale_price, 'unit_price': unit_price})
+            if (product_id, size_id) in seen:
+                item['price_changed'] = seen[(product_id, size_id)] != unit_price
+            subtotal += unit_price * quantity
+        items.append(item)
+
+    view = {'items': items, 'valid': all(item['status'] == LINE_OK for item in items)}
+    if can_view_prices:
+        view['subtotal'] = round(subtotal, 2)
+    return view
+
+
+def load_cart(user_id):
+    """The user's saved cart as {(product_id, size_id): quantity}, oldest line first"""
+    return {
+        (product_id, size_id): quantity for product_id, size_id, quantity in db.session.execute(
+            select(CartItem.product_id, CartItem.size_id, CartItem.quantity)
+            .where(CartItem.user_id == user_id).order_by(CartItem.id)
+        )
+    }
+
+
+def replace_cart(user_id, lines):
+    """Make the saved cart exactly `lines`; lines for sizes no longer sold are dropped.
+
+    Returns (lines, rows) as stored, for cart_view. Does not commit.
+    """
+    rows = line_rows(lines)
+    lines = {pair: quantity for pair, quantity in lines.items() if pair in rows}
+    db.session.execute(delete(CartItem).where(CartItem.user_id == user_id))
+    if lines:
+        db.session.execute(insert(CartItem), [
+            {'user_id': user_id, 'product_id': product_id, 'size_id': size_id, 'quantity': quantity}
+            for (product_id, size_id), quantity in lines.items()
+        ])
+    return lines, rows
+
+
+def merge_cart(user_id, lines):
+    """Fold a guest cart into the saved one, e.g. when signing in.
+
+    A line in both keeps the larger quantity, so merging the same guest cart
+    twice changes nothing; guest lines for sizes no longer sold are dropped.
+    Writes with one executemany UPDATE and one INSERT at most. Returns
+    (lines, rows) of the merged cart. Commits.
+    """
+    for attempt in range(2):
+        saved = {(row.product_id, row.size_id): row for row in db.session.execute(
+            select(CartItem.id, CartItem.product_id, CartItem.size_id, CartItem.quantity)
+            .where(CartItem.user_id == user_id).order_by(CartItem.id)
+        )}
+        rows = line_rows(set(saved) | set(lines))
+        changed = {pair: quantity for pair, quantity in lines.items()
+                   if pair in saved and quantity > saved[pair].quantity}
+        added = {pair: quantity for pair, quantity in lines.items() if pair in rows and pair not in saved}
+        try:
+            if changed:
+                db.session.execute(update(CartItem), [
+                    {'id': saved[pair].id, 'quantity': quantity} for pair, quantity in changed.items()
+                ])
+            if added:
+                db.session.execute(insert(CartItem), [
+                    {'user_id': user_id, 'product_id': product_id, 'size_id': size_id, 'quantity': quantity}
+                    for (product_id, size_id), quantity in added.items()
+                ])
+            db.session.commit()
+            break
+        except IntegrityError:
+            # Another sign-in merged the same lines first; read them and retry
+            db.session.rollback()
+            if attempt:
+                raise
+    merged = {pair: row.quantity for pair, row in saved.items()}
+    merged.update(changed)
+    merged.update(added)
+    return merged, rows
+
+
+def remove_lines(user_id, pairs=None):
+    """Delete the given lines (all by default) from the saved cart. Does not commit."""
+    statement = delete(CartItem).where(CartItem.user_id == user_id)
+    if pairs is not None:
+        if not pairs:
+            return
+        statement = statement.where(tuple_(CartItem.product_id, CartItem.size_id).in_(list(pairs)))
+    db.session.execute(statement)
+
+
+def init_app(app):
+    app.config.setdefault('CART_MAX_LINES', 100)
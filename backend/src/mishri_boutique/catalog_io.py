@@ -0,0 +1,298 @@
+import csv
+import json
+from datetime import datetime
+from itertools import islice
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import insert
+from . import db
+from .jobs import enqueue
+from .models import Category, Product, ProductSize, Size
+from .product_listing import mark_stale
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_BATCH_SIZE = 5000
+
+# Plain text columns copied as-is from an import row
+TEXT_FIELDS = ('description', 'fabric', 'style', 'occasion', 'sleeve_type', 'neck_type')
+
+FORMATS = ('jsonl', 'csv')
+
+
+class RowError(ValueError):
+    """Raised for an import row that can't be loaded"""
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, dict) pairs from a text stream without reading it all"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_num, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_num, json.loads(line)
+            except ValueError:
+                yield line_num, RowError('Invalid JSON')
+    else:
+        raise ValueError('Unknown format: %s' % fmt)
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def _parse_images(value):
+    # CSV cells hold "url1|url2"; JSONL rows hold a list
+    if not value:
+        return []
+    if isinstance(value, list):
+        return value
+    return [v.strip() for v in str(value).split('|') if v.strip()]
+
+
+def _parse_sizes(value):
+    # CSV cells hold "S:5|M:3"; JSONL rows hold [{"size": "S", "stock": 5}, ...]
+    if not value:
+        return []
+    if isinstance(value, list):
+        if not all(isinstance(s, dict) for s in value):
+            raise RowError('Sizes must be objects with a size and stock')
+        return [(s.get('size_id', s.get('size')), s.get('stock', 0)) for s in value]
+    pairs = []
+    for part in str(value).split('|'):
+        if part.strip():
+            size, _, stock = part.partition(':')
+            pairs.append((size.strip(), stock.strip() or 0))
+    return pairs
+
+
+def _optional_float(value):
+    return float(value) if value not in (None, '') else None
+
+
+class CatalogMaps:
+    """Categories and sizes preloaded once, looked up by id or name"""
+
+    def __init__(self):
+        self.categories = {}
+        for category in Category.query.all():
+            self.categories[category.id] = category.id
+            self.categories[str(category.id)] = category.id
+            self.categories[category.name.lower()] = category.id
+        self.sizes = {}
+        for size in Size.query.all():
+            self.sizes[size.id] = size.id
+            self.sizes[str(size.id)] = size.id
+            self.sizes[size.name.lower()] = size.id
+
+    def category_id(self, value):
+        key = value.lower() if isinstance(value, str) else value
+        if key not in self.categories:
+            raise RowError('Unknown category: %s' % value)
+        return self.categories[key]
+
+    def size_id(self, value):
+        key = value.lower() if isinstance(value, str) else value
+        if key not in self.sizes:
+            raise RowError('Unknown size: %s' % value)
+        return self.sizes[key]
+
+
+def build_row(row, maps, now):
+    """Validate one import row into (product values, [(size_id, stock)])"""
+    if isinstance(row, Exception):
+        raise row
+    if not isinstance(row, dict):
+        raise RowError('Row must be an object')
+    try:
+        return _build_row(row, maps, now)
+    except RowError:
+        raise
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        # A field of the wrong type (e.g. a number where a list belongs)
+        raise RowError('Invalid row: %s' % e)
+
+
+def _build_row(row, maps, now):
+    name = row.get('name')
+    name = name.strip() if isinstance(name, str) else ''
+    if not name:
+        raise RowError('Missing name')
+    try:
+        price = float(row['price'])
+        sale_price = _optional_float(row.get('sale_price'))
+    except (KeyError, TypeError, ValueError):
+        raise RowError('Missing or invalid price')
+    category = row.get('category_id') or row.get('category')
+    if category in (None, ''):
+        raise RowError('Missing category')
+    if isinstance(category, (dict, list)):
+        raise RowError('Invalid category')
+
+    sizes = {}
+    for size, stock in _parse_sizes(row.get('sizes')):
+        if not isinstance(size, (int, str)):
+            raise RowError('Invalid size: %s' % size)
+        try:
+            stock = max(0, int(stock))
+        except (TypeError, ValueError):
+            raise RowError('Invalid stock for size %s' % size)
+        size_id = maps.size_id(size)
+        sizes[size_id] = sizes.get(size_id, 0) + stock
+
+    images = _parse_images(row.get('images'))
+    if not all(isinstance(image, str) for image in images):
+        raise RowError('Images must be URLs')
+    values = {
+        'name': name,
+        'price': price,
+        'sale_price': sale_price,
+        'images': images,
+        'is_featured': _parse_bool(row.get('is_featured')),
+        'category_id': maps.category_id(category),
+        'stock': sum(sizes.values()),
+        'created_at': now,
+        'updated_at': now,
+    }
+    for field in TEXT_FIELDS:
+        value = row.get(field)
+        if isinstance(value, (dict, list)):
+            raise RowError('Invalid %s' % field)
+        values[field] = str(value) if value not in (None, '') else None
+    return values, list(sizes.items())
+
+
+def _insert_batch(batch):
+    # Bulk INSERT ... RETURNING keeps ids in parameter order, so sizes can be
+    # attached without a lookup per product
+    ids = db.session.scalars(
+        insert(Product).returning(Product.id, sort_by_parameter_order=True),
+        [values for values, _ in batch]
+    ).all()
+    size_rows = [{'product_id': product_id, 'size_id': size_id, 'stock': stock}
+                 for product_id, (_, sizes) in zip(ids, batch)
+                 for size_id, stock in sizes]
+    if size_rows:
+        db.session.execute(insert(ProductSize), size_rows)
+    mark_stale(ids)
+
+
+def import_products(rows, batch_size=DEFAULT_BATCH_SIZE):
+    """Load products from (line number, row) pairs in batched transactions.
+
+    Invalid rows are skipped and reported; each batch of valid rows is
+    inserted with one statement per table and committed on its own.
+    Returns {'imported': n, 'errors': [{'line': n, 'error': msg}, ...]}.
+    """
+    maps = CatalogMaps()
+    report = {'imported': 0, 'errors': []}
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            break
+        now = datetime.utcnow()
+        batch = []
+        for line_num, row in chunk:
+            try:
+                batch.append(build_row(row, maps, now))
+            except RowError as e:
+                report['errors'].append({'line': line_num, 'error': str(e)})
+        if not batch:
+            continue
+        try:
+            _insert_batch(batch)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            first, last = chunk[0][0], chunk[-1][0]
+            # The database error names tables and constraints; keep it in the log
+            current_app.logger.exception('Import batch of lines %d-%d failed', first, last)
+            report['errors'].append({'line': first, 'error': 'Batch ending at line %d could not be saved' % last})
+            continue
+        report['imported'] += len(batch)
+
+    if report['imported']:
+        enqueue('search.optimize', key='search.optimize')
+        db.session.commit()
+    return report
+
+
+def export_products(batch_size=DEFAULT_BATCH_SIZE, include_prices=True):
+    """Yield the catalog as JSON lines in the import format.
+
+    Products are read in keyset-ordered batches, each with one query for its
+    sizes, so memory use stays flat however large the catalog is. Without
+    `include_prices`, price and sale_price are null, as for callers that
+    may not view prices.
+    """
+    category_names = dict(db.session.query(Category.id, Category.name))
+    size_names = dict(db.session.query(Size.id, Size.name))
+    columns = [Product.id, Product.name, Product.price, Product.sale_price, Product.images,
+               Product.is_featured, Product.category_id] + [getattr(Product, f) for f in TEXT_FIELDS]
+    last_id = 0
+    while True:
+        products = (db.session.query(*columns)
+                    .filter(Product.id > last_id)
+                    .order_by(Product.id)
+                    .limit(batch_size).all())
+        if not products:
+            break
+        ids = [p.id for p in products]
+        sizes = {}
+        for product_id, size_id, stock in (db.session.query(
+                ProductSize.product_id, ProductSize.size_id, ProductSize.stock)
+                .filter(ProductSize.product_id.in_(ids))
+                .order_by(ProductSize.product_id, ProductSize.size_id)):
+            sizes.setdefault(product_id, []).append({'size': size_names[size_id], 'stock': stock})
+        for p in products:
+            row = {
+                'id': p.id,
+                'name': p.name,
+                'price': p.price if include_prices else None,
+                'sale_price': p.sale_price if include_prices else None,
+                'images': p.images or [],
+                'is_featured': p.is_featured,
+                'category': category_names.get(p.category_id),
+                'sizes': sizes.get(p.id, []),
+            }
+            for field in TEXT_FIELDS:
+                row[field] = getattr(p, field)
+            yield json.dumps(row) + '\n'
+        last_id = ids[-1]
+
+
+catalog_cli = AppGroup('catalog', help='Bulk catalog import and export.')
+
+
+@catalog_cli.command('import')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None,
+              help='Input format; guessed from the file extension by default.')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+              type=click.IntRange(1, MAX_BATCH_SIZE))
+def import_command(source, fmt, batch_size):
+    """Import products from a CSV or JSONL file ('-' for stdin)."""
+    fmt = fmt or ('csv' if source.name.endswith('.csv') else 'jsonl')
+    report = import_products(read_rows(source, fmt), batch_size=batch_size)
+    for error in report['errors']:
+        click.echo('line %(line)d: %(error)s' % error, err=True)
+    click.echo('Imported %d products, %d rows rejected' % (report['imported'], len(report['errors'])))
+
+
+@catalog_cli.command('export')
+@click.argument('target', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+              type=click.IntRange(1, MAX_BATCH_SIZE))
+def export_command(target, batch_size):
+    """Export the catalog as JSONL ('-' for stdout)."""
+    for line in export_products(batch_size=batch_size):
+        target.write(line)
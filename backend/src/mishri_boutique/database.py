@@ -0,0 +1,132 @@
+from functools import wraps
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql import CompoundSelect, Select
+from .serializers import engine_json_options
+
+# Bind key of the optional read replica (DATABASE_REPLICA_URL)
+REPLICA_BIND = 'replica'
+
+
+def engine_options(url, config):
+    """SQLAlchemy engine options for `url` built from the DB_* settings.
+
+    Pool sizing and statement timeouts only apply to server databases;
+    SQLite is tuned with pragmas on connect instead (see init_app). JSON
+    columns are coded with JSON_BACKEND.
+    """
+    url = make_url(url)
+    options = {'pool_pre_ping': config['DB_POOL_PRE_PING']}
+    options.update(engine_json_options(config.get('JSON_BACKEND', 'auto')))
+    backend = url.get_backend_name()
+    if backend == 'sqlite':
+        return options
+
+    options.update({
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    })
+    timeout = config['DB_STATEMENT_TIMEOUT_MS']
+    if timeout and backend == 'postgresql':
+        options['connect_args'] = {'options': '-c statement_timeout=%d' % timeout}
+    elif timeout and backend in ('mysql', 'mariadb'):
+        options['connect_args'] = {'init_command': 'SET SESSION max_execution_time=%d' % timeout}
+    return options
+
+
+def sqlite_pragmas(config):
+    return [
+        ('journal_mode', config['SQLITE_JOURNAL_MODE']),
+        ('synchronous', config['SQLITE_SYNCHRONOUS']),
+        ('mmap_size', int(config['SQLITE_MMAP_SIZE'])),
+        ('busy_timeout', int(config['SQLITE_BUSY_TIMEOUT_MS'])),
+    ]
+
+
+def _set_pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute('PRAGMA %s=%s' % (name, value))
+        finally:
+            cursor.close()
+    return on_connect
+
+
+def apply_sqlite_pragmas(engine, config):
+    """Set the SQLITE_* pragmas on each new connection if `engine` is SQLite"""
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', _set_pragmas(sqlite_pragmas(config)))
+
+
+class RoutingSession(Session):
+    """Session sending plain SELECTs to the replica inside read_replica views.
+
+    Flushes and UPDATE/INSERT/DELETE statements always go to the primary, so
+    a replica-routed view that happens to write still writes to the primary.
+    Without a replica bind configured everything uses the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and isinstance(clause, (Select, CompoundSelect))
+                and has_app_context() and g.get('use_replica')):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_replica(f):
+    """Mark a read-only view whose queries may be served by the replica.
+
+    Replicas lag the primary slightly, so only use this on catalog reads
+    where a just-written change showing up a moment later is acceptable.
+    Place it directly under @app.route so the view and every decorator below
+    it read from the replica.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        g.use_replica = True
+        return f(*args, **kwargs)
+    return wrapper
+
+
+def configure(app):
+    """Fill in engine options and the replica bind; call before db.init_app"""
+    config = app.config
+    config.setdefault('DB_POOL_SIZE', 10)
+    config.setdefault('DB_MAX_OVERFLOW', 20)
+    config.setdefault('DB_POOL_TIMEOUT', 30)
+    config.setdefault('DB_POOL_RECYCLE', 1800)
+    config.setdefault('DB_POOL_PRE_PING', True)
+    config.setdefault('DB_STATEMENT_TIMEOUT_MS', 0)
+    config.setdefault('DATABASE_REPLICA_URL', None)
+    config.setdefault('SQLITE_JOURNAL_MODE', 'WAL')
+    config.setdefault('SQLITE_SYNCHRONOUS', 'NORMAL')
+    config.setdefault('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+    config.setdefault('SQLITE_BUSY_TIMEOUT_MS', 5000)
+
+    # Explicitly configured options win over the computed ones
+    options = engine_options(config['SQLALCHEMY_DATABASE_URI'], config)
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    replica_url = config['DATABASE_REPLICA_URL']
+    if replica_url:
+        binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+        binds.setdefault(REPLICA_BIND, dict(engine_options(replica_url, config), url=replica_url))
+        config['SQLALCHEMY_BINDS'] = binds
+
+
+def init_app(app):
+    """Apply the SQLite pragmas to every SQLite engine; call after db.init_app"""
+    db = app.extensions['sqlalchemy']
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        apply_sqlite_pragmas(engine, app.config)
@@ -0,0 +1,107 @@
+from sqlalchemy import case, func, literal, select, union_all
+from . import db
+from .models import Product, ProductListing, ProductSize, Size
+
+# Product columns that can be filtered on and counted
+FACET_COLUMNS = {
+    'fabric': Product.fabric,
+    'style': Product.style,
+    'occasion': Product.occasion,
+    'sleeve_type': Product.sleeve_type,
+    'neck_type': Product.neck_type,
+}
+
+# Price buckets shown in the filter panel as (label, upper bound); the last
+# bucket is open ended
+PRICE_BUCKETS = [
+    ('0-500', 500),
+    ('501-1000', 1000),
+    ('1001-2000', 2000),
+    ('2001-3000', 3000),
+    ('3001+', None),
+]
+
+
+def _values(args, name):
+    # Accept both ?fabric=Silk,Cotton and ?fabric=Silk&fabric=Cotton
+    values = []
+    for raw in args.getlist(name):
+        values.extend(v.strip() for v in raw.split(',') if v.strip())
+    return values
+
+
+def parse_filters(args):
+    """Read facet filters from request args into a plain dict"""
+    filters = {}
+    for name in FACET_COLUMNS:
+        values = _values(args, name)
+        if values:
+            filters[name] = values
+    sizes = _values(args, 'size')
+    if sizes:
+        filters['size'] = sizes
+    min_price = args.get('min_price', type=float)
+    max_price = args.get('max_price', type=float)
+    if min_price is not None:
+        filters['min_price'] = min_price
+    if max_price is not None:
+        filters['max_price'] = max_price
+    return filters
+
+
+def filter_criteria(filters, exclude=None, source=Product):
+    """Translate parsed filters into SQL criteria on Product (or ProductListing).
+
+    Values within one facet are OR-ed, facets are AND-ed. `exclude` drops one
+    facet, which is how facet counts stay disjunctive (selecting Silk still
+    shows how many Cotton products there are).
+    """
+    criteria = []
+    for name in FACET_COLUMNS:
+        if name != exclude and name in filters:
+            criteria.append(getattr(source, name).in_(filters[name]))
+    if exclude != 'size' and 'size' in filters:
+        # Resolve the names to ids first so the lookup can use
+        # ix_product_sizes_size_product instead of scanning product_sizes
+        size_ids = select(Size.id).where(Size.name.in_(filters['size']))
+        sized = select(ProductSize.product_id).where(ProductSize.size_id.in_(size_ids))
+        product_id = ProductListing.product_id if source is ProductListing else Product.id
+        criteria.append(product_id.in_(sized))
+    if exclude != 'price':
+        if 'min_price' in filters:
+            criteria.append(source.price >= filters['min_price'])
+        if 'max_price' in filters:
+            criteria.append(source.price <= filters['max_price'])
+    return criteria
+
+
+def price_bucket():
+    whens = [(Product.price <= upper, label) for label, upper in PRICE_BUCKETS if upper is not None]
+    return case(*whens, else_=PRICE_BUCKETS[-1][0])
+
+
+def facet_counts(filters, base_criteria=()):
+    """Count matching products per facet value in a single UNION ALL query.
+
+    Returns {'fabric': {'Silk': 3, ...}, 'size': {...}, 'price': {...}}.
+    """
+    def grouped(name, value, *joins):
+        stmt = select(literal(name).label('facet'), value.label('value'),
+                      func.count(func.distinct(Product.id)).label('count'))
+        stmt = stmt.select_from(Product)
+        for target, onclause in joins:
+            stmt = stmt.join(target, onclause)
+        for criterion in list(base_criteria) + filter_criteria(filters, exclude=name):
+            stmt = stmt.where(criterion)
+        return stmt.where(value.isnot(None)).group_by(value)
+
+    selects = [grouped(name, column) for name, column in FACET_COLUMNS.items()]
+    selects.append(grouped('size', Size.name,
+                           (ProductSize, ProductSize.product_id == Product.id),
+                           (Size, Size.id == ProductSize.size_id)))
+    selects.append(grouped('price', price_bucket()))
+
+    counts = {name: {} for name in list(FACET_COLUMNS) + ['size', 'price']}
+    for facet, value, count in db.session.execute(union_all(*selects)):
+        counts[facet][value] = count
+    return counts
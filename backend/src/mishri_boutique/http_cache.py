@@ -0,0 +1,123 @@
+import gzip
+from functools import wraps
+from hashlib import sha1
+from flask import current_app, request
+from .auth import TIER_PRICES
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Suffixes added to the ETag of compressed representations, since a strong
+# validator must differ between encodings of the same resource
+ENCODING_SUFFIXES = {'br': '-br', 'gzip': '-gz'}
+
+
+def catalog_etag(caller_tier, version):
+    """ETag of the current request's response for a given catalog version"""
+    return sha1(repr((request.endpoint, sorted(request.args.items(multi=True)),
+                      caller_tier, version)).encode()).hexdigest()
+
+
+def _strip_encoding(etag):
+    for suffix in ENCODING_SUFFIXES.values():
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)]
+    return etag
+
+
+def etag_matches(etag):
+    return any(_strip_encoding(tag) == etag for tag in request.if_none_match.as_set()) \
+        or request.if_none_match.star_tag
+
+
+def conditional(max_age, namespaces=None, tier=None):
+    """Decorator adding a strong ETag and Cache-Control to a GET view.
+
+    When `namespaces` is given it receives the view kwargs and returns the
+    response cache namespaces the response depends on; the ETag is then
+    derived from their generations, which every listing change bumps, so a
+    matching If-None-Match is answered with 304 without touching the
+    database. Without `namespaces` the ETag is a hash of the response body.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            caller_tier = tier() if tier else None
+            etag = None
+            if namespaces is not None:
+                cache = current_app.extensions['response_cache']
+                etag = catalog_etag(caller_tier, cache.generations(namespaces(**kwargs)))
+                if etag_matches(etag):
+                    response = current_app.response_class(status=304)
+                    add_cache_headers(response, etag, max_age, caller_tier)
+                    return response
+
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            if etag is None:
+                etag = sha1(response.get_data()).hexdigest()
+                if etag_matches(etag):
+                    response = current_app.response_class(status=304)
+            add_cache_headers(response, etag, max_age, caller_tier)
+            return response
+        return wrapper
+    return decorator
+
+
+def add_cache_headers(response, etag, max_age, caller_tier):
+    response.set_etag(etag)
+    if caller_tier is not None:
+        response.vary.add('Authorization')
+    if caller_tier == TIER_PRICES:
+        # Prices are only for signed-in PLUS/PREMIUM users; keep them out of shared caches
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    response.cache_control.max_age = max_age
+
+
+def _negotiate_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    """after_request hook compressing large JSON bodies with br or gzip"""
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or response.direct_passthrough
+            or response.is_streamed or 'Content-Encoding' in response.headers
+            or response.mimetype != 'application/json'):
+        return response
+
+    data = response.get_data()
+    if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+    encoding = _negotiate_encoding()
+    if encoding is None:
+        return response
+
+    level = current_app.config['COMPRESS_LEVEL']
+    if encoding == 'br':
+        data = brotli.compress(data, quality=min(level, 11))
+    else:
+        data = gzip.compress(data, compresslevel=min(level, 9))
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(etag + ENCODING_SUFFIXES[encoding], weak)
+    return response
+
+
+def init_app(app):
+    app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+    app.config.setdefault('COMPRESS_LEVEL', 6)
+    app.after_request(compress_response)
@@ -0,0 +1,394 @@
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import socket
+import ssl
+import tempfile
+from datetime import datetime
+from urllib.parse import urljoin, urlsplit
+import click
+from flask import current_app, send_from_directory
+from flask.cli import AppGroup
+from werkzeug.security import safe_join
+from . import db
+from .jobs import enqueue, job
+from .models import Product, ProductImage
+
+# (name, target width) of every derivative; never upscaled
+VARIANTS = (('thumb', 160), ('card', 480), ('detail', 1200))
+
+# (extension, Pillow format, save options) of every derivative
+FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+# Part of the content address, so changing VARIANTS or FORMATS yields new
+# URLs instead of serving stale files under the immutable old ones
+PIPELINE_VERSION = 'v1:' + repr((VARIANTS, FORMATS))
+
+# 1 year; derivative URLs never change content
+MEDIA_MAX_AGE = 31536000
+
+# Redirects followed when downloading a source image
+MAX_REDIRECTS = 3
+
+
+class ImageError(Exception):
+    """Raised when a source image can't be fetched or decoded"""
+
+
+def variant_widths(width):
+    """Widths actually generated for a source `width` pixels wide"""
+    widths = []
+    for name, target in VARIANTS:
+        actual = min(target, width)
+        if actual not in [w for _, w in widths]:
+            widths.append((name, actual))
+    return widths
+
+
+def _relative_path(digest, name, ext):
+    return '%s/%s/%s.%s' % (digest[:2], digest, name, ext)
+
+
+def media_url(digest, name, ext):
+    return '%s/%s' % (current_app.config['IMAGE_URL_PREFIX'], _relative_path(digest, name, ext))
+
+
+def image_variants(urls, assets):
+    """Responsive variants of each URL in `urls` (a product's images).
+
+    `assets` are the product's ProductImage rows. Returns a list parallel to
+    `urls`: {'src', 'width', 'height', 'srcset': {'webp', 'jpeg'}} for
+    processed images, None where derivatives aren't ready (the raw URL is
+    still there to fall back on).
+    """
+    by_position = {a.position: a for a in assets}
+    variants = []
+    for position, url in enumerate(urls or []):
+        asset = by_position.get(position)
+        if asset is None or asset.status != ProductImage.READY or asset.source_url != url:
+            variants.append(None)
+            continue
+        widths = variant_widths(asset.width)
+        # Small sources collapse variants; fall back to the largest one kept
+        src = 'card' if 'card' in dict(widths) else widths[-1][0]
+        variants.append({
+            'src': media_url(asset.digest, src, 'jpg'),
+            'width': asset.width,
+            'height': asset.height,
+            'srcset': {
+                'webp': ', '.join('%s %dw' % (media_url(asset.digest, name, 'webp'), w) for name, w in widths),
+                'jpeg': ', '.join('%s %dw' % (media_url(asset.digest, name, 'jpg'), w) for name, w in widths),
+            },
+        })
+    return variants
+
+
+def sync_product_images(product):
+    """Make product.image_assets follow product.images.
+
+    Entries whose URL changed are reset to pending; returns True if any image
+    needs processing. Does not commit.
+    """
+    existing = {asset.position: asset for asset in product.image_assets}
+    changed = False
+    for position, url in enumerate(product.images or []):
+        asset = existing.pop(position, None)
+        if asset is None:
+            product.image_assets.append(ProductImage(position=position, source_url=url))
+            changed = True
+        elif asset.source_url != url:
+            asset.source_url = url
+            asset.status = ProductImage.PENDING
+            asset.digest = asset.width = asset.height = asset.error = None
+            changed = True
+    for asset in existing.values():
+        product.image_assets.remove(asset)
+    return changed
+
+
+def _allowed_hosts():
+    hosts = current_app.config['IMAGE_SOURCE_HOSTS'] or ()
+    if isinstance(hosts, str):
+        hosts = hosts.split(',')
+    return {host.strip().lower() for host in hosts if host.strip()}
+
+
+def _public_address(host, port):
+    """An address of `host` to connect to; refuses hosts resolving to internal ones"""
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except OSError as e:
+        raise ImageError('Resolving %s failed: %s' % (host, e))
+    addresses = []
+    for _, _, _, _, sockaddr in infos:
+        address = ipaddress.ip_address(sockaddr[0].split('%')[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        # Covers private, loopback, link-local, reserved and unspecified ranges
+        if not address.is_global or address.is_multicast:
+            raise ImageError('%s resolves to a non-public address' % host)
+        addresses.append(str(address))
+    if not addresses:
+        raise ImageError('Resolving %s failed' % host)
+    return addresses[0]
+
+
+class _PinnedHTTPConnection(http.client.HTTPConnection):
+    """Connects to an address vetted by _public_address, so the host can't be
+    re-resolved to another one between the check and the request"""
+
+    def __init__(self, host, port, address, timeout):
+        super().__init__(host, port, timeout=timeout)
+        self.address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self.address, self.port), self.timeout)
+
+
+class _PinnedHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, host, port, address, timeout):
+        super().__init__(host, port, timeout=timeout, context=ssl.create_default_context())
+        self.address = address
+
+    def connect(self):
+        sock = socket.create_connection((self.address, self.port), self.timeout)
+        # The certificate is still checked against the host name
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+def _download(url, limit):
+    allowed = _allowed_hosts()
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        host = (parts.hostname or '').lower()
+        if host not in allowed:
+            raise ImageError('%s is not on an allowed image host (IMAGE_SOURCE_HOSTS)' % url)
+        try:
+            port = parts.port or (443 if parts.scheme == 'https' else 80)
+        except ValueError:
+            raise ImageError('Invalid port in %s' % url)
+        connection_class = _PinnedHTTPSConnection if parts.scheme == 'https' else _PinnedHTTPConnection
+        connection = connection_class(host, port, _public_address(host, port),
+                                      current_app.config['IMAGE_FETCH_TIMEOUT'])
+        try:
+            connection.request('GET', (parts.path or '/') + ('?' + parts.query if parts.query else ''))
+            response = connection.getresponse()
+            if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+                # Followed by hand so every hop is checked like the first
+                url = urljoin(url, response.getheader('Location'))
+                continue
+            if response.status != 200:
+                raise ImageError('Fetching %s failed: HTTP %d' % (url, response.status))
+            return response.read(limit + 1)
+        except (OSError, http.client.HTTPException) as e:
+            raise ImageError('Fetching %s failed: %s' % (url, e))
+        finally:
+            connection.close()
+    raise ImageError('Too many redirects fetching %s' % url)
+
+
+def fetch_source(url):
+    """Bytes of a source image.
+
+    http(s) URLs are only downloaded from IMAGE_SOURCE_HOSTS and never from
+    hosts resolving to private, loopback or link-local addresses, redirects
+    included; other paths are read from under IMAGE_SOURCE_ROOT.
+    """
+    limit = current_app.config['IMAGE_MAX_SOURCE_BYTES']
+    if url.startswith(('http://', 'https://')):
+        data = _download(url, limit)
+    else:
+        root = current_app.config['IMAGE_SOURCE_ROOT']
+        path = safe_join(root, url.lstrip('/')) if root else None
+        # realpath so a symlink can't lead out of the root either
+        if path is not None and not os.path.realpath(path).startswith(os.path.realpath(root) + os.sep):
+            path = None
+        if path is None or not os.path.isfile(path):
+            raise ImageError('No source file for %s' % url)
+        with open(path, 'rb') as f:
+            data = f.read(limit + 1)
+    if len(data) > limit:
+        raise ImageError('Source image larger than %d bytes' % limit)
+    return data
+
+
+def _write_atomic(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def store_derivatives(data):
+    """Generate every variant of the source image `data`.
+
+    Files are stored under their content address, so an image shared by
+    several products (or re-uploaded) is only processed once. Returns
+    (digest, width, height) of the oriented source.
+    """
+    try:
+        # Imported here: only processes generating derivatives need Pillow
+        from PIL import Image, ImageOps
+    except ImportError:
+        raise ImageError('Generating image derivatives requires Pillow')
+    digest = hashlib.sha256(PIPELINE_VERSION.encode() + b'\0' + data).hexdigest()
+    storage = current_app.config['IMAGE_STORAGE_DIR']
+    try:
+        source = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+        width, height = source.size
+        done = os.path.join(storage, _relative_path(digest, 'detail', 'done'))
+        if os.path.exists(done):
+            return digest, width, height
+        if source.mode not in ('RGB', 'RGBA'):
+            source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+        for name, target in variant_widths(width):
+            resized = source.copy()
+            resized.thumbnail((target, height), Image.LANCZOS)
+            flat = resized
+            if resized.mode == 'RGBA':
+                # JPEG has no alpha; composite on white
+                flat = Image.new('RGB', resized.size, (255, 255, 255))
+                flat.paste(resized, mask=resized.split()[3])
+            for ext, fmt, options in FORMATS:
+                out = io.BytesIO()
+                (resized if fmt == 'WEBP' else flat).save(out, fmt, **options)
+                _write_atomic(os.path.join(storage, _relative_path(digest, name, ext)), out.getvalue())
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageError('Could not process image: %s' % e)
+    # Marker written last so a crash mid-way is redone on the next attempt
+    _write_atomic(done, b'')
+    return digest, width, height
+
+
+def process_product_images(product_id):
+    """Generate derivatives for the product's pending images and commit.
+
+    Each row is only updated while it still points at the URL that was
+    processed, so an edit made in the meantime is never overwritten.
+    """
+    product = Product.query.get(product_id)
+    if product is None:
+        return 0
+    processed = 0
+    for asset in [a for a in product.image_assets if a.status == ProductImage.PENDING]:
+        url = asset.source_url
+        ready = (ProductImage.query
+                 .filter_by(source_url=url, status=ProductImage.READY)
+                 .filter(ProductImage.digest.isnot(None)).first())
+        try:
+            if ready is not None:
+                values = {'digest': ready.digest, 'width': ready.width, 'height': ready.height}
+            else:
+                digest, width, height = store_derivatives(fetch_source(url))
+                values = {'digest': digest, 'width': width, 'height': height}
+            values.update(status=ProductImage.READY, error=None)
+        except ImageError as e:
+            current_app.logger.warning('Image %s of product %d failed: %s', url, product_id, e)
+            values = {'status': ProductImage.FAILED, 'error': str(e)[:255]}
+        processed += ProductImage.query.filter_by(
+            id=asset.id, source_url=url, status=ProductImage.PENDING
+        ).update(values, synchronize_session=False)
+
+    if processed:
+        from .product_listing import mark_stale
+        # Bump updated_at so clients see the product changed and pick up the srcsets
+        Product.query.filter_by(id=product_id).update(
+            {Product.updated_at: datetime.utcnow()}, synchronize_session=False
+        )
+        mark_stale([product_id])
+    db.session.commit()
+    return processed
+
+
+@job('images.process')
+def process_images_job(payload):
+    process_product_images(payload['product_id'])
+
+
+def schedule_product_images(product):
+    """Queue derivative generation for a product in the current transaction"""
+    if product.id is None:
+        db.session.flush()
+    enqueue('images.process', {'product_id': product.id}, key='images:%d' % product.id)
+
+
+def serve_media(filename):
+    response = send_from_directory(current_app.config['IMAGE_STORAGE_DIR'], filename,
+                                   max_age=MEDIA_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+images_cli = AppGroup('images', help='Product image derivatives.')
+
+
+@images_cli.command('backfill')
+@click.option('--retry-failed', is_flag=True, help='Also retry images that failed before.')
+def backfill_command(retry_failed):
+    """Generate derivatives for every product image that lacks them."""
+    if retry_failed:
+        ProductImage.query.filter_by(status=ProductImage.FAILED).update(
+            {ProductImage.status: ProductImage.PENDING}, synchronize_session=False)
+        db.session.commit()
+    total = 0
+    last_id = 0
+    while True:
+        products = (Product.query.filter(Product.id > last_id)
+                    .order_by(Product.id).limit(500).all())
+        if not products:
+            break
+        pending = []
+        for product in products:
+            if sync_product_images(product) or any(
+                    a.status == ProductImage.PENDING for a in product.image_assets):
+                pending.append(product.id)
+        db.session.commit()
+        for product_id in pending:
+            total += process_product_images(product_id)
+        last_id = products[-1].id
+        db.session.expunge_all()
+    click.echo('Processed %d images' % total)
+
+
+@images_cli.command('prune')
+def prune_command():
+    """Delete stored derivatives no product image refers to any more."""
+    storage = current_app.config['IMAGE_STORAGE_DIR']
+    referenced = {d for d, in db.session.query(ProductImage.digest).filter(ProductImage.digest.isnot(None))}
+    removed = 0
+    for prefix in os.listdir(storage) if os.path.isdir(storage) else []:
+        for digest in os.listdir(os.path.join(storage, prefix)):
+            if digest not in referenced:
+                directory = os.path.join(storage, prefix, digest)
+                for name in os.listdir(directory):
+                    os.unlink(os.path.join(directory, name))
+                os.rmdir(directory)
+                removed += 1
+    click.echo('Removed %d unreferenced images' % removed)
+
+
+def init_app(app):
+    app.config.setdefault('IMAGE_STORAGE_DIR', os.path.join(app.instance_path, 'media'))
+    app.config.setdefault('IMAGE_URL_PREFIX', '/media')
+    app.config.setdefault('IMAGE_SOURCE_ROOT', None)
+    # Hosts (a list or comma-separated) source images may be downloaded from;
+    # none means sources are only read from IMAGE_SOURCE_ROOT
+    app.config.setdefault('IMAGE_SOURCE_HOSTS', ())
+    app.config.setdefault('IMAGE_MAX_SOURCE_BYTES', 20 * 1024 * 1024)
+    app.config.setdefault('IMAGE_FETCH_TIMEOUT', 10)
+    # An absolute prefix means a CDN or web server serves IMAGE_STORAGE_DIR
+    if app.config['IMAGE_URL_PREFIX'].startswith('/'):
+        app.add_url_rule(app.config['IMAGE_URL_PREFIX'] + '/<path:filename>', 'serve_media', serve_media)
+    app.cli.add_command(images_cli)
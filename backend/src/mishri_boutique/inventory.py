@@ -0,0 +1,225 @@
+import threading
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import case
+from . import db
+from .lifecycle import start_in_worker
+from .models import Product, ProductSize, Reservation, Size
+from .product_listing import mark_stale
+
+
+class InsufficientStock(Exception):
+    """Raised when a size does not have enough stock for a request"""
+
+    def __init__(self, product_id, size_id, requested):
+        super().__init__('Insufficient stock for product %d size %d' % (product_id, size_id))
+        self.product_id = product_id
+        self.size_id = size_id
+        self.requested = requested
+
+
+def _adjust_product_stock(product_id, delta):
+    # Incremental, so concurrent adjustments never overwrite each other
+    if delta:
+        Product.query.filter_by(id=product_id).update(
+            {Product.stock: Product.stock + delta}, synchronize_session=False
+        )
+        mark_stale([product_id])
+
+
+def adjust_stock(product_id, size_id, delta):
+    """Atomically add `delta` (possibly negative) to one size's stock.
+
+    A decrement only applies while enough stock is left
+    (UPDATE ... SET stock = stock - n WHERE stock >= n), so concurrent
+    callers can never drive stock below zero. Returns False if nothing was
+    changed. Does not commit.
+    """
+    query = ProductSize.query.filter_by(product_id=product_id, size_id=size_id)
+    if delta < 0:
+        query = query.filter(ProductSize.stock >= -delta)
+    updated = query.update({ProductSize.stock: ProductSize.stock + delta},
+                           synchronize_session=False)
+    if not updated:
+        return False
+    _adjust_product_stock(product_id, delta)
+    return True
+
+
+def adjust_stock_bulk(lines, sign=-1):
+    """Apply several size stock changes with one UPDATE per table.
+
+    `lines` is [(product_size_id, product_id, quantity), ...] with one entry
+    per product_size_id. With sign=-1 every row must still have enough stock
+    (stock >= quantity) or nothing is changed and False is returned; the
+    caller should then roll back. Does not commit.
+    """
+    if not lines:
+        return True
+    by_row = {row_id: quantity for row_id, _, quantity in lines}
+    if sign > 0:
+        # Rows removed since the stock was taken have nothing to give back to
+        existing = {row_id for row_id, in ProductSize.query
+                    .with_entities(ProductSize.id).filter(ProductSize.id.in_(by_row))}
+        lines = [line for line in lines if line[0] in existing]
+        by_row = {row_id: by_row[row_id] for row_id in existing}
+        if not by_row:
+            return True
+    row_delta = case(by_row, value=ProductSize.id) * sign
+    query = ProductSize.query.filter(ProductSize.id.in_(by_row))
+    if sign < 0:
+        query = query.filter(ProductSize.stock >= case(by_row, value=ProductSize.id))
+    updated = query.update({ProductSize.stock: ProductSize.stock + row_delta},
+                           synchronize_session=False)
+    if updated != len(by_row):
+        return False
+
+    by_product = {}
+    for _, product_id, quantity in lines:
+        by_product[product_id] = by_product.get(product_id, 0) + quantity
+    Product.query.filter(Product.id.in_(by_product)).update(
+        {Product.stock: Product.stock + case(by_product, value=Product.id) * sign},
+        synchronize_session=False
+    )
+    mark_stale(by_product)
+    return True
+
+
+def set_size_stock(product, sizes_data):
+    """Make the product's sizes match `sizes_data` ([{size_id, stock}, ...]).
+
+    Existing rows are updated in place (locked for the update where the
+    database supports it), new sizes are inserted and missing ones removed.
+    Product.stock is moved by the net difference instead of being recomputed.
+    Unknown size ids are ignored. Does not commit.
+    """
+    wanted = {}
+    for size_data in sizes_data:
+        wanted[int(size_data['size_id'])] = max(0, int(size_data.get('stock', 0)))
+    known = {s.id for s in Size.query.filter(Size.id.in_(wanted)).all()} if wanted else set()
+
+    existing = {ps.size_id: ps for ps in ProductSize.query
+                .filter_by(product_id=product.id).with_for_update().all()}
+    delta = 0
+    for size_id, product_size in existing.items():
+        if size_id not in wanted:
+            delta -= product_size.stock or 0
+            db.session.delete(product_size)
+        elif wanted[size_id] != product_size.stock:
+            delta += wanted[size_id] - (product_size.stock or 0)
+            product_size.stock = wanted[size_id]
+    for size_id in known - set(existing):
+        delta += wanted[size_id]
+        db.session.add(ProductSize(product_id=product.id, size_id=size_id, stock=wanted[size_id]))
+
+    db.session.flush()
+    _adjust_product_stock(product.id, delta)
+    return delta
+
+
+def reserve(product_id, size_id, quantity, user_id=None, ttl=None):
+    """Hold `quantity` units of a size for `ttl` seconds.
+
+    Stock is taken immediately with a conditional decrement and given back if
+    the reservation is released or expires. Raises InsufficientStock. Does
+    not commit.
+    """
+    if quantity <= 0:
+        raise ValueError('quantity must be positive')
+    if not adjust_stock(product_id, size_id, -quantity):
+        raise InsufficientStock(product_id, size_id, quantity)
+
+    ttl = ttl or current_app.config['RESERVATION_TTL']
+    reservation = Reservation(
+        token=str(uuid.uuid4()),
+        product_id=product_id,
+        size_id=size_id,
+        user_id=user_id,
+        quantity=quantity,
+        expires_at=datetime.utcnow() + timedelta(seconds=ttl)
+    )
+    db.session.add(reservation)
+    db.session.flush()
+    return reservation
+
+
+def _transition(reservation_id, new_status):
+    # Only one caller can move a reservation out of HELD
+    return Reservation.query.filter_by(id=reservation_id, status=Reservation.HELD).update(
+        {Reservation.status: new_status}, synchronize_session=False
+    ) == 1
+
+
+def commit_reservation(reservation):
+    """Turn a held reservation into a sale; its stock stays deducted"""
+    return _transition(reservation.id, Reservation.COMMITTED)
+
+
+def release_reservation(reservation):
+    """Give a held reservation's stock back. Returns False if it wasn't held."""
+    if not _transition(reservation.id, Reservation.RELEASED):
+        return False
+    adjust_stock(reservation.product_id, reservation.size_id, reservation.quantity)
+    return True
+
+
+def expire_reservations(now=None, batch_size=500):
+    """Release every held reservation past its expiry and commit.
+
+    Safe to run from several workers at once: each reservation is released
+    by whichever sweep moves it out of HELD first.
+    """
+    now = now or datetime.utcnow()
+    released = 0
+    while True:
+        expired = (Reservation.query
+                   .filter(Reservation.status == Reservation.HELD,
+                           Reservation.expires_at <= now)
+                   .order_by(Reservation.expires_at)
+                   .limit(batch_size).all())
+        if not expired:
+            break
+        for reservation in expired:
+            if release_reservation(reservation):
+                released += 1
+        db.session.commit()
+        if len(expired) < batch_size:
+            break
+    return released
+
+
+class ReservationReaper(threading.Thread):
+    """Daemon thread that periodically expires stale reservations"""
+
+    def __init__(self, app, interval):
+        super().__init__(name='reservation-reaper', daemon=True)
+        self.app = app
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    expire_reservations()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Reservation expiry sweep failed')
+                finally:
+                    db.session.remove()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def init_app(app):
+    app.config.setdefault('RESERVATION_TTL', 900)
+    app.config.setdefault('RESERVATION_SWEEP_INTERVAL', 60)
+    interval = app.config['RESERVATION_SWEEP_INTERVAL']
+    if interval and not app.testing:
+        def start():
+            reaper = ReservationReaper(app, interval)
+            reaper.start()
+            app.extensions['reservation_reaper'] = reaper
+        start_in_worker(app, start)
@@ -0,0 +1,315 @@
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app, has_app_context
+from flask.cli import AppGroup
+from sqlalchemy import event, select, update
+from sqlalchemy.engine import make_url
+from . import db
+from .database import RoutingSession
+from .lifecycle import start_in_worker
+from .models import Job
+
+# Job name -> handler(payload) of every registered job
+HANDLERS = {}
+
+
+class UnknownJob(LookupError):
+    """Raised when enqueuing or running a job no handler is registered for"""
+
+
+def job(name):
+    """Register the decorated function as the handler of jobs called `name`.
+
+    Handlers receive the job's JSON payload and run in an app context. A job
+    may run more than once (a worker can die after the handler's commit but
+    before the job is removed), so handlers must be idempotent.
+    """
+    def decorator(f):
+        HANDLERS[name] = f
+        return f
+    return decorator
+
+
+def enqueue(name, payload=None, delay=0, key=None, max_attempts=None):
+    """Add a job to the current transaction; it is queued when the caller commits.
+
+    Enqueuing in the caller's transaction means a rolled back write never
+    leaves a job behind and a committed one never loses its job. With `key`,
+    nothing is added while a job with the same key is still queued. Returns
+    the Job, or None if it was deduplicated.
+    """
+    if name not in HANDLERS:
+        raise UnknownJob(name)
+    if key is not None and db.session.query(Job.id).filter_by(key=key, status=Job.QUEUED).first():
+        return None
+    queued = Job(
+        name=name,
+        payload=payload or {},
+        key=key,
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+        max_attempts=max_attempts or current_app.config['JOB_MAX_ATTEMPTS']
+    )
+    db.session.add(queued)
+    db.session.info['jobs_enqueued'] = True
+    return queued
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _wake_workers(session):
+    # In-process workers pick new jobs up right away instead of at the next poll
+    if session.info.pop('jobs_enqueued', False) and has_app_context():
+        for worker in current_app.extensions.get('job_workers', ()):
+            worker.wake()
+
+
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def _forget_enqueued(session, previous_transaction):
+    session.info.pop('jobs_enqueued', None)
+
+
+def claim(worker_id, limit):
+    """Mark up to `limit` due jobs as running for `worker_id`; returns their ids.
+
+    A single conditional UPDATE, so concurrent workers never claim the same
+    job; Postgres additionally skips rows another worker has locked.
+    """
+    now = datetime.utcnow()
+    due = (select(Job.id)
+           .where(Job.status == Job.QUEUED, Job.run_at <= now)
+           .order_by(Job.run_at, Job.id)
+           .limit(limit))
+    # Idle polls stay read-only, so they never take SQLite's write lock
+    if db.session.execute(due.with_only_columns(Job.id).limit(1)).first() is None:
+        db.session.rollback()
+        return []
+    if db.engine.dialect.name == 'postgresql':
+        due = due.with_for_update(skip_locked=True)
+    values = {'status': Job.RUNNING, 'locked_by': worker_id, 'locked_at': now,
+              'attempts': Job.attempts + 1}
+
+    if db.engine.dialect.update_returning:
+        statement = (update(Job)
+                     .where(Job.id.in_(due.scalar_subquery()), Job.status == Job.QUEUED)
+                     .values(values)
+                     .returning(Job.id)
+                     .execution_options(synchronize_session=False))
+        ids = [job_id for job_id, in db.session.execute(statement)]
+    else:
+        ids = []
+        for job_id in db.session.scalars(due).all():
+            claimed = db.session.execute(
+                update(Job).where(Job.id == job_id, Job.status == Job.QUEUED).values(values)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if claimed:
+                ids.append(job_id)
+    db.session.commit()
+    return ids
+
+
+def run_job(job_id):
+    """Run one claimed job; returns True if it succeeded.
+
+    Succeeded jobs are deleted. Failed ones are retried with exponential
+    backoff until max_attempts, then kept as failed for `flask jobs retry`.
+    """
+    queued = db.session.get(Job, job_id)
+    started = time.perf_counter()
+    try:
+        handler = HANDLERS.get(queued.name)
+        if handler is None:
+            raise UnknownJob(queued.name)
+        handler(queued.payload)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception('Job %d (%s) failed', job_id, queued.name)
+        _retry_or_fail(job_id, e)
+        return False
+
+    Job.query.filter_by(id=job_id).delete(synchronize_session=False)
+    db.session.commit()
+    current_app.logger.debug('Job %d ran in %.1fms', job_id, (time.perf_counter() - started) * 1000)
+    return True
+
+
+def _retry_or_fail(job_id, error):
+    failed = db.session.get(Job, job_id)
+    if failed is None:
+        return
+    config = current_app.config
+    if failed.attempts >= failed.max_attempts:
+        failed.status = Job.FAILED
+    else:
+        delay = min(config['JOB_RETRY_BACKOFF'] * 2 ** (failed.attempts - 1), config['JOB_RETRY_MAX_DELAY'])
+        failed.status = Job.QUEUED
+        failed.run_at = datetime.utcnow() + timedelta(seconds=delay)
+    failed.last_error = ('%s: %s' % (type(error).__name__, error))[:2000]
+    failed.locked_by = failed.locked_at = None
+    db.session.commit()
+
+
+def requeue_stale(lease=None):
+    """Give jobs whose worker died mid-run back to the queue; returns the count.
+
+    A job counts as abandoned once it has been running longer than the lease
+    (JOB_LEASE_SECONDS). Ones that already used up their attempts fail.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=lease or current_app.config['JOB_LEASE_SECONDS'])
+    stale = Job.query.filter(Job.status == Job.RUNNING, Job.locked_at < cutoff)
+    if stale.with_entities(Job.id).first() is None:
+        db.session.rollback()
+        return 0
+    failed = stale.filter(Job.attempts >= Job.max_attempts).update(
+        {Job.status: Job.FAILED, Job.last_error: 'Lease expired', Job.locked_by: None, Job.locked_at: None},
+        synchronize_session=False)
+    requeued = stale.update(
+        {Job.status: Job.QUEUED, Job.locked_by: None, Job.locked_at: None},
+        synchronize_session=False)
+    db.session.commit()
+    return failed + requeued
+
+
+def run_pending(worker_id=None, limit=None):
+    """Run due jobs until none are left (or `limit` ran); returns how many ran"""
+    worker_id = worker_id or default_worker_id()
+    batch_size = current_app.config['JOB_BATCH_SIZE']
+    ran = 0
+    while limit is None or ran < limit:
+        ids = claim(worker_id, batch_size if limit is None else min(batch_size, limit - ran))
+        if not ids:
+            break
+        for job_id in ids:
+            run_job(job_id)
+            ran += 1
+    return ran
+
+
+def default_worker_id(name='main'):
+    return '%s:%d:%s' % (socket.gethostname(), os.getpid(), name)
+
+
+class JobWorker(threading.Thread):
+    """Daemon thread running due jobs.
+
+    Polls every `interval` seconds; jobs committed by this process wake it
+    immediately. Abandoned jobs are requeued about twice per lease period.
+    """
+
+    def __init__(self, app, interval, name='job-worker'):
+        super().__init__(name=name, daemon=True)
+        self.app = app
+        self.interval = interval
+        self.worker_id = default_worker_id(name)
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._next_requeue = 0
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            with self.app.app_context():
+                try:
+                    if time.monotonic() >= self._next_requeue:
+                        requeue_stale()
+                        self._next_requeue = time.monotonic() + self.app.config['JOB_LEASE_SECONDS'] / 2
+                    run_pending(self.worker_id)
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Job worker %s failed', self.worker_id)
+                finally:
+                    db.session.remove()
+            self._wake.wait(self.interval)
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+
+def start_workers(app, count):
+    workers = [JobWorker(app, app.config['JOB_POLL_INTERVAL'], 'job-worker-%d' % i) for i in range(count)]
+    for worker in workers:
+        worker.start()
+    app.extensions.setdefault('job_workers', []).extend(workers)
+    return workers
+
+
+jobs_cli = AppGroup('jobs', help='Background job queue.')
+
+
+@jobs_cli.command('work')
+@click.option('--workers', default=2, show_default=True, help='Worker threads in this process.')
+def work_command(workers):
+    """Run jobs until interrupted (a dedicated worker process)."""
+    app = current_app._get_current_object()
+    # JOB_WORKERS threads start with a process's first request, so none run here
+    start_workers(app, workers)
+    running = app.extensions['job_workers']
+    click.echo('Running %d job workers, Ctrl+C to stop' % len(running))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for worker in running:
+            worker.stop()
+        for worker in running:
+            worker.join()
+
+
+@jobs_cli.command('run')
+def run_command():
+    """Run every job that is due now, then exit."""
+    requeue_stale()
+    click.echo('Ran %d jobs' % run_pending())
+
+
+@jobs_cli.command('list')
+@click.option('--status', type=click.Choice([Job.QUEUED, Job.RUNNING, Job.FAILED]))
+@click.option('--limit', default=50, show_default=True)
+def list_command(status, limit):
+    """Show queued, running and failed jobs."""
+    query = Job.query.order_by(Job.run_at, Job.id)
+    if status:
+        query = query.filter_by(status=status)
+    for queued in query.limit(limit):
+        click.echo('%6d %-8s %-20s attempts=%d/%d run_at=%s %s' % (
+            queued.id, queued.status, queued.name, queued.attempts, queued.max_attempts,
+            queued.run_at.isoformat(timespec='seconds'), queued.last_error or ''))
+
+
+@jobs_cli.command('retry')
+@click.argument('job_ids', nargs=-1, type=int)
+def retry_command(job_ids):
+    """Queue failed jobs again (all of them without JOB_IDS)."""
+    query = Job.query.filter_by(status=Job.FAILED)
+    if job_ids:
+        query = query.filter(Job.id.in_(job_ids))
+    retried = query.update({Job.status: Job.QUEUED, Job.attempts: 0, Job.run_at: datetime.utcnow()},
+                           synchronize_session=False)
+    db.session.commit()
+    click.echo('Queued %d jobs' % retried)
+
+
+def init_app(app):
+    app.config.setdefault('JOB_WORKERS', 1)
+    app.config.setdefault('JOB_POLL_INTERVAL', 1.0)
+    app.config.setdefault('JOB_BATCH_SIZE', 10)
+    app.config.setdefault('JOB_MAX_ATTEMPTS', 5)
+    app.config.setdefault('JOB_RETRY_BACKOFF', 10)
+    app.config.setdefault('JOB_RETRY_MAX_DELAY', 3600)
+    app.config.setdefault('JOB_LEASE_SECONDS', 300)
+    app.cli.add_command(jobs_cli)
+    workers = app.config['JOB_WORKERS']
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # Every thread shares the one connection, so a worker's poll would end
+        # whatever transaction a request has open; use `flask jobs run`
+        workers = 0
+    if workers and not app.testing:
+        start_in_worker(app, lambda: start_workers(app, workers))
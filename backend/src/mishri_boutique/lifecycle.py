@@ -0,0 +1,50 @@
+import os
+import threading
+import weakref
+
+
+def start_in_worker(app, start):
+    """Call start() once in every process, just before its first request.
+
+    Background threads started by create_app itself would only run in the
+    parent when a server imports the app once and forks its workers
+    (gunicorn --preload); started lazily, each worker gets its own and the
+    boot path stays free of them.
+    """
+    starts = app.extensions.get('worker_starts')
+    if starts is None:
+        starts = app.extensions['worker_starts'] = []
+        state = {'pid': None}
+        lock = threading.Lock()
+
+        @app.before_request
+        def _start_worker_threads():
+            if state['pid'] == os.getpid():
+                return
+            with lock:
+                if state['pid'] != os.getpid():
+                    for fn in starts:
+                        fn()
+                    state['pid'] = os.getpid()
+    starts.append(start)
+
+
+def _dispose_after_fork():
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+# Engines of every app, held weakly so apps can still be garbage collected
+_engines = weakref.WeakSet()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_dispose_after_fork)
+
+
+def dispose_engines_after_fork(app):
+    """Make forked children drop the pooled connections of the app's engines.
+
+    Sharing a socket between processes corrupts both sides' sessions, so a
+    child opens its own connections instead (the parent keeps its pool).
+    """
+    with app.app_context():
+        _engines.update(app.extensions['sqlalchemy'].engines.values())
@@ -0,0 +1,199 @@
+import hashlib
+import hmac
+import struct
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from functools import lru_cache
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import and_, or_
+from . import db
+from .models import ProductListing
+from .serializers import RowSerializer
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+# Sort keys accepted by the listing endpoint (matching the frontend sort options).
+# Each maps to (column, descending); the product id is always the tie-breaker.
+SORT_KEYS = {
+    'newest': (ProductListing.created_at, True),
+    'oldest': (ProductListing.created_at, False),
+    'price-low-high': (ProductListing.price, False),
+    'price-high-low': (ProductListing.price, True),
+}
+DEFAULT_SORT = 'newest'
+
+# Columns a client may request via ?fields=, all read from product_listing
+PROJECTABLE_FIELDS = {
+    'id': ProductListing.product_id.label('id'),
+    'name': ProductListing.name,
+    'description': ProductListing.description,
+    'price': ProductListing.price,
+    'sale_price': ProductListing.sale_price,
+    'effective_price': ProductListing.effective_price,
+    'fabric': ProductListing.fabric,
+    'style': ProductListing.style,
+    'occasion': ProductListing.occasion,
+    'sleeve_type': ProductListing.sleeve_type,
+    'neck_type': ProductListing.neck_type,
+    'images': ProductListing.images,
+    'primary_image': ProductListing.primary_image,
+    'image_variants': ProductListing.image_variants,
+    'sizes': ProductListing.sizes,
+    'stock': ProductListing.stock,
+    'is_featured': ProductListing.is_featured,
+    'category_id': ProductListing.category_id,
+    'category_name': ProductListing.category_name,
+    'created_at': ProductListing.created_at,
+    'updated_at': ProductListing.updated_at,
+}
+DEFAULT_FIELDS = ['id', 'name', 'description', 'price', 'sale_price', 'fabric', 'style', 'occasion',
+                  'sleeve_type', 'neck_type', 'images', 'stock', 'is_featured', 'category_id',
+                  'created_at', 'updated_at', 'image_variants']
+
+PRICE_FIELDS = ('price', 'sale_price', 'effective_price')
+
+# Product representation of the detail, featured, category, filter and search endpoints
+PRODUCT_FIELDS = ('id', 'name', 'description', 'price', 'sale_price', 'fabric', 'style', 'occasion',
+                  'sleeve_type', 'neck_type', 'images', 'image_variants', 'category_id', 'sizes',
+                  'stock', 'is_featured')
+
+
+class ListingError(ValueError):
+    """Raised for invalid listing parameters (bad sort, fields or cursor)"""
+
+
+def encode_cursor(product_id):
+    return urlsafe_b64encode(str(product_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return int(urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise ListingError('Invalid cursor')
+
+
+def _price_mask(product_id):
+    key = current_app.config['SECRET_KEY'].encode()
+    return hmac.new(key, b'listing-cursor-price:%d' % product_id, hashlib.sha256).digest()[:8]
+
+
+def _seal_price(price, product_id):
+    # Callers without price access must not read a price out of their cursor
+    packed = struct.pack('>d', price)
+    return urlsafe_b64encode(bytes(a ^ b for a, b in zip(packed, _price_mask(product_id)))).decode()
+
+
+def _open_price(sealed, product_id):
+    packed = urlsafe_b64decode(sealed.encode())
+    return struct.unpack('>d', bytes(a ^ b for a, b in zip(packed, _price_mask(product_id))))[0]
+
+
+def _cursor_serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='listing-cursor')
+
+
+def encode_listing_cursor(sort, value, product_id):
+    """Cursor of the row after (value, product_id) in `sort` order.
+
+    Carries the sort value itself, so the next page does not depend on the
+    anchor row still existing. Signed, and prices are sealed.
+    """
+    if value is not None:
+        value = _seal_price(value, product_id) if sort.startswith('price') else value.isoformat()
+    return _cursor_serializer().dumps([sort, value, product_id])
+
+
+def decode_listing_cursor(cursor, sort):
+    """(sort value, product_id) from a cursor made for `sort`"""
+    try:
+        cursor_sort, value, product_id = _cursor_serializer().loads(cursor)
+        product_id = int(product_id)
+        if value is not None and cursor_sort == sort:
+            value = _open_price(value, product_id) if sort.startswith('price') else datetime.fromisoformat(value)
+    except (BadSignature, TypeError, ValueError, struct.error):
+        raise ListingError('Invalid cursor')
+    if cursor_sort != sort:
+        raise ListingError('Cursor belongs to another sort order')
+    return value, product_id
+
+
+def parse_fields(raw):
+    """Parse a comma separated ?fields= value into a list of column names"""
+    if not raw:
+        return DEFAULT_FIELDS
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in PROJECTABLE_FIELDS]
+    if unknown:
+        raise ListingError('Unknown fields: ' + ', '.join(unknown))
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return fields
+
+
+def parse_limit(raw):
+    if raw is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(raw, MAX_PAGE_SIZE))
+
+
+@lru_cache(maxsize=256)
+def product_serializer(fields=PRODUCT_FIELDS, can_view_prices=False):
+    """RowSerializer of product_listing `fields` (a tuple) for a price tier.
+
+    Compiled once per combination; callers without price access get NULL
+    price columns.
+    """
+    return RowSerializer(PROJECTABLE_FIELDS, fields, () if can_view_prices else PRICE_FIELDS)
+
+
+def _keyset_filter(sort_column, descending, anchor_value, anchor_id):
+    # (sort_column, id) strictly after the anchor row in the requested order
+    if descending:
+        return or_(sort_column < anchor_value,
+                   and_(sort_column == anchor_value, ProductListing.product_id < anchor_id))
+    return or_(sort_column > anchor_value,
+               and_(sort_column == anchor_value, ProductListing.product_id > anchor_id))
+
+
+def list_products(sort=None, fields=None, limit=None, cursor=None,
+                  can_view_prices=False, filters=()):
+    """Return one page of products as (rows, next_cursor).
+
+    Pages are keyset-paginated on (sort column, id) so the cost of a page does
+    not depend on how deep into the catalog it is.  The cursor carries both of
+    the last row's (see encode_listing_cursor), so deleting that row between
+    pages does not break the next one.
+    """
+    sort = sort or DEFAULT_SORT
+    if sort not in SORT_KEYS:
+        raise ListingError('Unknown sort: ' + sort)
+    sort_column, descending = SORT_KEYS[sort]
+    fields = fields or DEFAULT_FIELDS
+    limit = parse_limit(limit)
+
+    serializer = product_serializer(tuple(fields), can_view_prices)
+    query = db.session.query(*serializer.columns, sort_column.label('_sort_key'))
+    for criterion in filters:
+        query = query.filter(criterion)
+
+    if cursor:
+        anchor_value, anchor_id = decode_listing_cursor(cursor, sort)
+        query = query.filter(_keyset_filter(sort_column, descending, anchor_value, anchor_id))
+
+    if descending:
+        query = query.order_by(sort_column.desc(), ProductListing.product_id.desc())
+    else:
+        query = query.order_by(sort_column.asc(), ProductListing.product_id.asc())
+
+    # Fetch one extra row to know whether another page exists
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    products = [serializer.serialize(row) for row in rows]
+    next_cursor = encode_listing_cursor(sort, rows[-1]._sort_key, rows[-1].id) if has_more else None
+    return products, next_cursor
@@ -0,0 +1,77 @@
+from datetime import datetime
+from email.message import EmailMessage
+from flask import current_app, render_template
+from . import db
+from .auth import password_reset_token
+from .jobs import enqueue, job
+from .user import User
+
+# Subject of each template under templates/email/ (<name>.html and <name>.txt)
+SUBJECTS = {
+    'password_reset': 'Reset Your Password - Mishri Boutique',
+}
+
+
+def render_email(template, **context):
+    """(subject, text, html) of an email template"""
+    context.setdefault('year', datetime.utcnow().year)
+    return (SUBJECTS[template],
+            render_template('email/%s.txt' % template, **context),
+            render_template('email/%s.html' % template, **context))
+
+
+def send_email(to, subject, text, html):
+    """Deliver a message through MAIL_SERVER, or log it when none is configured"""
+    config = current_app.config
+    message = EmailMessage()
+    message['Subject'] = subject
+    message['From'] = config['MAIL_DEFAULT_SENDER']
+    message['To'] = to
+    message.set_content(text)
+    message.add_alternative(html, subtype='html')
+
+    if not config['MAIL_SERVER']:
+        # Bodies carry secrets such as password reset links, so they are
+        # only logged when asked for in a debug (development) app
+        if config['MAIL_LOG_BODIES'] and current_app.debug:
+            current_app.logger.info('MAIL_SERVER not set, not sending "%s" to %s:\n%s', subject, to, text)
+        else:
+            current_app.logger.info('MAIL_SERVER not set, not sending "%s" to %s', subject, to)
+        return
+    import smtplib
+    with smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=config['MAIL_TIMEOUT']) as smtp:
+        if config['MAIL_USE_TLS']:
+            smtp.starttls()
+        if config['MAIL_USERNAME']:
+            smtp.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+        smtp.send_message(message)
+
+
+def queue_password_reset(user):
+    """Email `user` a password reset link from a job once the current transaction commits.
+
+    The job only stores the user id: the token is made when the email is
+    sent, so no working reset link sits in the jobs table.
+    """
+    enqueue('email.password_reset', {'user_id': user.id})
+
+
+@job('email.password_reset')
+def send_password_reset_job(payload):
+    user = db.session.get(User, payload['user_id'])
+    if user is None:
+        return
+    reset_link = '%s/reset-password/%s' % (current_app.config['FRONTEND_URL'], password_reset_token(user))
+    subject, text, html = render_email('password_reset', name=user.username, reset_link=reset_link)
+    send_email(user.email, subject, text, html)
+
+
+def init_app(app):
+    app.config.setdefault('MAIL_SERVER', None)
+    app.config.setdefault('MAIL_PORT', 587)
+    app.config.setdefault('MAIL_USE_TLS', True)
+    app.config.setdefault('MAIL_USERNAME', None)
+    app.config.setdefault('MAIL_PASSWORD', None)
+    app.config.setdefault('MAIL_DEFAULT_SENDER', 'Mishri Boutique <no-reply@mishriboutique.com>')
+    app.config.setdefault('MAIL_TIMEOUT', 10)
+    app.config.setdefault('MAIL_LOG_BODIES', False)
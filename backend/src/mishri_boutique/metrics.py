@@ -0,0 +1,276 @@
+import hmac
+import ipaddress
+import threading
+import time
+from flask import abort, current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .serializers import FastJSONProvider
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Longest repr of bound parameters written to the slow query log
+MAX_PARAMS_LENGTH = 500
+
+PREFIX = 'mishri_'
+
+
+class RequestMetrics:
+    """What one request spent on SQL and JSON encoding"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+
+
+class MetricsRegistry:
+    """Per-endpoint aggregates rendered in the Prometheus text format.
+
+    Values live in the process, so with several workers each one reports its
+    own counters; Prometheus sums them across scrape targets.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+            self.endpoints = {}
+            self.slow_queries = 0
+
+    def observe(self, endpoint, method, status, duration, metrics, size):
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = {
+                    'buckets': [0] * len(self.buckets), 'count': 0, 'duration': 0.0,
+                    'queries': 0, 'db_time': 0.0, 'serialize_time': 0.0, 'bytes': 0
+                }
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    stats['buckets'][i] += 1
+            stats['count'] += 1
+            stats['duration'] += duration
+            stats['queries'] += metrics.queries
+            stats['db_time'] += metrics.db_time
+            stats['serialize_time'] += metrics.serialize_time
+            stats['bytes'] += size
+
+    def slow_query(self):
+        with self._lock:
+            self.slow_queries += 1
+
+    def render(self):
+        with self._lock:
+            lines = []
+
+            def metric(name, kind, help_text):
+                lines.append('# HELP %s%s %s' % (PREFIX, name, help_text))
+                lines.append('# TYPE %s%s %s' % (PREFIX, name, kind))
+
+            metric('http_requests_total', 'counter', 'Requests handled, by endpoint, method and status.')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append('%shttp_requests_total{endpoint="%s",method="%s",status="%s"} %d'
+                             % (PREFIX, _label(endpoint), method, status, count))
+
+            metric('http_request_duration_seconds', 'histogram', 'Time spent handling a request.')
+            for endpoint, stats in sorted(self.endpoints.items()):
+                label = _label(endpoint)
+                for bound, count in zip(self.buckets, stats['buckets']):
+                    lines.append('%shttp_request_duration_seconds_bucket{endpoint="%s",le="%g"} %d'
+                                 % (PREFIX, label, bound, count))
+                lines.append('%shttp_request_duration_seconds_bucket{endpoint="%s",le="+Inf"} %d'
+                             % (PREFIX, label, stats['count']))
+                lines.append('%shttp_request_duration_seconds_sum{endpoint="%s"} %.6f'
+                             % (PREFIX, label, stats['duration']))
+                lines.append('%shttp_request_duration_seconds_count{endpoint="%s"} %d'
+                             % (PREFIX, label, stats['count']))
+
+            for name, field, fmt, help_text in (
+                    ('db_queries_total', 'queries', '%d', 'SQL statements executed.'),
+                    ('db_time_seconds_total', 'db_time', '%.6f', 'Time spent executing SQL.'),
+                    ('serialization_seconds_total', 'serialize_time', '%.6f', 'Time spent encoding JSON.'),
+                    ('response_bytes_total', 'bytes', '%d', 'Response body bytes sent.')):
+                metric(name, 'counter', help_text)
+                for endpoint, stats in sorted(self.endpoints.items()):
+                    lines.append(('%s%s{endpoint="%s"} ' + fmt)
+                                 % (PREFIX, name, _label(endpoint), stats[field]))
+
+            metric('slow_queries_total', 'counter', 'Statements slower than SLOW_QUERY_MS.')
+            lines.append('%sslow_queries_total %d' % (PREFIX, self.slow_queries))
+            return '\n'.join(lines) + '\n'
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _request_metrics():
+    if has_request_context():
+        return g.get('request_metrics')
+    return None
+
+
+class TimedJSONProvider(FastJSONProvider):
+    """JSON provider that charges encoding time to the current request"""
+
+    def encode(self, obj):
+        started = time.perf_counter()
+        try:
+            return super().encode(obj)
+        finally:
+            metrics = _request_metrics()
+            if metrics is not None:
+                metrics.serialize_time += time.perf_counter() - started
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_metrics_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    metrics = _request_metrics()
+    if metrics is not None:
+        metrics.queries += 1
+        metrics.db_time += elapsed
+
+    if not has_app_context():
+        return
+    threshold = current_app.config.get('SLOW_QUERY_MS')
+    if threshold and elapsed * 1000 >= threshold:
+        registry = current_app.extensions.get('metrics')
+        if registry is not None:
+            registry.slow_query()
+        _log_slow_query(conn, statement, parameters, executemany, elapsed)
+
+
+def explain(conn, statement, parameters):
+    """Plan of a SELECT as text, run on a separate DBAPI cursor so the
+    original cursor's pending results are left alone"""
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return '\n'.join(' | '.join(str(value) for value in row) for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def _log_slow_query(conn, statement, parameters, executemany, elapsed):
+    # Bound values can hold emails, password hashes and tokens, so they are
+    # only logged when debugging; the statement itself has placeholders
+    params = ''
+    if current_app.config.get('SLOW_QUERY_LOG_PARAMS'):
+        params = repr(parameters)
+        if len(params) > MAX_PARAMS_LENGTH:
+            params = params[:MAX_PARAMS_LENGTH] + '...'
+        params = '\nParameters: ' + params
+    # Plans can quote the bound values too (Postgres filter lines), so
+    # EXPLAIN is opt-in as well
+    plan = None
+    if (current_app.config.get('SLOW_QUERY_EXPLAIN') and not executemany
+            and statement.lstrip().upper().startswith(('SELECT', 'WITH'))):
+        try:
+            plan = explain(conn, statement, parameters)
+        except Exception as e:
+            plan = 'EXPLAIN failed: %s' % e
+    endpoint = request.endpoint if has_request_context() else None
+    current_app.logger.warning(
+        'Slow query (%.1f ms, endpoint %s): %s%s%s',
+        elapsed * 1000, endpoint, statement, params, '\nPlan:\n' + plan if plan else ''
+    )
+
+
+def start_request():
+    g.request_metrics = RequestMetrics()
+
+
+def record_response(response):
+    """after_request hook recording the request and adding Server-Timing"""
+    metrics = g.pop('request_metrics', None)
+    if metrics is None:
+        return response
+    duration = time.perf_counter() - metrics.started
+    if response.is_streamed:
+        size = response.content_length or 0
+    else:
+        size = len(response.get_data())
+    endpoint = request.endpoint or 'unmatched'
+    current_app.extensions['metrics'].observe(
+        endpoint, request.method, str(response.status_code), duration, metrics, size
+    )
+    response.headers.add('Server-Timing', 'db;dur=%.1f;desc="%d queries"' % (
+        metrics.db_time * 1000, metrics.queries))
+    response.headers.add('Server-Timing', 'serialize;dur=%.1f' % (metrics.serialize_time * 1000))
+    response.headers.add('Server-Timing', 'total;dur=%.1f' % (duration * 1000))
+    return response
+
+
+def _allowed_networks():
+    networks = current_app.config['METRICS_ALLOWED_IPS'] or ()
+    if isinstance(networks, str):
+        networks = networks.split(',')
+    return [ipaddress.ip_network(n.strip(), strict=False) for n in networks if n.strip()]
+
+
+def metrics_allowed():
+    """Whether the caller may scrape /metrics: the METRICS_TOKEN bearer token
+    or an address in METRICS_ALLOWED_IPS (addresses or CIDR networks)"""
+    token = current_app.config['METRICS_TOKEN']
+    if token:
+        scheme, _, given = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(given.encode(), token.encode()):
+            return True
+    try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    return any(address in network for network in _allowed_networks())
+
+
+def metrics_view():
+    if not metrics_allowed():
+        abort(404)
+    return current_app.response_class(
+        current_app.extensions['metrics'].render(),
+        mimetype='text/plain; version=0.0.4'
+    )
+
+
+def init_app(app):
+    """Register the hooks and the /metrics endpoint.
+
+    Call before other after_request hooks are registered (they run in reverse
+    order) so the recorded size is that of the final, compressed body.
+    """
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('SLOW_QUERY_MS', 250)
+    app.config.setdefault('SLOW_QUERY_EXPLAIN', False)
+    app.config.setdefault('SLOW_QUERY_LOG_PARAMS', False)
+    app.config.setdefault('METRICS_TOKEN', None)
+    app.config.setdefault('METRICS_ALLOWED_IPS', '127.0.0.1,::1')
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    app.extensions['metrics'] = MetricsRegistry()
+    app.json = TimedJSONProvider(app, app.json.backend)
+    # Engine-class listeners cover every engine the app creates
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(start_request)
+    app.after_request(record_response)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
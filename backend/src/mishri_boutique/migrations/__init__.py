@@ -0,0 +1,7 @@
+"""Versioned schema migrations, applied in order by `flask db upgrade`.
+
+Each vNNNN_<name>.py module defines upgrade(connection), which runs inside
+the migration's transaction. Migrations describe the schema as it was when
+they were written, so they never import the models; add a new one for every
+schema change instead of editing an applied one.
+"""
@@ -0,0 +1,224 @@
+"""Baseline: the schema db.create_all() used to create at start-up.
+
+Tables are created only where missing, so databases created by create_all
+adopt migrations by running this once.
+"""
+from sqlalchemy import (JSON, Boolean, Column, DateTime, Enum, Float, ForeignKey, Index, Integer,
+                        MetaData, String, Table, Text, UniqueConstraint, text)
+
+metadata = MetaData()
+
+Table(
+    'categories', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('description', Text),
+    Column('created_at', DateTime),
+)
+
+Table(
+    'sizes', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(20), nullable=False, index=True),
+    Column('measurements', String(100)),
+)
+
+Table(
+    'users', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('username', String(80), nullable=False, unique=True),
+    Column('email', String(120), nullable=False, unique=True),
+    Column('password_hash', String(128)),
+    Column('user_type', Enum('BASIC', 'PLUS', 'PREMIUM', name='usertype')),
+    Column('points', Integer),
+    Column('created_at', DateTime),
+    Column('last_login', DateTime),
+)
+
+Table(
+    'products', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(200), nullable=False),
+    Column('description', Text),
+    Column('price', Float, nullable=False),
+    Column('sale_price', Float),
+    Column('fabric', String(100)),
+    Column('style', String(100)),
+    Column('occasion', String(100)),
+    Column('sleeve_type', String(100), index=True),
+    Column('neck_type', String(100), index=True),
+    Column('images', JSON),
+    Column('stock', Integer),
+    Column('is_featured', Boolean),
+    Column('category_id', Integer, ForeignKey('categories.id'), nullable=False, index=True),
+    Column('created_at', DateTime),
+    Column('updated_at', DateTime),
+    Index('ix_products_created_at_id', 'created_at', 'id'),
+    Index('ix_products_price_id', 'price', 'id'),
+    Index('ix_products_fabric_price', 'fabric', 'price'),
+    Index('ix_products_style_price', 'style', 'price'),
+    Index('ix_products_occasion_price', 'occasion', 'price'),
+)
+
+Table(
+    'product_sizes', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('product_id', Integer, ForeignKey('products.id'), nullable=False, index=True),
+    Column('size_id', Integer, ForeignKey('sizes.id'), nullable=False),
+    Column('stock', Integer),
+    Index('ix_product_sizes_size_product', 'size_id', 'product_id'),
+)
+
+Table(
+    'product_images', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('product_id', Integer, ForeignKey('products.id', ondelete='CASCADE'), nullable=False),
+    Column('position', Integer, nullable=False),
+    Column('source_url', String(1000), nullable=False, index=True),
+    Column('digest', String(64)),
+    Column('width', Integer),
+    Column('height', Integer),
+    Column('status', String(20), nullable=False),
+    Column('error', String(255)),
+    Column('updated_at', DateTime),
+    UniqueConstraint('product_id', 'position', name='uq_product_images_position'),
+)
+
+Table(
+    'product_listing', metadata,
+    Column('product_id', Integer, ForeignKey('products.id', ondelete='CASCADE'), primary_key=True),
+    Column('name', String(200), nullable=False),
+    Column('description', Text),
+    Column('price', Float, nullable=False),
+    Column('sale_price', Float),
+    Column('effective_price', Float, nullable=False),
+    Column('fabric', String(100)),
+    Column('style', String(100)),
+    Column('occasion', String(100)),
+    Column('sleeve_type', String(100)),
+    Column('neck_type', String(100)),
+    Column('images', JSON),
+    Column('primary_image', String(1000)),
+    Column('image_variants', JSON),
+    Column('category_id', Integer, nullable=False),
+    Column('category_name', String(100)),
+    Column('sizes', JSON),
+    Column('size_names', String(500)),
+    Column('stock', Integer),
+    Column('is_featured', Boolean),
+    Column('created_at', DateTime),
+    Column('updated_at', DateTime),
+    Index('ix_product_listing_created_at_id', 'created_at', 'product_id'),
+    Index('ix_product_listing_price_id', 'price', 'product_id'),
+    Index('ix_product_listing_effective_price', 'effective_price'),
+    Index('ix_product_listing_category_id', 'category_id', 'product_id'),
+    Index('ix_product_listing_featured', 'is_featured', 'product_id'),
+    Index('ix_product_listing_fabric_price', 'fabric', 'price'),
+    Index('ix_product_listing_style_price', 'style', 'price'),
+    Index('ix_product_listing_occasion_price', 'occasion', 'price'),
+)
+
+Table(
+    'reservations', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('token', String(36), nullable=False, unique=True),
+    Column('product_id', Integer, ForeignKey('products.id', ondelete='CASCADE'), nullable=False),
+    Column('size_id', Integer, ForeignKey('sizes.id'), nullable=False),
+    Column('user_id', Integer, ForeignKey('users.id')),
+    Column('quantity', Integer, nullable=False),
+    Column('status', String(20), nullable=False),
+    Column('expires_at', DateTime, nullable=False),
+    Column('created_at', DateTime),
+    Index('ix_reservations_status_expires_at', 'status', 'expires_at'),
+)
+
+Table(
+    'orders', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('status', String(20), nullable=False),
+    Column('total', Float, nullable=False),
+    Column('idempotency_key', String(255)),
+    Column('created_at', DateTime),
+    Column('updated_at', DateTime),
+    UniqueConstraint('user_id', 'idempotency_key', name='uq_orders_user_idempotency_key'),
+    Index('ix_orders_user_id_id', 'user_id', 'id'),
+)
+
+Table(
+    'order_items', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('order_id', Integer, ForeignKey('orders.id'), nullable=False, index=True),
+    Column('product_id', Integer, ForeignKey('products.id'), nullable=False),
+    Column('size_id', Integer, ForeignKey('sizes.id'), nullable=False),
+    Column('product_name', String(200), nullable=False),
+    Column('quantity', Integer, nullable=False),
+    Column('unit_price', Float, nullable=False),
+)
+
+Table(
+    'jobs', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('payload', JSON, nullable=False),
+    Column('key', String(200)),
+    Column('status', String(20), nullable=False),
+    Column('attempts', Integer, nullable=False),
+    Column('max_attempts', Integer, nullable=False),
+    Column('run_at', DateTime, nullable=False),
+    Column('locked_by', String(100)),
+    Column('locked_at', DateTime),
+    Column('last_error', Text),
+    Column('created_at', DateTime),
+    Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    Index('ix_jobs_key', 'key'),
+)
+
+# Full-text index over products (see search.py). SQLite: an FTS5 external
+# content table kept in sync by triggers; Postgres: a weighted generated
+# tsvector with a GIN index.
+_FTS_COLUMNS = 'name, description, fabric, style, occasion'
+_FTS_NEW = 'new.name, new.description, new.fabric, new.style, new.occasion'
+_FTS_OLD = 'old.name, old.description, old.fabric, old.style, old.occasion'
+
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+    "%s, content='products', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')" % _FTS_COLUMNS,
+    "CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN "
+    "INSERT INTO products_fts(rowid, %s) VALUES (new.id, %s); END" % (_FTS_COLUMNS, _FTS_NEW),
+    "CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, %s) VALUES ('delete', old.id, %s); END"
+    % (_FTS_COLUMNS, _FTS_OLD),
+    "CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF %s ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, %s) VALUES ('delete', old.id, %s); "
+    "INSERT INTO products_fts(rowid, %s) VALUES (new.id, %s); END"
+    % (_FTS_COLUMNS, _FTS_COLUMNS, _FTS_OLD, _FTS_COLUMNS, _FTS_NEW),
+]
+
+POSTGRES_SEARCH_DDL = [
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(fabric, '') || ' ' || coalesce(style, '') "
+    "|| ' ' || coalesce(occasion, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'D')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_products_search_vector ON products USING GIN (search_vector)",
+]
+
+
+def upgrade(connection):
+    metadata.create_all(connection)
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        exists = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+        )).first()
+        for statement in SQLITE_SEARCH_DDL:
+            connection.execute(text(statement))
+        if not exists:
+            # Index rows that were written before the index existed
+            connection.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+    elif dialect == 'postgresql':
+        for statement in POSTGRES_SEARCH_DDL:
+            connection.execute(text(statement))
@@ -0,0 +1,40 @@
+"""Points ledger: an append-only row for every change to users.points.
+
+Existing balances are carried over as one opening_balance entry per user,
+so the ledger of every user sums to their points from the start.
+"""
+from datetime import datetime
+from sqlalchemy import (Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table,
+                        UniqueConstraint, func, insert, inspect, literal, select)
+
+metadata = MetaData()
+
+users = Table(
+    'users', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('points', Integer),
+)
+
+points_ledger = Table(
+    'points_ledger', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('points', Integer, nullable=False),
+    Column('reason', String(50), nullable=False),
+    Column('ref', String(100)),
+    Column('created_at', DateTime),
+    UniqueConstraint('reason', 'ref', name='uq_points_ledger_reason_ref'),
+    Index('ix_points_ledger_user_id_id', 'user_id', 'id'),
+)
+
+
+def upgrade(connection):
+    if inspect(connection).has_table(points_ledger.name):
+        # Already created by db.create_all() from the models
+        return
+    points_ledger.create(connection)
+    connection.execute(insert(points_ledger).from_select(
+        ['user_id', 'points', 'reason', 'created_at'],
+        select(users.c.id, users.c.points, literal('opening_balance'), literal(datetime.utcnow()))
+        .where(func.coalesce(users.c.points, 0) != 0)
+    ))
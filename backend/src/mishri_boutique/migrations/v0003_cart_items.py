@@ -0,0 +1,24 @@
+"""Cart items: the saved cart of each signed-in user."""
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, MetaData, Table, UniqueConstraint
+
+metadata = MetaData()
+
+Table('users', metadata, Column('id', Integer, primary_key=True))
+Table('products', metadata, Column('id', Integer, primary_key=True))
+Table('sizes', metadata, Column('id', Integer, primary_key=True))
+
+cart_items = Table(
+    'cart_items', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('product_id', Integer, ForeignKey('products.id', ondelete='CASCADE'), nullable=False),
+    Column('size_id', Integer, ForeignKey('sizes.id'), nullable=False),
+    Column('quantity', Integer, nullable=False),
+    Column('updated_at', DateTime),
+    UniqueConstraint('user_id', 'product_id', 'size_id', name='uq_cart_items_line'),
+)
+
+
+def upgrade(connection):
+    # Already there if db.create_all() made it from the models
+    cart_items.create(connection, checkfirst=True)
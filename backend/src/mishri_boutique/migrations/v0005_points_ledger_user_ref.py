@@ -0,0 +1,52 @@
+"""Points ledger refs are unique per user rather than across all users.
+
+v0002 made (reason, ref) unique, so one user's credit with a given ref
+blocked every other user's. The constraint becomes (user_id, reason, ref).
+SQLite cannot drop a constraint declared in CREATE TABLE, so there the table
+is rebuilt and its rows copied over.
+"""
+from sqlalchemy import (Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table,
+                        UniqueConstraint, insert, inspect, select, text)
+from sqlalchemy.schema import AddConstraint
+
+metadata = MetaData()
+
+Table('users', metadata, Column('id', Integer, primary_key=True))
+
+points_ledger = Table(
+    'points_ledger', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('points', Integer, nullable=False),
+    Column('reason', String(50), nullable=False),
+    Column('ref', String(100)),
+    Column('created_at', DateTime),
+    UniqueConstraint('user_id', 'reason', 'ref', name='uq_points_ledger_user_reason_ref'),
+    Index('ix_points_ledger_user_id_id', 'user_id', 'id'),
+)
+
+OLD_CONSTRAINT = 'uq_points_ledger_reason_ref'
+NEW_CONSTRAINT = 'uq_points_ledger_user_reason_ref'
+
+
+def upgrade(connection):
+    names = {c['name'] for c in inspect(connection).get_unique_constraints(points_ledger.name)}
+    if NEW_CONSTRAINT in names:
+        # Already created by db.create_all() from the models
+        return
+    if connection.dialect.name != 'sqlite':
+        if OLD_CONSTRAINT in names:
+            connection.execute(text('ALTER TABLE points_ledger DROP CONSTRAINT ' + OLD_CONSTRAINT))
+        connection.execute(AddConstraint(next(
+            c for c in points_ledger.constraints if c.name == NEW_CONSTRAINT)))
+        return
+
+    # Move the old table aside (its index first, so the name is free), then
+    # create the new one under the original name and copy every row across
+    connection.execute(text('DROP INDEX IF EXISTS ix_points_ledger_user_id_id'))
+    connection.execute(text('ALTER TABLE points_ledger RENAME TO points_ledger_v0004'))
+    points_ledger.create(connection)
+    old = Table('points_ledger_v0004', MetaData(), *(Column(c.name) for c in points_ledger.columns))
+    connection.execute(insert(points_ledger).from_select(
+        [c.name for c in points_ledger.columns], select(*old.columns)))
+    connection.execute(text('DROP TABLE points_ledger_v0004'))
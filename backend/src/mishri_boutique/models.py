@@ -22,9 +22,9 @@ class Size(db.Model):
     __tablename__ = 'sizes'
     
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(20), nullable=False)  # XS, S, M, L, XL, XXL, etc.
+    name = db.Column(db.String(20), nullable=False, index=True)  # XS, S, M, L, XL, XXL, etc.
     measurements = db.Column(db.String(100))  # e.g., "Bust: 36", Length: 45""
-    products = db.relationship('ProductSize', backref='size', lazy=True)
+    product_sizes = db.relationship('ProductSize', backref='size', lazy=True)
 
     def to_dict(self):
         return {
@@ -35,6 +35,10 @@ class Size(db.Model):
 
 class ProductSize(db.Model):
     __tablename__ = 'product_sizes'
+    __table_args__ = (
+        db.Index('ix_product_sizes_product_id', 'product_id'),
+        db.Index('ix_product_sizes_size_product', 'size_id', 'product_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
@@ -43,6 +47,18 @@ class ProductSize(db.Model):
 
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        # Keyset pagination indexes for the listing sort keys
+        db.Index('ix_products_created_at_id', 'created_at', 'id'),
+        db.Index('ix_products_price_id', 'price', 'id'),
+        # Faceted filter indexes; price is included so range filters stay on the index
+        db.Index('ix_products_fabric_price', 'fabric', 'price'),
+        db.Index('ix_products_style_price', 'style', 'price'),
+        db.Index('ix_products_occasion_price', 'occasion', 'price'),
+        db.Index('ix_products_sleeve_type', 'sleeve_type'),
+        db.Index('ix_products_neck_type', 'neck_type'),
+        db.Index('ix_products_category_id', 'category_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -62,7 +78,13 @@ class Product(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
-    sizes = db.relationship('Size', secondary='product_sizes', backref='products')
+    # Read-only view of the sizes; stock is written through product_sizes
+    sizes = db.relationship('Size', secondary='product_sizes', viewonly=True,
+                            backref=db.backref('products', viewonly=True))
+    product_sizes = db.relationship('ProductSize', backref='product', lazy=True,
+                                    cascade='all, delete-orphan')
+    image_assets = db.relationship('ProductImage', backref='product', lazy=True,
+                                   cascade='all, delete-orphan', order_by='ProductImage.position')
 
     def to_dict(self):
         return {
@@ -80,7 +102,215 @@ class Product(db.Model):
             'stock': self.stock,
             'is_featured': self.is_featured,
             'category_id': self.category_id,
-            'sizes': [size.to_dict() for size in self.sizes],
+            'sizes': [dict(ps.size.to_dict(), stock=ps.stock) for ps in self.product_sizes],
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
-        } 
\ No newline at end of file
+        } 
+
+class ProductImage(db.Model):
+    """Resized derivatives of one entry of Product.images (see images.py)"""
+    __tablename__ = 'product_images'
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'position', name='uq_product_images_position'),
+        db.Index('ix_product_images_source_url', 'source_url'),
+    )
+
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    source_url = db.Column(db.String(1000), nullable=False)
+    # Content address of the derivatives; null until processed
+    digest = db.Column(db.String(64))
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    status = db.Column(db.String(20), nullable=False, default=PENDING)
+    error = db.Column(db.String(255))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ProductListing(db.Model):
+    """Denormalized copy of a product as listed in the catalog (see product_listing.py).
+
+    Rebuilt from products, product_sizes, sizes, categories and
+    product_images whenever one of them changes, so listing reads are a
+    single scan of this table.
+    """
+    __tablename__ = 'product_listing'
+    __table_args__ = (
+        db.Index('ix_product_listing_created_at_id', 'created_at', 'product_id'),
+        db.Index('ix_product_listing_price_id', 'price', 'product_id'),
+        db.Index('ix_product_listing_effective_price', 'effective_price'),
+        db.Index('ix_product_listing_category_id', 'category_id', 'product_id'),
+        db.Index('ix_product_listing_featured', 'is_featured', 'product_id'),
+        db.Index('ix_product_listing_fabric_price', 'fabric', 'price'),
+        db.Index('ix_product_listing_style_price', 'style', 'price'),
+        db.Index('ix_product_listing_occasion_price', 'occasion', 'price'),
+    )
+
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text)
+    price = db.Column(db.Float, nullable=False)
+    sale_price = db.Column(db.Float)
+    # sale_price if set, else price
+    effective_price = db.Column(db.Float, nullable=False)
+    fabric = db.Column(db.String(100))
+    style = db.Column(db.String(100))
+    occasion = db.Column(db.String(100))
+    sleeve_type = db.Column(db.String(100))
+    neck_type = db.Column(db.String(100))
+    images = db.Column(db.JSON)
+    primary_image = db.Column(db.String(1000))
+    image_variants = db.Column(db.JSON)
+    category_id = db.Column(db.Integer, nullable=False)
+    category_name = db.Column(db.String(100))
+    # Sizes as served ([{id, name, measurements, stock}, ...]) and their
+    # names as '|S|M|L|' for size filters
+    sizes = db.Column(db.JSON)
+    size_names = db.Column(db.String(500))
+    stock = db.Column(db.Integer)
+    is_featured = db.Column(db.Boolean)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+
+class Reservation(db.Model):
+    __tablename__ = 'reservations'
+    __table_args__ = (
+        # The expiry sweep scans held reservations by expiry time
+        db.Index('ix_reservations_status_expires_at', 'status', 'expires_at'),
+    )
+
+    HELD = 'held'
+    COMMITTED = 'committed'
+    RELEASED = 'released'
+
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(36), unique=True, nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    size_id = db.Column(db.Integer, db.ForeignKey('sizes.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    quantity = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=HELD)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'token': self.token,
+            'product_id': self.product_id,
+            'size_id': self.size_id,
+            'quantity': self.quantity,
+            'status': self.status,
+            'expires_at': self.expires_at.isoformat()
+        }
+
+
+class CartItem(db.Model):
+    """One line of a signed-in user's saved cart (see cart.py)"""
+    __tablename__ = 'cart_items'
+    __table_args__ = (
+        # Also the index the cart is read by
+        db.UniqueConstraint('user_id', 'product_id', 'size_id', name='uq_cart_items_line'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    size_id = db.Column(db.Integer, db.ForeignKey('sizes.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class Order(db.Model):
+    __tablename__ = 'orders'
+    __table_args__ = (
+        # A retried checkout with the same Idempotency-Key maps to one order
+        db.UniqueConstraint('user_id', 'idempotency_key', name='uq_orders_user_idempotency_key'),
+        db.Index('ix_orders_user_id_id', 'user_id', 'id'),
+    )
+
+    PLACED = 'placed'
+    CANCELLED = 'cancelled'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=PLACED)
+    total = db.Column(db.Float, nullable=False, default=0)
+    idempotency_key = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    items = db.relationship('OrderItem', backref='order', lazy=True, cascade='all, delete-orphan')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'total': self.total,
+            'items': [item.to_dict() for item in self.items],
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+
+
+class OrderItem(db.Model):
+    __tablename__ = 'order_items'
+
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    size_id = db.Column(db.Integer, db.ForeignKey('sizes.id'), nullable=False)
+    product_name = db.Column(db.String(200), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    unit_price = db.Column(db.Float, nullable=False)
+
+    def to_dict(self):
+        return {
+            'product_id': self.product_id,
+            'size_id': self.size_id,
+            'name': self.product_name,
+            'quantity': self.quantity,
+            'unit_price': self.unit_price
+        }
+
+
+class Job(db.Model):
+    """Queued background work (see jobs.py)"""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+        db.Index('ix_jobs_key', 'key'),
+    )
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    # Jobs enqueued with a key are skipped while one with the same key is queued
+    key = db.Column(db.String(200))
+    status = db.Column(db.String(20), nullable=False, default=QUEUED)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'payload': self.payload,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_at': self.run_at.isoformat(),
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat()
+        }
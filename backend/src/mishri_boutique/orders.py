@@ -0,0 +1,201 @@
+from datetime import datetime
+from sqlalchemy import insert, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from . import db
+from .inventory import InsufficientStock, adjust_stock, adjust_stock_bulk, commit_reservation
+from .listing import decode_cursor, encode_cursor, parse_limit
+from .models import Order, OrderItem, Product, ProductSize, Reservation
+
+
+class OrderError(ValueError):
+    """Raised for malformed order requests"""
+
+
+def parse_lines(items):
+    """Normalise request items into {(product_id, size_id): quantity}.
+
+    Accepts {product_id, size_id, quantity} as well as the cart's
+    {id, size: {id}, quantity} shape; repeated lines are merged.
+    """
+    if not items:
+        raise OrderError('Order has no items')
+    if not isinstance(items, (list, tuple)):
+        raise OrderError('items must be a list')
+    lines = {}
+    for item in items:
+        if not isinstance(item, dict):
+            raise OrderError('Each item needs a product_id, size_id and quantity')
+        try:
+            product_id = int(item.get('product_id', item.get('id')))
+            size = item.get('size_id', item.get('size'))
+            size_id = int(size['id'] if isinstance(size, dict) else size)
+            quantity = int(item.get('quantity', 1))
+        except (TypeError, ValueError, KeyError):
+            raise OrderError('Each item needs a product_id, size_id and quantity')
+        if quantity <= 0:
+            raise OrderError('Quantities must be positive')
+        lines[(product_id, size_id)] = lines.get((product_id, size_id), 0) + quantity
+    return lines
+
+
+def _stock_rows(pairs):
+    # One query for every line: the size row plus the product fields we copy
+    return {
+        (row.product_id, row.size_id): row for row in db.session.query(
+            ProductSize.id, ProductSize.product_id, ProductSize.size_id, ProductSize.stock,
+            Product.name, Product.price, Product.sale_price
+        ).join(Product, Product.id == ProductSize.product_id)
+        .filter(tuple_(ProductSize.product_id, ProductSize.size_id).in_(list(pairs)))
+    }
+
+
+def find_order(user_id, idempotency_key):
+    if not idempotency_key:
+        return None
+    return Order.query.filter_by(user_id=user_id, idempotency_key=idempotency_key).first()
+
+
+def _claim_reservations(user_id, tokens, lines):
+    """Commit the user's held reservations for this order.
+
+    Returns {(product_id, size_id): units already taken from stock}, capped
+    at the ordered quantity; any excess is given back to stock.
+    """
+    if not isinstance(tokens, (list, tuple)) or not all(isinstance(t, str) for t in tokens):
+        raise OrderError('reservations must be a list of reservation tokens')
+    reservations = Reservation.query.filter(Reservation.token.in_(set(tokens))).all()
+    if len(reservations) != len(set(tokens)):
+        raise OrderError('Unknown reservation')
+    now = datetime.utcnow()
+    held = {}
+    for reservation in reservations:
+        pair = (reservation.product_id, reservation.size_id)
+        if reservation.user_id is None or int(reservation.user_id) != user_id:
+            raise OrderError('Unknown reservation')
+        if reservation.status != Reservation.HELD or reservation.expires_at <= now:
+            raise OrderError('Reservation %s is no longer held' % reservation.token)
+        if pair not in lines:
+            raise OrderError('Reservation %s is not for an item in this order' % reservation.token)
+        # Only one caller moves a reservation out of HELD; a lost race means
+        # the expiry sweep already gave its stock back
+        if not commit_reservation(reservation):
+            raise OrderError('Reservation %s is no longer held' % reservation.token)
+        held[pair] = held.get(pair, 0) + reservation.quantity
+
+    for (product_id, size_id), quantity in held.items():
+        excess = quantity - lines[(product_id, size_id)]
+        if excess > 0:
+            adjust_stock(product_id, size_id, excess)
+            held[(product_id, size_id)] = lines[(product_id, size_id)]
+    return held
+
+
+def place_order(user_id, items, idempotency_key=None, reservations=()):
+    """Create an order and take its stock in a single transaction.
+
+    `reservations` are tokens of the user's held reservations (see
+    inventory.reserve); their units are already out of stock, so they are
+    committed instead of being taken a second time. Returns (order,
+    created). When `idempotency_key` was already used by this user the
+    original order is returned with created=False and nothing is written.
+    Raises OrderError or InsufficientStock (after rolling back).
+    """
+    existing = find_order(user_id, idempotency_key)
+    if existing is not None:
+        return existing, False
+
+    lines = parse_lines(items)
+    rows = _stock_rows(lines)
+    for pair in lines:
+        if pair not in rows:
+            raise OrderError('Product %d is not available in size %d' % pair)
+    try:
+        held = _claim_reservations(user_id, reservations, lines) if reservations else {}
+    except OrderError:
+        db.session.rollback()
+        raise
+    # Units still to take from stock once reservations are accounted for
+    needed = {pair: quantity - held.get(pair, 0) for pair, quantity in lines.items()
+              if quantity > held.get(pair, 0)}
+    for (product_id, size_id), quantity in needed.items():
+        if rows[(product_id, size_id)].stock < quantity:
+            db.session.rollback()
+            raise InsufficientStock(product_id, size_id, quantity)
+
+    # The pre-check above is only advisory; the conditional bulk decrement is
+    # what guarantees no oversell when checkouts race
+    if not adjust_stock_bulk([(rows[pair].id, pair[0], quantity) for pair, quantity in needed.items()]):
+        db.session.rollback()
+        product_id, size_id = _first_short(needed)
+        raise InsufficientStock(product_id, size_id, needed[(product_id, size_id)])
+
+    item_rows = []
+    for (product_id, size_id), quantity in lines.items():
+        row = rows[(product_id, size_id)]
+        item_rows.append({
+            'product_id': product_id,
+            'size_id': size_id,
+            'product_name': row.name,
+            'quantity': quantity,
+            'unit_price': row.sale_price if row.sale_price is not None else row.price
+        })
+    order = Order(
+        user_id=user_id,
+        idempotency_key=idempotency_key,
+        total=round(sum(i['unit_price'] * i['quantity'] for i in item_rows), 2)
+    )
+
+    try:
+        db.session.add(order)
+        db.session.flush()
+        # One executemany INSERT for all line items
+        for item in item_rows:
+            item['order_id'] = order.id
+        db.session.execute(insert(OrderItem), item_rows)
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent retry with the same key won; our stock change rolls back
+        db.session.rollback()
+        winner = find_order(user_id, idempotency_key)
+        if winner is None:
+            raise
+        return winner, False
+    return order, True
+
+
+def _first_short(lines):
+    rows = _stock_rows(lines)
+    for pair, quantity in lines.items():
+        row = rows.get(pair)
+        if row is None or row.stock < quantity:
+            return pair
+    return next(iter(lines))
+
+
+def cancel_order(order):
+    """Cancel a placed order and put its stock back. Returns False if it
+    was not in the placed state. Commits."""
+    updated = Order.query.filter_by(id=order.id, status=Order.PLACED).update(
+        {Order.status: Order.CANCELLED}, synchronize_session=False
+    )
+    if not updated:
+        return False
+    lines = {(item.product_id, item.size_id): item.quantity for item in order.items}
+    rows = _stock_rows(lines)
+    adjust_stock_bulk([(rows[pair].id, pair[0], quantity)
+                       for pair, quantity in lines.items() if pair in rows], sign=1)
+    db.session.commit()
+    return True
+
+
+def list_orders(user_id, limit=None, cursor=None):
+    """A page of the user's orders, newest first, keyset-paginated on id"""
+    limit = parse_limit(limit)
+    query = (Order.query.options(selectinload(Order.items))
+             .filter(Order.user_id == user_id))
+    if cursor:
+        query = query.filter(Order.id < decode_cursor(cursor))
+    orders = query.order_by(Order.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(orders[limit - 1].id) if len(orders) > limit else None
+    return orders[:limit], next_cursor
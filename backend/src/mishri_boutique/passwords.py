@@ -0,0 +1,137 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+try:
+    import bcrypt
+except ImportError:  # bcrypt is optional; werkzeug's pbkdf2 is always available
+    bcrypt = None
+
+SCHEMES = ('bcrypt', 'pbkdf2')
+
+# Werkzeug method used for the pbkdf2 scheme
+PBKDF2_METHOD = 'pbkdf2:sha256:600000'
+
+
+class HashPoolBusy(Exception):
+    """Raised when too many hash computations are already queued"""
+
+
+def _scheme():
+    scheme = current_app.config['PASSWORD_SCHEME']
+    if scheme == 'bcrypt' and bcrypt is None:
+        return 'pbkdf2'
+    return scheme
+
+
+def _hash(password, scheme, rounds):
+    if scheme == 'bcrypt':
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('ascii')
+    return generate_password_hash(password, method=PBKDF2_METHOD)
+
+
+def _verify(stored, password):
+    if not stored:
+        return False
+    if stored.startswith('$2'):
+        if bcrypt is None:
+            return False
+        return bcrypt.checkpw(password.encode('utf-8'), stored.encode('ascii'))
+    return check_password_hash(stored, password)
+
+
+def needs_rehash(stored):
+    """True if `stored` was made with another scheme or cost than configured"""
+    if _scheme() == 'bcrypt':
+        # $2b$<rounds>$<salt and hash>
+        rounds = '%02d' % current_app.config['BCRYPT_ROUNDS']
+        return not stored.startswith('$2') or stored.split('$')[2] != rounds
+    return not stored.startswith(PBKDF2_METHOD + '$')
+
+
+class HashPool:
+    """Bounded pool running password hashing off the request thread.
+
+    bcrypt and hashlib release the GIL while hashing, so a small pool keeps
+    hashing from starving other requests of CPU, and the queue bound turns a
+    login storm into fast HashPoolBusy errors instead of a growing backlog.
+    The ASGI login awaits the pool's futures (see asgi.AsgiApp.login), so
+    neither the event loop nor a thread waits on a hash there.
+    """
+
+    def __init__(self, workers, max_pending):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashPoolBusy()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+def _pool():
+    return current_app.extensions['password_hash_pool']
+
+
+def hash_password_async(password):
+    """Future resolving to a hash of `password` with the configured scheme. Raises HashPoolBusy."""
+    return _pool().submit(_hash, password, _scheme(), current_app.config['BCRYPT_ROUNDS'])
+
+
+def verify_password_async(stored, password):
+    """Future resolving to whether `password` matches `stored`. Raises HashPoolBusy."""
+    return _pool().submit(_verify, stored, password)
+
+
+def _dummy_verify(extensions, scheme, rounds, password):
+    dummy = extensions.get('password_dummy_hash')
+    if dummy is None:
+        # Made on first use rather than at startup, which it would slow down
+        dummy = extensions['password_dummy_hash'] = _hash('dummy-password', scheme, rounds)
+    _verify(dummy, password)
+    return False
+
+
+def dummy_verify_async(password):
+    """Future resolving to False after the time a real check takes, so unknown
+    emails can't be told apart"""
+    return _pool().submit(_dummy_verify, current_app.extensions, _scheme(),
+                          current_app.config['BCRYPT_ROUNDS'], password)
+
+
+# Blocking variants for WSGI views; the pool still bounds how many hashes run
+def hash_password(password):
+    return hash_password_async(password).result()
+
+
+def verify_password(stored, password):
+    """Check `password` against a bcrypt or werkzeug hash. Raises HashPoolBusy."""
+    return verify_password_async(stored, password).result()
+
+
+def dummy_verify(password):
+    return dummy_verify_async(password).result()
+
+
+def init_app(app):
+    app.config.setdefault('PASSWORD_SCHEME', 'bcrypt')
+    app.config.setdefault('BCRYPT_ROUNDS', 12)
+    # Hashing is CPU bound, so more threads than cores only adds queueing
+    app.config.setdefault('PASSWORD_HASH_WORKERS', os.cpu_count() or 2)
+    app.config.setdefault('PASSWORD_HASH_MAX_PENDING', 64)
+    if app.config['PASSWORD_SCHEME'] not in SCHEMES:
+        raise ValueError('Unknown PASSWORD_SCHEME: ' + app.config['PASSWORD_SCHEME'])
+
+    app.extensions['password_hash_pool'] = HashPool(app.config['PASSWORD_HASH_WORKERS'],
+                                                    app.config['PASSWORD_HASH_MAX_PENDING'])
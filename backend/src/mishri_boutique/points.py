@@ -0,0 +1,192 @@
+import click
+from flask.cli import AppGroup
+from sqlalchemy import case, func, insert, literal, or_, select, tuple_, update
+from . import db
+from .user import PointsEntry, User, UserType
+
+# Users changed per UPDATE in accrue_bulk, to stay well under bind parameter limits
+BULK_CHUNK = 500
+
+
+class PointsError(ValueError):
+    """Raised for malformed points entries"""
+
+
+def tier_for(points):
+    """SQL expression of the UserType a points balance earns (see User.update_user_type)"""
+    user_type = User.__table__.c.user_type.type
+    return case(
+        (points >= User.PREMIUM_THRESHOLD, literal(UserType.PREMIUM, user_type)),
+        (points >= User.PLUS_THRESHOLD, literal(UserType.PLUS, user_type)),
+        else_=literal(UserType.BASIC, user_type)
+    )
+
+
+def _balance():
+    return func.coalesce(User.points, 0)
+
+
+def accrue(user_id, points, reason, ref=None):
+    """Atomically add `points` (possibly negative) to a user and log it.
+
+    A single UPDATE moves the balance and the tier together
+    (SET points = points + n, user_type = CASE ...), so concurrent accruals
+    never overwrite each other. A deduction only applies while the balance
+    covers it. Returns (points, user_type) after the change, or None if
+    nothing was changed. Does not commit.
+    """
+    points = _parse_points(points)
+    new_balance = _balance() + points
+    statement = (update(User)
+                 .where(User.id == user_id)
+                 .values({User.points: new_balance, User.user_type: tier_for(new_balance)})
+                 .execution_options(synchronize_session=False))
+    if points < 0:
+        statement = statement.where(_balance() >= -points)
+
+    dialect = db.session.get_bind(User).dialect
+    if dialect.update_returning:
+        row = db.session.execute(statement.returning(User.points, User.user_type)).first()
+    elif db.session.execute(statement).rowcount:
+        # The row is ours until the transaction ends, so this reads our write
+        row = db.session.execute(select(User.points, User.user_type).where(User.id == user_id)).first()
+    else:
+        row = None
+    if row is None:
+        return None
+    db.session.add(PointsEntry(user_id=user_id, points=points, reason=reason, ref=ref))
+    return row.points, row.user_type
+
+
+def accrue_bulk(entries):
+    """Credit many entries at once, e.g. points for a batch of orders.
+
+    `entries` are dicts with user_id, points (positive), reason and
+    optionally ref. Entries whose (user_id, reason, ref) is already in the
+    ledger are skipped, so a batch job can safely run again. The ledger rows
+    go in with one executemany INSERT; balances and tiers are updated with
+    one statement each per BULK_CHUNK users. Returns the number of entries
+    credited. Raises PointsError for unknown users (the caller should then
+    roll back). Does not commit.
+    """
+    rows = []
+    for entry in entries:
+        try:
+            row = {'user_id': int(entry['user_id']), 'points': _parse_points(entry['points']),
+                   'reason': entry['reason'], 'ref': entry.get('ref')}
+        except (KeyError, TypeError, ValueError):
+            raise PointsError('Each entry needs a user_id, points and reason')
+        if row['points'] < 0:
+            raise PointsError('Bulk entries can only credit points')
+        if row['ref'] is not None:
+            row['ref'] = str(row['ref'])
+        rows.append(row)
+
+    keyed = {(row['user_id'], row['reason'], row['ref']) for row in rows if row['ref'] is not None}
+    if keyed:
+        seen = set()
+        done = _credited(keyed)
+        fresh = []
+        for row in rows:
+            key = (row['user_id'], row['reason'], row['ref'])
+            if row['ref'] is not None and (key in done or key in seen):
+                continue
+            seen.add(key)
+            fresh.append(row)
+        rows = fresh
+    if not rows:
+        return 0
+
+    by_user = {}
+    for row in rows:
+        by_user[row['user_id']] = by_user.get(row['user_id'], 0) + row['points']
+    user_ids = list(by_user)
+    for start in range(0, len(user_ids), BULK_CHUNK):
+        chunk = {user_id: by_user[user_id] for user_id in user_ids[start:start + BULK_CHUNK]}
+        updated = db.session.execute(
+            update(User).where(User.id.in_(chunk))
+            .values({User.points: _balance() + case(chunk, value=User.id)})
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if updated != len(chunk):
+            found = set(db.session.scalars(select(User.id).where(User.id.in_(chunk))))
+            raise PointsError('Unknown users: %s' % ', '.join(str(i) for i in sorted(set(chunk) - found)))
+        recompute_tiers(chunk)
+    db.session.execute(insert(PointsEntry), rows)
+    return len(rows)
+
+
+def _credited(keys):
+    keys = list(keys)
+    done = set()
+    for start in range(0, len(keys), BULK_CHUNK):
+        done.update(db.session.execute(
+            select(PointsEntry.user_id, PointsEntry.reason, PointsEntry.ref)
+            .where(tuple_(PointsEntry.user_id, PointsEntry.reason, PointsEntry.ref)
+                   .in_(keys[start:start + BULK_CHUNK]))
+        ).tuples())
+    return done
+
+
+def recompute_tiers(user_ids=None):
+    """Bring user_type in line with points for the given users (all by default).
+
+    One set-based UPDATE that only touches rows whose tier is wrong. Returns
+    the number of users changed. Does not commit.
+    """
+    tier = tier_for(_balance())
+    statement = (update(User)
+                 .where(or_(User.user_type.is_(None), User.user_type != tier))
+                 .values({User.user_type: tier})
+                 .execution_options(synchronize_session=False))
+    if user_ids is not None:
+        statement = statement.where(User.id.in_(list(user_ids)))
+    return db.session.execute(statement).rowcount
+
+
+def mismatched_balances(limit=100):
+    """(user_id, points, ledger sum) of users whose balance disagrees with their ledger"""
+    ledger = (select(PointsEntry.user_id, func.sum(PointsEntry.points).label('total'))
+              .group_by(PointsEntry.user_id).subquery())
+    total = func.coalesce(ledger.c.total, 0)
+    return db.session.execute(
+        select(User.id, _balance(), total)
+        .outerjoin(ledger, ledger.c.user_id == User.id)
+        .where(_balance() != total)
+        .order_by(User.id).limit(limit)
+    ).tuples().all()
+
+
+def _parse_points(points):
+    try:
+        value = int(points)
+    except (TypeError, ValueError):
+        raise PointsError('Points must be a whole number')
+    if isinstance(points, bool) or (isinstance(points, float) and points != value) or not value:
+        raise PointsError('Points must be a non-zero whole number')
+    return value
+
+
+points_cli = AppGroup('points', help='Loyalty points.')
+
+
+@points_cli.command('recompute-tiers')
+def recompute_tiers_command():
+    """Set every user's tier from their points (e.g. after changing thresholds)."""
+    changed = recompute_tiers()
+    db.session.commit()
+    click.echo('Updated %d users' % changed)
+
+
+@points_cli.command('verify')
+@click.option('--limit', default=100, show_default=True)
+def verify_command(limit):
+    """List users whose points do not match their ledger."""
+    mismatched = mismatched_balances(limit)
+    for user_id, points, total in mismatched:
+        click.echo('user %d: points=%d ledger=%d' % (user_id, points, total))
+    click.echo('%d mismatched users' % len(mismatched) if mismatched else 'All balances match the ledger')
+
+
+def init_app(app):
+    app.cli.add_command(points_cli)
@@ -0,0 +1,245 @@
+from itertools import chain
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import delete, event, insert, select
+from . import db
+from .database import RoutingSession
+from .images import image_variants
+from .models import Category, Product, ProductImage, ProductListing, ProductSize, Size
+
+# Products rebuilt per statement batch
+CHUNK_SIZE = 500
+
+# Columns copied as-is from products
+COPIED_COLUMNS = ('name', 'description', 'price', 'sale_price', 'fabric', 'style', 'occasion',
+                  'sleeve_type', 'neck_type', 'images', 'category_id', 'stock', 'is_featured',
+                  'created_at', 'updated_at')
+
+
+def _chunks(ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def build_rows(connection, product_ids, lock=False):
+    """product_listing rows of the given products, read with three queries.
+
+    With `lock` the product rows are locked (where supported) so concurrent
+    refreshes of one product run one after the other.
+    """
+    statement = (select(Product.id, *[getattr(Product, c) for c in COPIED_COLUMNS],
+                        Category.name.label('category_name'))
+                 .outerjoin(Category, Category.id == Product.category_id)
+                 .where(Product.id.in_(product_ids)))
+    if lock:
+        statement = statement.with_for_update(of=Product)
+    products = connection.execute(statement).all()
+    sizes = {}
+    for product_id, size_id, name, measurements, stock in connection.execute(
+            select(ProductSize.product_id, Size.id, Size.name, Size.measurements, ProductSize.stock)
+            .join(Size, Size.id == ProductSize.size_id)
+            .where(ProductSize.product_id.in_(product_ids))
+            .order_by(ProductSize.id)):
+        sizes.setdefault(product_id, []).append(
+            {'id': size_id, 'name': name, 'measurements': measurements, 'stock': stock})
+    assets = {}
+    for asset in connection.execute(select(ProductImage).where(ProductImage.product_id.in_(product_ids))):
+        assets.setdefault(asset.product_id, []).append(asset)
+
+    rows = []
+    for product in products:
+        row = {c: getattr(product, c) for c in COPIED_COLUMNS}
+        product_sizes = sizes.get(product.id, [])
+        row.update(
+            product_id=product.id,
+            effective_price=product.price if product.sale_price is None else product.sale_price,
+            primary_image=product.images[0] if product.images else None,
+            image_variants=image_variants(product.images, assets.get(product.id, [])),
+            category_name=product.category_name,
+            sizes=product_sizes,
+            size_names=''.join('|' + s['name'] for s in product_sizes) + '|' if product_sizes else None,
+        )
+        rows.append(row)
+    return rows
+
+
+def refresh_listings(product_ids, connection=None):
+    """Rebuild the product_listing rows of `product_ids` in the current transaction.
+
+    Ids of deleted products just lose their row. Returns the ids of the
+    categories the products were or now are in.
+    """
+    connection = connection or db.session.connection()
+    category_ids = set()
+    for chunk in _chunks(set(product_ids)):
+        rows = build_rows(connection, chunk, lock=True)
+        stale = delete(ProductListing).where(ProductListing.product_id.in_(chunk))
+        if connection.dialect.delete_returning:
+            category_ids.update(connection.scalars(stale.returning(ProductListing.category_id)))
+        else:
+            category_ids.update(connection.scalars(
+                select(ProductListing.category_id).where(ProductListing.product_id.in_(chunk))))
+            connection.execute(stale)
+        if rows:
+            connection.execute(insert(ProductListing), rows)
+            category_ids.update(row['category_id'] for row in rows)
+    return category_ids
+
+
+def mark_stale(product_ids):
+    """Refresh these products' listings when the current transaction commits.
+
+    ORM changes to products, sizes, categories and images are picked up
+    automatically; writers using bulk UPDATE/INSERT statements call this.
+    """
+    _pending(db.session)['products'].update(product_ids)
+
+
+def _pending(session):
+    return session.info.setdefault('stale_listings', {'products': set(), 'categories': set(), 'sizes': set()})
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _collect_stale(session, flush_context):
+    pending = None
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Product):
+            ids, key = (obj.id,), 'products'
+        elif isinstance(obj, (ProductSize, ProductImage)):
+            ids, key = (obj.product_id,), 'products'
+        elif isinstance(obj, Category) and obj not in session.new:
+            ids, key = (obj.id,), 'categories'
+        elif isinstance(obj, Size) and obj not in session.new:
+            ids, key = (obj.id,), 'sizes'
+        else:
+            continue
+        pending = pending or _pending(session)
+        pending[key].update(ids)
+
+
+@event.listens_for(RoutingSession, 'before_commit')
+def _refresh_stale(session):
+    # Flush first so the last ORM changes are collected too
+    session.flush()
+    pending = session.info.pop('stale_listings', None)
+    if not pending:
+        return
+    # Always read the primary, even inside read_replica views
+    connection = session.connection()
+    product_ids = set(pending['products'])
+    if pending['categories']:
+        product_ids.update(connection.scalars(
+            select(Product.id).where(Product.category_id.in_(pending['categories']))))
+    if pending['sizes']:
+        product_ids.update(connection.scalars(
+            select(ProductSize.product_id).where(ProductSize.size_id.in_(pending['sizes']))))
+    product_ids.discard(None)
+    if product_ids:
+        category_ids = refresh_listings(product_ids, connection)
+        session.info['changed_listings'] = (product_ids, category_ids)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _invalidate_cached(session):
+    # Stock changes from orders, reservations and sweeps land here too. The
+    # generations bumped here also version the catalog ETags; 'catalog'
+    # covers the list and filter views, where any product can appear
+    changed = session.info.pop('changed_listings', None)
+    cache = current_app.extensions.get('response_cache')
+    if changed and cache is not None:
+        product_ids, category_ids = changed
+        cache.invalidate('catalog', 'featured', *['product:%d' % i for i in product_ids],
+                         *['category:%d' % i for i in category_ids if i is not None])
+
+
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def _forget_stale(session, previous_transaction):
+    session.info.pop('stale_listings', None)
+    session.info.pop('changed_listings', None)
+
+
+def rebuild_listings():
+    """Rebuild the whole table, committing per chunk; returns the row count.
+
+    Rows are replaced in place, so listings stay readable meanwhile.
+    """
+    count = 0
+    last_id = 0
+    while True:
+        ids = db.session.scalars(select(Product.id).where(Product.id > last_id)
+                                 .order_by(Product.id).limit(CHUNK_SIZE)).all()
+        if not ids:
+            break
+        refresh_listings(ids)
+        db.session.commit()
+        count += len(ids)
+        last_id = ids[-1]
+    db.session.execute(delete(ProductListing).where(
+        ~select(Product.id).where(Product.id == ProductListing.product_id).exists()))
+    db.session.commit()
+    return count
+
+
+def check_listings(fix=False):
+    """Compare every listing row with one built from the source tables.
+
+    Returns {'missing': [ids], 'orphaned': [ids], 'mismatched': [ids]};
+    with `fix` those rows are rebuilt and committed.
+    """
+    report = {'missing': [], 'orphaned': [], 'mismatched': []}
+    connection = db.session.connection()
+    product_ids = set(connection.scalars(select(Product.id)))
+    listed_ids = set(connection.scalars(select(ProductListing.product_id)))
+    report['missing'] = sorted(product_ids - listed_ids)
+    report['orphaned'] = sorted(listed_ids - product_ids)
+
+    columns = [c.key for c in ProductListing.__table__.columns]
+    for chunk in _chunks(product_ids & listed_ids):
+        expected = {row['product_id']: row for row in build_rows(connection, chunk)}
+        for stored in connection.execute(select(ProductListing).where(ProductListing.product_id.in_(chunk))):
+            if any(getattr(stored, c) != expected[stored.product_id][c] for c in columns):
+                report['mismatched'].append(stored.product_id)
+
+    if fix:
+        stale = report['missing'] + report['orphaned'] + report['mismatched']
+        if stale:
+            refresh_listings(stale, connection)
+        db.session.commit()
+    return report
+
+
+listing_cli = AppGroup('listing', help='Denormalized product listing table.')
+
+
+@listing_cli.command('rebuild')
+def rebuild_command():
+    """Rebuild product_listing from the catalog tables."""
+    click.echo('Rebuilt %d listings' % rebuild_listings())
+
+
+@listing_cli.command('check')
+@click.option('--fix', is_flag=True, help='Rebuild the rows found to be out of date.')
+def check_command(fix):
+    """Verify product_listing matches the catalog tables."""
+    report = check_listings(fix=fix)
+    for kind, ids in report.items():
+        if ids:
+            click.echo('%s: %d (%s%s)' % (kind, len(ids), ', '.join(map(str, ids[:20])),
+                                          ', ...' if len(ids) > 20 else ''))
+    if not any(report.values()):
+        click.echo('product_listing is consistent')
+    elif not fix:
+        raise SystemExit(1)
+
+
+def fill_empty_listings():
+    """Build the table if it is empty while products exist (run after migrating)"""
+    if db.session.query(Product.id).first() and not db.session.query(ProductListing.product_id).first():
+        current_app.logger.info('Building product_listing for the existing catalog')
+        rebuild_listings()
+
+
+def init_app(app):
+    app.cli.add_command(listing_cli)
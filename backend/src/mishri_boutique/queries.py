@@ -0,0 +1,16 @@
+from sqlalchemy.orm import joinedload
+from .models import ProductSize
+
+
+def product_sizes_query(product_id):
+    """ProductSize rows of one product with their Size joined in"""
+    return (ProductSize.query
+            .options(joinedload(ProductSize.size))
+            .filter_by(product_id=product_id)
+            .order_by(ProductSize.size_id))
+
+
+def size_with_stock(product_size):
+    size_dict = product_size.size.to_dict()
+    size_dict['stock'] = product_size.stock
+    return size_dict
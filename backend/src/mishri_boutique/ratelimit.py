@@ -0,0 +1,96 @@
+import threading
+import time
+
+
+class MemoryLimiterStore:
+    """Fixed-window counters kept in the process (one set per worker)"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def incr(self, key, window):
+        now = time.time()
+        with self._lock:
+            if len(self._counts) >= self.max_keys:
+                self._counts = {k: v for k, v in self._counts.items() if v[1] > now}
+            count, expires_at = self._counts.get(key, (0, 0))
+            if expires_at <= now:
+                count, expires_at = 0, now + window
+            count += 1
+            self._counts[key] = (count, expires_at)
+            return count, expires_at - now
+
+    def peek(self, key):
+        now = time.time()
+        with self._lock:
+            count, expires_at = self._counts.get(key, (0, 0))
+            return (count, expires_at - now) if expires_at > now else (0, 0)
+
+    def reset(self, key):
+        with self._lock:
+            self._counts.pop(key, None)
+
+
+class RedisLimiterStore:
+    """Fixed-window counters shared by every worker through redis"""
+
+    def __init__(self, url, prefix='mishri:rl:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('CACHE_BACKEND=redis requires the redis package')
+        self._client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def incr(self, key, window):
+        pipe = self._client.pipeline()
+        pipe.incr(self.prefix + key)
+        pipe.expire(self.prefix + key, window, nx=True)
+        pipe.ttl(self.prefix + key)
+        count, _, ttl = pipe.execute()
+        return count, max(ttl, 0)
+
+    def peek(self, key):
+        pipe = self._client.pipeline()
+        pipe.get(self.prefix + key)
+        pipe.ttl(self.prefix + key)
+        count, ttl = pipe.execute()
+        return int(count or 0), max(ttl, 0)
+
+    def reset(self, key):
+        self._client.delete(self.prefix + key)
+
+
+class RateLimiter:
+    """Counts attempts per key in fixed windows.
+
+    Uses the same backend as the response cache, so limits are per worker
+    with the memory backend and global with redis.
+    """
+
+    def __init__(self, app=None):
+        self.store = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config.get('CACHE_BACKEND') == 'redis':
+            self.store = RedisLimiterStore(app.config['CACHE_REDIS_URL'])
+        else:
+            self.store = MemoryLimiterStore()
+        app.extensions['rate_limiter'] = self
+
+    def hit(self, key, limit, window):
+        """Record an attempt; returns seconds to wait if `limit` is exceeded, else 0"""
+        count, remaining = self.store.incr(key, window)
+        return max(1, int(remaining)) if count > limit else 0
+
+    def blocked(self, key, limit):
+        """Seconds to wait if `key` already used up `limit`, without counting"""
+        count, remaining = self.store.peek(key)
+        return max(1, int(remaining)) if count >= limit else 0
+
+    def reset(self, key):
+        self.store.reset(key)
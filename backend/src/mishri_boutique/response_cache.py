@@ -0,0 +1,209 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, g, request
+
+
+class MemoryBackend:
+    """In-process LRU cache with per-entry TTL.
+
+    Each worker process keeps its own copy, so invalidations only reach the
+    worker that handled the write; use the redis backend when running several
+    workers that must see writes immediately.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._marks = {}
+        self._lock = threading.Lock()
+        # Counters restart at 0 with the process; the epoch tells them apart
+        self.epoch = uuid.uuid4().hex
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        expires_at = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_counters(self, keys):
+        """(epoch, [value of each counter])"""
+        with self._lock:
+            return self.epoch, [self._counters.get(key, 0) for key in keys]
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def mark(self, key, timeout):
+        with self._lock:
+            self._marks[key] = time.monotonic() + timeout
+
+    def marked(self, keys):
+        """Whether any of `keys` was marked within its timeout"""
+        now = time.monotonic()
+        with self._lock:
+            return any(self._marks.get(key, 0) > now for key in keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+            self._marks.clear()
+            self.epoch = uuid.uuid4().hex
+
+
+class RedisBackend:
+    """Backend for redis (or any server speaking its protocol, e.g. KeyDB)"""
+
+    def __init__(self, url, prefix='mishri:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('CACHE_BACKEND=redis requires the redis package')
+        self._client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self._client.get(self.prefix + key)
+
+    def set(self, key, value, timeout=None):
+        self._client.set(self.prefix + key, value, ex=timeout or None)
+
+    def get_counters(self, keys):
+        """(epoch, [value of each counter]) in one round trip"""
+        epoch, *values = self._client.mget([self.prefix + 'epoch'] + [self.prefix + k for k in keys])
+        if epoch is None:
+            # First use, or the counters were cleared: start a new epoch
+            self._client.set(self.prefix + 'epoch', uuid.uuid4().hex, nx=True)
+            epoch = self._client.get(self.prefix + 'epoch')
+        return epoch.decode() if isinstance(epoch, bytes) else epoch, [int(v or 0) for v in values]
+
+    def incr(self, key):
+        return self._client.incr(self.prefix + key)
+
+    def mark(self, key, timeout):
+        self._client.set(self.prefix + key, 1, px=int(timeout * 1000))
+
+    def marked(self, keys):
+        return self._client.exists(*[self.prefix + k for k in keys]) > 0
+
+    def clear(self):
+        keys = list(self._client.scan_iter(self.prefix + '*'))
+        if keys:
+            self._client.delete(*keys)
+
+
+class ResponseCache:
+    """Cache of serialized JSON responses for public catalog endpoints.
+
+    Entries are grouped into namespaces such as 'product:12' or 'featured'.
+    Every namespace has a generation counter that is part of the cache key, so
+    invalidating a namespace is a single counter bump and stale entries simply
+    age out of the LRU. The same generations version the catalog ETags (see
+    http_cache.conditional).
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.replica_lag = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_BACKEND', 'memory')
+        app.config.setdefault('CACHE_DEFAULT_TIMEOUT', 300)
+        app.config.setdefault('CACHE_MAX_ENTRIES', 1024)
+        app.config.setdefault('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+        app.config.setdefault('CACHE_REPLICA_LAG_SECONDS', 5)
+
+        backend = app.config['CACHE_BACKEND']
+        if backend == 'redis':
+            self.backend = RedisBackend(app.config['CACHE_REDIS_URL'])
+        elif backend == 'memory':
+            self.backend = MemoryBackend(app.config['CACHE_MAX_ENTRIES'])
+        else:
+            raise ValueError('Unknown CACHE_BACKEND: ' + backend)
+        # How long after an invalidation a replica may still return the old
+        # rows; only matters when reads go to a replica
+        if app.config.get('DATABASE_REPLICA_URL'):
+            self.replica_lag = app.config['CACHE_REPLICA_LAG_SECONDS']
+        app.extensions['response_cache'] = self
+
+    def generations(self, namespaces):
+        """Current version of `namespaces`; changes whenever one is invalidated"""
+        epoch, counters = self.backend.get_counters(['gen:' + ns for ns in namespaces])
+        return '%s/%s' % (epoch, ','.join('%s@%d' % pair for pair in zip(namespaces, counters)))
+
+    def key(self, namespaces, endpoint, tier, generations=None):
+        """Cache key of the current request's response"""
+        if generations is None:
+            generations = self.generations(namespaces)
+        args = '&'.join('%s=%s' % item for item in sorted(request.args.items(multi=True)))
+        return 'resp:%s:%s?%s|%s' % (endpoint, tier, args, generations)
+
+    def invalidate(self, *namespaces):
+        for ns in namespaces:
+            self.backend.incr('gen:' + ns)
+            if self.replica_lag:
+                self.backend.mark('settling:' + ns, self.replica_lag)
+
+    def settling(self, namespaces):
+        """Whether a replica read of `namespaces` may predate their last invalidation.
+
+        Such a body must not be stored: it would be cached under the new
+        generation and served until the next write.
+        """
+        return bool(self.replica_lag) and self.backend.marked(['settling:' + ns for ns in namespaces])
+
+    def clear(self):
+        self.backend.clear()
+
+    def cached(self, namespaces, tier=None, timeout=None):
+        """Decorator caching a view's 200 JSON responses.
+
+        `namespaces` is a callable receiving the view kwargs and returning the
+        namespaces the response depends on; `tier`, if given, returns the
+        caller's price visibility tier for views whose output depends on it.
+        """
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                names = namespaces(**kwargs)
+                key = self.key(names, request.endpoint, tier() if tier else 'all')
+                body = self.backend.get(key)
+                if body is not None:
+                    response = current_app.response_class(body, mimetype='application/json')
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                # Right after a write, read the body from the primary so the
+                # entry stored under the new generation is current
+                if g.get('use_replica') and self.settling(names):
+                    g.use_replica = False
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code == 200:
+                    self.backend.set(key, response.get_data(),
+                                     timeout or current_app.config['CACHE_DEFAULT_TIMEOUT'])
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
@@ -1,55 +1,192 @@
-from flask import jsonify, request
+import io
+from flask import Response, abort, current_app, jsonify, request, stream_with_context
 from flask_jwt_extended import (
-    create_access_token,
     get_jwt_identity,
     jwt_required,
     current_user
 )
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
-from . import db
-from .models import Product, Category, Size, ProductSize
+from . import db, cache, limiter
+from .models import Product, ProductListing, Category, Size, ProductSize, Reservation, Order, OrderItem
 from .user import User, UserType
+from .auth import (can_receive_promotions, can_view_prices, current_tier, issue_access_token,
+                   price_tier, record_login, user_for_reset_token)
+from .passwords import HashPoolBusy, dummy_verify, hash_password, needs_rehash, verify_password
+from .listing import (ListingError, decode_cursor, encode_cursor, list_products, parse_fields, parse_limit,
+                      product_serializer)
+from .queries import product_sizes_query, size_with_stock
+from .serializers import json_array_response
+from .facets import facet_counts, filter_criteria, parse_filters
+from .database import read_replica
+from .http_cache import conditional
+from .search import SearchUnavailable, search_product_ids
+from .inventory import InsufficientStock, release_reservation, reserve, set_size_stock
+from .orders import OrderError, cancel_order, list_orders, place_order
+from .catalog_io import DEFAULT_BATCH_SIZE, MAX_BATCH_SIZE, export_products, import_products, read_rows
+from .images import schedule_product_images, sync_product_images
+from .mail import queue_password_reset
+from .points import PointsError, accrue
+from .cart import (cart_view, line_rows, load_cart, merge_cart, parse_cart, remove_lines, replace_cart,
+                   valid_items)
+
+def product_rows(statement):
+    """Execute a product_listing SELECT, fetching rows in JSON_STREAM_CHUNK batches"""
+    return db.session.execute(
+        statement.execution_options(yield_per=current_app.config['JSON_STREAM_CHUNK']))
+
+def too_many_attempts(retry_after):
+    response = jsonify({'error': 'Too many login attempts, please try again later'})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+def hash_pool_busy():
+    response = jsonify({'error': 'Server busy, please retry'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def login_account_key(data):
+    return 'login-account:' + str(data.get('email', '')).strip().lower()
+
+def start_login(data):
+    """Rate-limit a login attempt and load its user.
+
+    Returns (error response, None) when the attempt is refused, otherwise
+    (None, user or None). The password is checked by the caller, off the
+    request thread where it can be (see asgi.AsgiApp.login).
+    """
+    config = current_app.config
+    retry_after = (limiter.hit('login-ip:%s' % request.remote_addr, config['LOGIN_RATE_LIMIT_IP'],
+                               config['LOGIN_RATE_WINDOW'])
+                   or limiter.blocked(login_account_key(data), config['LOGIN_RATE_LIMIT_ACCOUNT']))
+    if retry_after:
+        return too_many_attempts(retry_after), None
+    return None, User.query.filter_by(email=data['email']).first()
+
+def finish_login(data, user, valid, new_hash=None):
+    """Response to a login attempt once its password was checked"""
+    config = current_app.config
+    account_key = login_account_key(data)
+    if not valid:
+        # Only failures count towards the per-account limit
+        limiter.hit(account_key, config['LOGIN_RATE_LIMIT_ACCOUNT'], config['LOGIN_RATE_WINDOW'])
+        return jsonify({'error': 'Invalid credentials'}), 401
+
+    limiter.reset(account_key)
+    if new_hash is not None:
+        user.password_hash = new_hash
+        db.session.commit()
+
+    now = datetime.utcnow()
+    record_login(user.id, now)
+    user_data = user.to_dict()
+    user_data['last_login'] = now.isoformat()
+    response = {
+        'access_token': issue_access_token(user),
+        'user': user_data
+    }
+    # Carry a guest cart over into the saved one and return the result, so
+    # the client starts from the server's cart. Malformed lines are
+    # skipped and counted; they never fail the login or the other lines
+    items, skipped = valid_items(data.get('cart') or [])
+    try:
+        lines, _ = parse_cart(items)
+    except OrderError:
+        lines, skipped = {}, len(items) + skipped
+    lines, rows = merge_cart(user.id, lines)
+    response['cart'] = cart_view(lines, rows, user.can_view_prices)
+    response['cart']['skipped'] = skipped
+    return jsonify(response), 200
 
 def init_routes(app):
     # Auth routes
     @app.route('/api/auth/register', methods=['POST'])
     def register():
         data = request.get_json()
-        # Check if user already exists
-        if User.query.filter_by(email=data['email']).first():
+        # Check if user already exists (one query for both unique columns)
+        taken = db.session.query(User.email, User.username).filter(
+            or_(User.email == data['email'], User.username == data['username'])
+        ).all()
+        if any(email == data['email'] for email, _ in taken):
             return jsonify({'error': 'Email already registered'}), 400
-        if User.query.filter_by(username=data['username']).first():
+        if taken:
             return jsonify({'error': 'Username already taken'}), 400
         
+        try:
+            password_hash = hash_password(data['password'])
+        except HashPoolBusy:
+            return hash_pool_busy()
+        
         # Create new user
         user = User(
             username=data['username'],
             email=data['email'],
-            password_hash=generate_password_hash(data['password'])
+            password_hash=password_hash
         )
         
         db.session.add(user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Lost a race with a concurrent registration
+            db.session.rollback()
+            return jsonify({'error': 'Email or username already taken'}), 400
         
         return jsonify({'message': 'User registered successfully'}), 201
 
     @app.route('/api/auth/login', methods=['POST'])
     def login():
         data = request.get_json()
-        user = User.query.filter_by(email=data['email']).first()
-        
-        if user and check_password_hash(user.password_hash, data['password']):
-            user.last_login = datetime.utcnow()
+        error, user = start_login(data)
+        if error is not None:
+            return error
+        try:
+            if user:
+                valid = verify_password(user.password_hash, data['password'])
+            else:
+                valid = dummy_verify(data['password'])
+        except HashPoolBusy:
+            return hash_pool_busy()
+
+        new_hash = None
+        if valid and needs_rehash(user.password_hash):
+            # Upgrade hashes made with an older scheme or cost; retried next
+            # login if the pool is busy right now
+            try:
+                new_hash = hash_password(data['password'])
+            except HashPoolBusy:
+                pass
+        return finish_login(data, user, valid, new_hash)
+
+    @app.route('/api/auth/password-reset', methods=['POST'])
+    def request_password_reset():
+        data = request.get_json()
+        retry_after = limiter.hit('reset-ip:%s' % request.remote_addr, app.config['LOGIN_RATE_LIMIT_IP'],
+                                  app.config['LOGIN_RATE_WINDOW'])
+        if retry_after:
+            return too_many_attempts(retry_after)
+
+        user = User.query.filter_by(email=data.get('email')).first()
+        if user:
+            # Rendering and SMTP happen in the job worker, off the request
+            queue_password_reset(user)
             db.session.commit()
-            
-            access_token = create_access_token(identity=user.id)
-            return jsonify({
-                'access_token': access_token,
-                'user': user.to_dict()
-            }), 200
-        
-        return jsonify({'error': 'Invalid credentials'}), 401
+        # Same answer for unknown emails so this can't probe for accounts
+        return jsonify({'message': 'If the email is registered, a reset link has been sent'}), 202
+
+    @app.route('/api/auth/password-reset/<token>', methods=['POST'])
+    def reset_password(token):
+        data = request.get_json()
+        user = user_for_reset_token(token)
+        if user is None:
+            return jsonify({'error': 'Invalid or expired reset link'}), 400
+        try:
+            user.password_hash = hash_password(data['password'])
+        except HashPoolBusy:
+            return hash_pool_busy()
+        db.session.commit()
+        return jsonify({'message': 'Password updated successfully'}), 200
 
     # User Profile and Points Routes
     @app.route('/api/profile', methods=['GET'])
@@ -62,16 +199,47 @@ def init_routes(app):
     @app.route('/api/points/add', methods=['POST'])
     @jwt_required()
     def add_points():
+        user_id = int(get_jwt_identity())
+        data = request.get_json() or {}
+        ref = data.get('ref')
+        try:
+            if int(data.get('points', 0)) <= 0:
+                return jsonify({'error': 'Points must be a positive whole number'}), 400
+            result = accrue(user_id, data['points'], 'api', str(ref) if ref is not None else None)
+            if result is None:
+                return jsonify({'error': 'User not found'}), 404
+            db.session.commit()
+        except (PointsError, TypeError, ValueError):
+            return jsonify({'error': 'Points must be a positive whole number'}), 400
+        except IntegrityError:
+            # This user's ledger already has an entry with this ref
+            db.session.rollback()
+            return jsonify({'error': 'Points for this ref were already added'}), 409
+
+        # Built from the UPDATE's RETURNING row instead of reloading the user
+        points, user_type = result
+        response = {
+            'message': 'Points added successfully',
+            'user': {
+                'id': user_id,
+                'points': points,
+                'user_type': user_type.value,
+                'can_view_prices': user_type.can_view_prices,
+                'can_receive_promotions': user_type.can_receive_promotions
+            }
+        }
+        # The tier is embedded in the token, so reissue it when it changes
+        if user_type != current_tier():
+            response['access_token'] = issue_access_token(db.session.get(User, user_id))
+        return jsonify(response), 200
+
+    @app.route('/api/auth/refresh', methods=['POST'])
+    @jwt_required()
+    def refresh_token():
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        data = request.get_json()
-        
-        points = data.get('points', 0)
-        user.add_points(points)
-        db.session.commit()
-        
+        user = User.query.get_or_404(user_id)
         return jsonify({
-            'message': 'Points added successfully',
+            'access_token': issue_access_token(user),
             'user': user.to_dict()
         }), 200
 
@@ -79,23 +247,22 @@ def init_routes(app):
     @app.route('/api/check-price-access', methods=['GET'])
     @jwt_required()
     def check_price_access():
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
         return jsonify({
-            'can_view_prices': user.can_view_prices
+            'can_view_prices': can_view_prices()
         }), 200
 
     @app.route('/api/check-promotion-access', methods=['GET'])
     @jwt_required()
     def check_promotion_access():
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
         return jsonify({
-            'can_receive_promotions': user.can_receive_promotions
+            'can_receive_promotions': can_receive_promotions()
         }), 200
 
     # Category Routes
     @app.route('/api/categories', methods=['GET'])
+    @read_replica
+    @conditional(max_age=3600)
+    @cache.cached(lambda: ['categories'])
     def get_categories():
         categories = Category.query.all()
         return jsonify([{
@@ -114,6 +281,7 @@ def init_routes(app):
         )
         db.session.add(category)
         db.session.commit()
+        cache.invalidate('categories')
         return jsonify({
             'id': category.id,
             'name': category.name,
@@ -121,27 +289,48 @@ def init_routes(app):
         }), 201
 
     # Product Routes
+    def listing_criteria():
+        filters = filter_criteria(parse_filters(request.args), source=ProductListing)
+        category_id = request.args.get('category_id', type=int)
+        if category_id is not None:
+            filters.append(ProductListing.category_id == category_id)
+        return filters
+
     @app.route('/api/products', methods=['GET'])
+    @read_replica
+    @conditional(max_age=60, namespaces=lambda: ['catalog'], tier=price_tier)
     def get_products():
-        # Implementation here
-        return jsonify({"message": "Products endpoint"}), 200
+        filters = listing_criteria()
+
+        try:
+            products, next_cursor = list_products(
+                sort=request.args.get('sort'),
+                fields=parse_fields(request.args.get('fields')),
+                limit=request.args.get('limit', type=int),
+                cursor=request.args.get('cursor'),
+                can_view_prices=can_view_prices(),
+                filters=filters
+            )
+        except ListingError as e:
+            return jsonify({'error': str(e)}), 400
+
+        response = jsonify(products)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response, 200
 
     @app.route('/api/products/<int:product_id>', methods=['GET'])
+    @read_replica
+    @conditional(max_age=60, namespaces=lambda product_id: ['product:%d' % product_id],
+                 tier=price_tier)
+    @cache.cached(lambda product_id: ['product:%d' % product_id], tier=price_tier)
     def get_product(product_id):
-        user_id = get_jwt_identity() if request.headers.get('Authorization') else None
-        user = User.query.get(user_id) if user_id else None
-        
-        product = Product.query.get_or_404(product_id)
-        return jsonify({
-            'id': product.id,
-            'name': product.name,
-            'description': product.description,
-            'price': product.price if (user and user.can_view_prices) else None,
-            'category_id': product.category_id,
-            'image_url': product.image_url,
-            'stock': product.stock,
-            'is_featured': product.is_featured
-        }), 200
+        serializer = product_serializer(can_view_prices=can_view_prices())
+        row = db.session.execute(
+            serializer.select().where(ProductListing.product_id == product_id)).first()
+        if row is None:
+            abort(404)
+        return jsonify(serializer.serialize(row)), 200
 
     @app.route('/api/products', methods=['POST'])
     @jwt_required()
@@ -164,19 +353,22 @@ def init_routes(app):
         
         # Handle sizes and stock
         sizes_data = data.get('sizes', [])
+        size_ids = [s['size_id'] for s in sizes_data]
+        known = {s.id for s in Size.query.filter(Size.id.in_(size_ids)).all()} if size_ids else set()
         total_stock = 0
         for size_data in sizes_data:
-            size = Size.query.get(size_data['size_id'])
-            if size:
+            if size_data['size_id'] in known:
                 product_size = ProductSize(
-                    size_id=size.id,
+                    size_id=size_data['size_id'],
                     stock=size_data.get('stock', 0)
                 )
                 total_stock += product_size.stock
-                product.sizes.append(size)
+                product.product_sizes.append(product_size)
         
         product.stock = total_stock
         db.session.add(product)
+        if sync_product_images(product):
+            schedule_product_images(product)
         db.session.commit()
         
         return jsonify(product.to_dict()), 201
@@ -201,74 +393,83 @@ def init_routes(app):
         product.category_id = data.get('category_id', product.category_id)
         product.is_featured = data.get('is_featured', product.is_featured)
         
-        # Update sizes and stock
+        # Update sizes and stock in place; Product.stock moves by the difference
         if 'sizes' in data:
-            # Clear existing product sizes
-            ProductSize.query.filter_by(product_id=product.id).delete()
-            
-            total_stock = 0
-            for size_data in data['sizes']:
-                size = Size.query.get(size_data['size_id'])
-                if size:
-                    product_size = ProductSize(
-                        product_id=product.id,
-                        size_id=size.id,
-                        stock=size_data.get('stock', 0)
-                    )
-                    total_stock += product_size.stock
-                    db.session.add(product_size)
-            
-            product.stock = total_stock
+            set_size_stock(product, data['sizes'])
+        if sync_product_images(product):
+            schedule_product_images(product)
         
         db.session.commit()
         return jsonify(product.to_dict()), 200
 
+    @app.route('/api/products/bulk', methods=['POST'])
+    @jwt_required()
+    def bulk_import_products():
+        # Body is streamed: CSV when sent as text/csv, JSON lines otherwise
+        batch_size = request.args.get('batch_size', DEFAULT_BATCH_SIZE)
+        try:
+            batch_size = int(batch_size)
+        except ValueError:
+            batch_size = 0
+        if not 1 <= batch_size <= MAX_BATCH_SIZE:
+            return jsonify({'error': 'batch_size must be between 1 and %d' % MAX_BATCH_SIZE}), 400
+        fmt = 'csv' if request.mimetype == 'text/csv' else 'jsonl'
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8')
+        report = import_products(read_rows(stream, fmt), batch_size=batch_size)
+        return jsonify(report), 200 if not report['errors'] else 207
+
+    @app.route('/api/products/export', methods=['GET'])
+    @read_replica
+    @jwt_required()
+    def export_catalog():
+        return Response(stream_with_context(export_products(include_prices=can_view_prices())),
+                        mimetype='application/x-ndjson')
+
     @app.route('/api/products/<int:product_id>', methods=['DELETE'])
     @jwt_required()
     def delete_product(product_id):
         product = Product.query.get_or_404(product_id)
+        # Order history keeps pointing at the product, so it cannot go
+        ordered = db.session.query(OrderItem.query.filter_by(product_id=product_id).exists()).scalar()
+        if ordered:
+            return jsonify({'error': 'Product has orders and cannot be deleted'}), 409
         db.session.delete(product)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Ordered between the check and the delete
+            db.session.rollback()
+            return jsonify({'error': 'Product has orders and cannot be deleted'}), 409
         return jsonify({'message': 'Product deleted successfully'}), 200
 
     # Featured Products Route
     @app.route('/api/products/featured', methods=['GET'])
+    @read_replica
+    @conditional(max_age=300, namespaces=lambda: ['featured'], tier=price_tier)
+    @cache.cached(lambda: ['featured'], tier=price_tier)
     def get_featured_products():
-        user_id = get_jwt_identity() if request.headers.get('Authorization') else None
-        user = User.query.get(user_id) if user_id else None
-        
-        featured_products = Product.query.filter_by(is_featured=True).all()
-        return jsonify([{
-            'id': p.id,
-            'name': p.name,
-            'description': p.description,
-            'price': p.price if (user and user.can_view_prices) else None,
-            'category_id': p.category_id,
-            'image_url': p.image_url,
-            'stock': p.stock,
-            'is_featured': p.is_featured
-        } for p in featured_products]), 200
+        serializer = product_serializer(can_view_prices=can_view_prices())
+        rows = product_rows(serializer.select().where(ProductListing.is_featured == True)
+                            .order_by(ProductListing.product_id))
+        return json_array_response(rows, serializer.serialize)
 
     # Category Products Route
     @app.route('/api/categories/<int:category_id>/products', methods=['GET'])
+    @read_replica
+    @conditional(max_age=120, namespaces=lambda category_id: ['category:%d' % category_id],
+                 tier=price_tier)
+    @cache.cached(lambda category_id: ['category:%d' % category_id], tier=price_tier)
     def get_category_products(category_id):
-        user_id = get_jwt_identity() if request.headers.get('Authorization') else None
-        user = User.query.get(user_id) if user_id else None
-        
-        products = Product.query.filter_by(category_id=category_id).all()
-        return jsonify([{
-            'id': p.id,
-            'name': p.name,
-            'description': p.description,
-            'price': p.price if (user and user.can_view_prices) else None,
-            'category_id': p.category_id,
-            'image_url': p.image_url,
-            'stock': p.stock,
-            'is_featured': p.is_featured
-        } for p in products]), 200
+        serializer = product_serializer(can_view_prices=can_view_prices())
+        rows = product_rows(serializer.select().where(ProductListing.category_id == category_id)
+                            .order_by(ProductListing.product_id))
+        return json_array_response(rows, serializer.serialize)
 
     # Size Management Routes
     @app.route('/api/sizes', methods=['GET'])
+    @read_replica
+    @conditional(max_age=3600)
+    @cache.cached(lambda: ['sizes'])
     def get_sizes():
         sizes = Size.query.all()
         return jsonify([size.to_dict() for size in sizes]), 200
@@ -283,70 +484,187 @@ def init_routes(app):
         )
         db.session.add(size)
         db.session.commit()
+        cache.invalidate('sizes')
         return jsonify(size.to_dict()), 201
 
     @app.route('/api/products/<int:product_id>/sizes', methods=['GET'])
+    @read_replica
     def get_product_sizes(product_id):
-        product = Product.query.get_or_404(product_id)
-        product_sizes = ProductSize.query.filter_by(product_id=product_id).all()
-        
-        sizes_with_stock = []
-        for product_size in product_sizes:
-            size_dict = product_size.size.to_dict()
-            size_dict['stock'] = product_size.stock
-            sizes_with_stock.append(size_dict)
-        
-        return jsonify(sizes_with_stock), 200
+        product_sizes = product_sizes_query(product_id).all()
+        if not product_sizes:
+            # Distinguish "no sizes" from "no such product"
+            Product.query.get_or_404(product_id)
+
+        return jsonify([size_with_stock(ps) for ps in product_sizes]), 200
+
+    # Inventory Reservation Routes
+    @app.route('/api/inventory/reservations', methods=['POST'])
+    @jwt_required()
+    def create_reservation():
+        data = request.get_json()
+        try:
+            reservation = reserve(
+                product_id=data['product_id'],
+                size_id=data['size_id'],
+                quantity=data.get('quantity', 1),
+                user_id=get_jwt_identity()
+            )
+        except InsufficientStock as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 409
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        db.session.commit()
+        return jsonify(reservation.to_dict()), 201
+
+    @app.route('/api/inventory/reservations/<token>', methods=['DELETE'])
+    @jwt_required()
+    def delete_reservation(token):
+        reservation = Reservation.query.filter_by(token=token).first_or_404()
+        if str(reservation.user_id) != get_jwt_identity():
+            return jsonify({'error': 'Not your reservation'}), 403
+        if not release_reservation(reservation):
+            return jsonify({'error': 'Reservation is no longer held'}), 409
+        db.session.commit()
+        return jsonify({'message': 'Reservation released'}), 200
+
+    # Cart Routes
+    @app.route('/api/cart', methods=['GET'])
+    @jwt_required()
+    def get_cart():
+        lines = load_cart(int(get_jwt_identity()))
+        return jsonify(cart_view(lines, line_rows(lines), can_view_prices())), 200
+
+    @app.route('/api/cart', methods=['PUT'])
+    @jwt_required()
+    def put_cart():
+        data = request.get_json() or {}
+        try:
+            lines, seen = parse_cart(data.get('items'))
+        except OrderError as e:
+            return jsonify({'error': str(e)}), 400
+        lines, rows = replace_cart(int(get_jwt_identity()), lines)
+        db.session.commit()
+        return jsonify(cart_view(lines, rows, can_view_prices(), seen)), 200
+
+    @app.route('/api/cart', methods=['DELETE'])
+    @jwt_required()
+    def delete_cart():
+        remove_lines(int(get_jwt_identity()))
+        db.session.commit()
+        return jsonify({'message': 'Cart cleared'}), 200
+
+    @app.route('/api/cart/validate', methods=['POST'])
+    def validate_cart():
+        # Open to guests: prices are only shown to tiers that may see them
+        data = request.get_json() or {}
+        try:
+            lines, seen = parse_cart(data.get('items'))
+        except OrderError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(cart_view(lines, line_rows(lines), can_view_prices(), seen)), 200
+
+    # Order Routes
+    @app.route('/api/orders', methods=['GET'])
+    @jwt_required()
+    def get_orders():
+        try:
+            orders, next_cursor = list_orders(
+                int(get_jwt_identity()),
+                limit=request.args.get('limit', type=int),
+                cursor=request.args.get('cursor')
+            )
+        except ListingError as e:
+            return jsonify({'error': str(e)}), 400
+        response = jsonify([order.to_dict() for order in orders])
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response, 200
+
+    @app.route('/api/orders', methods=['POST'])
+    @jwt_required()
+    def create_order():
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Request body must be a JSON object'}), 400
+        try:
+            order, created = place_order(
+                int(get_jwt_identity()),
+                data.get('items'),
+                idempotency_key=request.headers.get('Idempotency-Key'),
+                reservations=data.get('reservations') or ()
+            )
+        except OrderError as e:
+            return jsonify({'error': str(e)}), 400
+        except InsufficientStock as e:
+            return jsonify({'error': str(e), 'product_id': e.product_id,
+                            'size_id': e.size_id}), 409
+
+        if not created:
+            response = jsonify(order.to_dict())
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response, 200
+        # What was bought leaves the saved cart
+        remove_lines(order.user_id, [(item.product_id, item.size_id) for item in order.items])
+        db.session.commit()
+        return jsonify(order.to_dict()), 201
+
+    @app.route('/api/orders/<int:order_id>/cancel', methods=['POST'])
+    @jwt_required()
+    def cancel_user_order(order_id):
+        order = Order.query.filter_by(id=order_id, user_id=int(get_jwt_identity())).first_or_404()
+        if not cancel_order(order):
+            return jsonify({'error': 'Only placed orders can be cancelled'}), 409
+        db.session.refresh(order)
+        return jsonify(order.to_dict()), 200
 
     # Filter Routes
     @app.route('/api/products/filter', methods=['GET'])
+    @read_replica
+    @conditional(max_age=60, namespaces=lambda: ['catalog'], tier=price_tier)
     def filter_products():
-        # Get filter parameters
-        fabric = request.args.get('fabric')
-        style = request.args.get('style')
-        occasion = request.args.get('occasion')
-        min_price = request.args.get('min_price', type=float)
-        max_price = request.args.get('max_price', type=float)
-        size = request.args.get('size')
-        
-        # Start with base query
-        query = Product.query
-        
-        # Apply filters
-        if fabric:
-            query = query.filter(Product.fabric == fabric)
-        if style:
-            query = query.filter(Product.style == style)
-        if occasion:
-            query = query.filter(Product.occasion == occasion)
-        if min_price is not None:
-            query = query.filter(Product.price >= min_price)
-        if max_price is not None:
-            query = query.filter(Product.price <= max_price)
-        if size:
-            query = query.join(ProductSize).join(Size).filter(Size.name == size)
-        
-        # Get user for price visibility
-        user_id = get_jwt_identity() if request.headers.get('Authorization') else None
-        user = User.query.get(user_id) if user_id else None
-        
-        products = query.all()
-        return jsonify([{
-            'id': p.id,
-            'name': p.name,
-            'description': p.description,
-            'price': p.price if (user and user.can_view_prices) else None,
-            'sale_price': p.sale_price if (user and user.can_view_prices) else None,
-            'fabric': p.fabric,
-            'style': p.style,
-            'occasion': p.occasion,
-            'sleeve_type': p.sleeve_type,
-            'neck_type': p.neck_type,
-            'images': p.images,
-            'category_id': p.category_id,
-            'sizes': [size.to_dict() for size in p.sizes],
-            'stock': p.stock,
-            'is_featured': p.is_featured
-        } for p in products]), 200
-
-    return app 
\ No newline at end of file
+        # Multi-value filters, e.g. ?fabric=Silk,Cotton&size=M&max_price=2000
+        filters = parse_filters(request.args)
+        serializer = product_serializer(can_view_prices=can_view_prices())
+        rows = product_rows(serializer.select()
+                            .where(*filter_criteria(filters, source=ProductListing))
+                            .order_by(ProductListing.product_id))
+        return json_array_response(rows, serializer.serialize)
+
+    @app.route('/api/products/search', methods=['GET'])
+    @read_replica
+    def search_products():
+        q = request.args.get('q', '')
+        limit = parse_limit(request.args.get('limit', type=int))
+        cursor = request.args.get('cursor')
+        try:
+            offset = decode_cursor(cursor) if cursor else 0
+            # Ask for one extra id to know whether another page exists
+            ids = search_product_ids(q, limit + 1, offset)
+        except ListingError as e:
+            return jsonify({'error': str(e)}), 400
+        except SearchUnavailable as e:
+            return jsonify({'error': str(e)}), 503
+
+        has_more = len(ids) > limit
+        ids = ids[:limit]
+        serializer = product_serializer(can_view_prices=can_view_prices())
+        rows = db.session.execute(
+            serializer.select().where(ProductListing.product_id.in_(ids))).all() if ids else []
+        by_id = {row.id: row for row in rows}
+
+        response = jsonify([serializer.serialize(by_id[i]) for i in ids if i in by_id])
+        if has_more:
+            response.headers['X-Next-Cursor'] = encode_cursor(offset + limit)
+        return response, 200
+
+    @app.route('/api/products/facets', methods=['GET'])
+    @read_replica
+    def get_product_facets():
+        criteria = []
+        category_id = request.args.get('category_id', type=int)
+        if category_id is not None:
+            criteria.append(Product.category_id == category_id)
+        return jsonify(facet_counts(parse_filters(request.args), criteria)), 200
+
+    return app
\ No newline at end of file
@@ -0,0 +1,166 @@
+import importlib
+import pkgutil
+import re
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, insert, select, text
+from . import db, migrations
+
+# Migration modules are named v<version>_<name>
+MIGRATION_RE = re.compile(r'^v(\d+)_(\w+)$')
+
+# Postgres advisory lock key held while migrating, so concurrent upgrades queue up
+MIGRATION_LOCK_ID = 7201
+
+# Outside db.Model's metadata: the migrations own every table, this one included
+schema_migrations = Table(
+    'schema_migrations', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+class MigrationError(RuntimeError):
+    """Raised for a broken migrations package (e.g. two migrations sharing a version)"""
+
+
+class Migration:
+    def __init__(self, version, name, module):
+        self.version = version
+        self.name = name
+        self.module = module
+
+    @property
+    def description(self):
+        return (self.module.__doc__ or '').strip().split('\n')[0]
+
+    def upgrade(self, connection):
+        self.module.upgrade(connection)
+
+
+def discover():
+    """Every migration in the migrations package, oldest first"""
+    found = {}
+    for info in pkgutil.iter_modules(migrations.__path__):
+        match = MIGRATION_RE.match(info.name)
+        if match is None:
+            continue
+        version = int(match.group(1))
+        if version in found:
+            raise MigrationError('Two migrations have version %d' % version)
+        module = importlib.import_module('%s.%s' % (migrations.__name__, info.name))
+        found[version] = Migration(version, match.group(2), module)
+    return [found[v] for v in sorted(found)]
+
+
+def applied_versions(connection):
+    """Versions recorded as applied; empty for a database never migrated"""
+    if not inspect(connection).has_table(schema_migrations.name):
+        return set()
+    return set(connection.scalars(select(schema_migrations.c.version)))
+
+
+def pending_migrations():
+    with db.engine.connect() as connection:
+        applied = applied_versions(connection)
+    return [m for m in discover() if m.version not in applied]
+
+
+def upgrade(target=None):
+    """Apply pending migrations up to version `target` (all by default).
+
+    Each migration runs in its own transaction together with its
+    schema_migrations row. Returns the migrations applied.
+    """
+    applied = []
+    with db.engine.begin() as connection:
+        schema_migrations.create(connection, checkfirst=True)
+    for migration in discover():
+        if target is not None and migration.version > target:
+            break
+        with db.engine.begin() as connection:
+            if connection.dialect.name == 'postgresql':
+                connection.execute(text('SELECT pg_advisory_xact_lock(:id)'), {'id': MIGRATION_LOCK_ID})
+            # Re-read under the lock: another process may have just applied it
+            if migration.version in applied_versions(connection):
+                continue
+            migration.upgrade(connection)
+            connection.execute(insert(schema_migrations).values(
+                version=migration.version, name=migration.name, applied_at=datetime.utcnow()))
+        current_app.logger.info('Applied migration %d (%s)', migration.version, migration.name)
+        applied.append(migration)
+    if applied:
+        from .product_listing import fill_empty_listings
+        fill_empty_listings()
+    return applied
+
+
+def stamp(version):
+    """Record migrations up to `version` as applied without running them"""
+    with db.engine.begin() as connection:
+        schema_migrations.create(connection, checkfirst=True)
+        done = applied_versions(connection)
+        stamped = [m for m in discover() if m.version <= version and m.version not in done]
+        for migration in stamped:
+            connection.execute(insert(schema_migrations).values(
+                version=migration.version, name=migration.name, applied_at=datetime.utcnow()))
+    return stamped
+
+
+db_cli = AppGroup('db', help='Database schema migrations.')
+
+
+@db_cli.command('upgrade')
+@click.option('--to', 'target', type=int, help='Stop after this version.')
+def upgrade_command(target):
+    """Apply pending migrations (run once per deploy, before starting workers)."""
+    applied = upgrade(target)
+    for migration in applied:
+        click.echo('Applied %04d %s' % (migration.version, migration.name))
+    if not applied:
+        click.echo('Database is up to date')
+
+
+@db_cli.command('current')
+def current_command():
+    """Show the latest applied migration."""
+    with db.engine.connect() as connection:
+        applied = applied_versions(connection)
+    click.echo('%04d' % max(applied) if applied else 'No migrations applied')
+
+
+@db_cli.command('history')
+def history_command():
+    """List every migration and whether it is applied."""
+    with db.engine.connect() as connection:
+        applied = applied_versions(connection)
+    for migration in discover():
+        click.echo('%04d %-8s %-20s %s' % (migration.version,
+                                           'applied' if migration.version in applied else 'pending',
+                                           migration.name, migration.description))
+
+
+@db_cli.command('stamp')
+@click.argument('version', type=int)
+def stamp_command(version):
+    """Mark migrations up to VERSION as applied without running them."""
+    click.echo('Stamped %d migrations' % len(stamp(version)))
+
+
+def init_app(app):
+    """Register `flask db`; with DB_AUTO_UPGRADE also migrate now.
+
+    The check costs two small queries and no reflection of the models. In
+    production run `flask db upgrade` once per deploy instead and start the
+    workers with DB_AUTO_UPGRADE off, so booting touches no database at all.
+    """
+    app.config.setdefault('DB_AUTO_UPGRADE', True)
+    app.cli.add_command(db_cli)
+    if app.config['DB_AUTO_UPGRADE']:
+        with app.app_context():
+            if pending_migrations():
+                upgrade()
+            db.session.remove()
@@ -0,0 +1,88 @@
+import re
+from sqlalchemy import text
+from . import db
+from .jobs import job
+
+# Product columns covered by the full-text index, in index column order. The
+# index (an FTS5 table kept in sync by triggers on SQLite, a generated tsvector
+# column on Postgres) is created by the migrations.
+SEARCH_COLUMNS = ('name', 'description', 'fabric', 'style', 'occasion')
+
+# Relative weights of the columns above; a hit in the name counts most
+SEARCH_WEIGHTS = (10.0, 1.0, 3.0, 3.0, 3.0)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class SearchUnavailable(RuntimeError):
+    """Raised when the configured database has no full-text search support"""
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+@job('search.optimize')
+def optimize_search_index(payload=None):
+    """Compact the index after bulk writes.
+
+    Trigger maintenance leaves FTS5 with many small segments after large
+    imports, which slows MATCH queries until merged; Postgres only needs
+    fresh planner statistics for the GIN index.
+    """
+    dialect = _dialect()
+    with db.engine.begin() as conn:
+        if dialect == 'sqlite':
+            conn.execute(text("INSERT INTO products_fts(products_fts) VALUES ('optimize')"))
+        elif dialect == 'postgresql':
+            conn.execute(text('ANALYZE products'))
+
+
+def tokenize(q):
+    return TOKEN_RE.findall(q or '')
+
+
+def _sqlite_match(tokens):
+    # Quote every token so user input can't inject FTS5 syntax; the last one
+    # is a prefix so results update while the user is still typing
+    terms = ['"%s"' % t for t in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _postgres_tsquery(tokens):
+    terms = list(tokens)
+    terms[-1] += ':*'
+    return ' & '.join(terms)
+
+
+def search_product_ids(q, limit, offset=0):
+    """Return ids of products matching `q`, best match first.
+
+    SQLite ranks with FTS5's BM25 using SEARCH_WEIGHTS; Postgres uses
+    ts_rank_cd over the weighted tsvector.
+    """
+    tokens = tokenize(q)
+    if not tokens:
+        return []
+
+    dialect = _dialect()
+    if dialect == 'sqlite':
+        weights = ', '.join(str(w) for w in SEARCH_WEIGHTS)
+        stmt = text(
+            "SELECT rowid FROM products_fts WHERE products_fts MATCH :match "
+            "ORDER BY bm25(products_fts, %s), rowid LIMIT :limit OFFSET :offset" % weights
+        )
+        params = {'match': _sqlite_match(tokens)}
+    elif dialect == 'postgresql':
+        stmt = text(
+            "SELECT id FROM products, to_tsquery('simple', :query) AS query "
+            "WHERE search_vector @@ query "
+            "ORDER BY ts_rank_cd(search_vector, query) DESC, id LIMIT :limit OFFSET :offset"
+        )
+        params = {'query': _postgres_tsquery(tokens)}
+    else:
+        raise SearchUnavailable('Full-text search is not supported on ' + dialect)
+
+    params.update(limit=limit, offset=offset)
+    return [row[0] for row in db.session.execute(stmt, params)]
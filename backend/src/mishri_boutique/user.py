@@ -7,6 +7,14 @@ class UserType(Enum):
     PLUS = "plus"    # Can see prices
     PREMIUM = "premium"  # Can see prices and promotions
 
+    @property
+    def can_view_prices(self):
+        return self in (UserType.PLUS, UserType.PREMIUM)
+
+    @property
+    def can_receive_promotions(self):
+        return self == UserType.PREMIUM
+
 class User(db.Model):
     __tablename__ = 'users'
 
@@ -35,21 +43,21 @@ class User(db.Model):
     @property
     def can_view_prices(self):
         """Check if user can view prices"""
-        return self.user_type in [UserType.PLUS, UserType.PREMIUM]
+        return bool(self.user_type and self.user_type.can_view_prices)
 
     @property
     def can_receive_promotions(self):
         """Check if user can receive promotional updates"""
-        return self.user_type == UserType.PREMIUM
+        return bool(self.user_type and self.user_type.can_receive_promotions)
 
     def add_points(self, points):
-        """Add points and update user type"""
-        self.points += points
-        # Check if user can be upgraded based on points
-        if self.points >= 1000 and self.user_type == UserType.BASIC:
-            self.user_type = UserType.PLUS
-        elif self.points >= 2000 and self.user_type == UserType.PLUS:
-            self.user_type = UserType.PREMIUM
+        """Add points and update user type in memory.
+
+        A read-modify-write that loses points when requests race; accrue
+        through points.accrue(), which also records the ledger entry.
+        """
+        self.points = (self.points or 0) + points
+        self.update_user_type()
 
     def to_dict(self):
         return {
@@ -62,4 +70,30 @@ class User(db.Model):
             'can_receive_promotions': self.can_receive_promotions,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'last_login': self.last_login.isoformat() if self.last_login else None
-        }
\ No newline at end of file
+        }
+
+
+class PointsEntry(db.Model):
+    """One append-only change to a user's points; users.points is their sum"""
+    __tablename__ = 'points_ledger'
+    __table_args__ = (
+        # Credits tied to something (e.g. an order) are granted to a user at most once
+        db.UniqueConstraint('user_id', 'reason', 'ref', name='uq_points_ledger_user_reason_ref'),
+        db.Index('ix_points_ledger_user_id_id', 'user_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    points = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(50), nullable=False)
+    ref = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'points': self.points,
+            'reason': self.reason,
+            'ref': self.ref,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
@@ -58,6 +58,9 @@ const ActionButton = styled(IconButton)(({ theme }) => ({
   },
 }));
 
+// Rendered width of a card in the product grid, for picking a srcset entry
+const CARD_IMAGE_SIZES = '(max-width: 600px) 100vw, (max-width: 900px) 50vw, 25vw';
+
 const ProductCard = ({ product }) => {
   const navigate = useNavigate();
   const dispatch = useDispatch();
@@ -70,6 +73,7 @@ const ProductCard = ({ product }) => {
     price,
     sale_price,
     images,
+    image_variants,
     fabric,
     is_featured,
     stock,
@@ -95,7 +99,13 @@ const ProductCard = ({ product }) => {
 
   const handleAddToCart = (e) => {
     e.stopPropagation();
-    dispatch(addItem({ ...product, quantity: 1 }));
+    // A cart line needs a size; only pick it here when there is no choice
+    const inStock = (product.sizes || []).filter((size) => size.stock > 0);
+    if (inStock.length !== 1) {
+      navigate(`/products/${id}`);
+      return;
+    }
+    dispatch(addItem({ ...product, size: inStock[0], quantity: 1 }));
   };
 
   const renderPrice = () => {
@@ -141,13 +151,22 @@ const ProductCard = ({ product }) => {
   return (
     <StyledCard onClick={() => navigate(`/products/${id}`)}>
       <Box sx={{ position: 'relative' }}>
-        <CardMedia
-          component="img"
-          height="300"
-          image={images[0]}
-          alt={name}
-          sx={{ objectFit: 'cover' }}
-        />
+        {/* Resized WebP/JPEG derivatives once generated, the original otherwise */}
+        <picture>
+          {image_variants?.[0] && (
+            <source type="image/webp" srcSet={image_variants[0].srcset.webp} sizes={CARD_IMAGE_SIZES} />
+          )}
+          <CardMedia
+            component="img"
+            height="300"
+            image={image_variants?.[0]?.src || images[0]}
+            srcSet={image_variants?.[0]?.srcset.jpeg}
+            sizes={image_variants?.[0] ? CARD_IMAGE_SIZES : undefined}
+            loading="lazy"
+            alt={name}
+            sx={{ objectFit: 'cover' }}
+          />
+        </picture>
         
         {/* Badges */}
         <Box sx={{ position: 'absolute', top: 10, left: 10, display: 'flex', gap: 1 }}>
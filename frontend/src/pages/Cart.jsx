@@ -1,4 +1,4 @@
-import React from 'react';
+import React, { useEffect } from 'react';
 import { useDispatch, useSelector } from 'react-redux';
 import { useNavigate } from 'react-router-dom';
 import {
@@ -32,23 +32,45 @@ import {
   removeItem,
   updateQuantity,
   clearCart,
+  validateCart,
 } from '../store/slices/cartSlice';
 
+// Shown under a line the server flagged when validating the cart
+const lineProblem = (line) => {
+  if (!line) return null;
+  if (line.status === 'unavailable') return 'No longer available';
+  if (line.status === 'insufficient_stock') return `Only ${line.stock} left`;
+  if (line.price_changed) return 'Price has changed';
+  return null;
+};
+
 const Cart = () => {
   const dispatch = useDispatch();
   const navigate = useNavigate();
-  const { items } = useSelector((state) => state.cart);
+  const { items, validation } = useSelector((state) => state.cart);
   const { user } = useSelector((state) => state.auth);
 
+  // One request checks stock and prices of every line
+  useEffect(() => {
+    if (items.length) {
+      dispatch(validateCart());
+    }
+  }, [dispatch, items]);
+
+  const validatedLine = (item) =>
+    validation?.items.find(
+      (line) => line.product_id === item.id && line.size_id === item.size?.id
+    );
+
   const handleQuantityChange = (productId, size, currentQty, delta) => {
     const newQty = currentQty + delta;
     if (newQty >= 1) {
-      dispatch(updateQuantity({ productId, size, quantity: newQty }));
+      dispatch(updateQuantity({ id: productId, size, quantity: newQty }));
     }
   };
 
   const handleRemoveItem = (productId, size) => {
-    dispatch(removeItem({ productId, size }));
+    dispatch(removeItem({ id: productId, size }));
   };
 
   const calculateSubtotal = () => {
@@ -137,6 +159,11 @@ const Cart = () => {
                           <Typography variant="body2" color="text.secondary">
                             {item.fabric} • {item.style}
                           </Typography>
+                          {lineProblem(validatedLine(item)) && (
+                            <Typography variant="body2" color="error">
+                              {lineProblem(validatedLine(item))}
+                            </Typography>
+                          )}
                         </Box>
                       </Box>
                     </TableCell>
@@ -265,7 +292,7 @@ const Cart = () => {
                   variant="contained"
                   size="large"
                   fullWidth
-                  disabled={!user}
+                  disabled={!user || validation?.valid === false}
                   endIcon={<ArrowForward />}
                   onClick={() => navigate('/checkout')}
                 >
@@ -14,12 +14,17 @@ export const register = createAsyncThunk(
 
 export const login = createAsyncThunk(
   'auth/login',
-  async (credentials) => {
-    const response = await axios.post(`${API_URL}/auth/login`, credentials);
-    const { token, user } = response.data;
+  async (credentials, { getState }) => {
+    // The server merges the guest cart into the user's saved cart
+    const response = await axios.post(`${API_URL}/auth/login`, {
+      ...credentials,
+      cart: getState().cart.items,
+    });
+    const { access_token: token, user, cart } = response.data;
     localStorage.setItem('token', token);
     axios.defaults.headers.common['Authorization'] = `Bearer ${token}`;
-    return user;
+    // cartSlice replaces the local cart with the merged one
+    return { user, cart };
   }
 );
 
@@ -74,7 +79,7 @@ const authSlice = createSlice({
       })
       .addCase(login.fulfilled, (state, action) => {
         state.loading = false;
-        state.user = action.payload;
+        state.user = action.payload.user;
         state.isAuthenticated = true;
         state.error = null;
       })
@@ -1,8 +1,45 @@
-import { createSlice } from '@reduxjs/toolkit';
+import { createSlice, createAsyncThunk } from '@reduxjs/toolkit';
+import axios from 'axios';
+import { login } from './authSlice';
+
+const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5000/api';
+
+// Checks price and stock of every line in one request
+export const validateCart = createAsyncThunk(
+  'cart/validate',
+  async (_, { getState }) => {
+    const response = await axios.post(`${API_URL}/cart/validate`, {
+      items: getState().cart.items.map((item) => ({
+        product_id: item.id,
+        size_id: item.size?.id,
+        quantity: item.quantity,
+        price: item.price,
+        sale_price: item.sale_price,
+      })),
+    });
+    return response.data;
+  }
+);
+
+// Client cart item from a line of the server's cart view
+const fromServerLine = (line) => ({
+  id: line.product_id,
+  name: line.name,
+  images: line.image ? [line.image] : [],
+  price: line.price,
+  sale_price: line.sale_price,
+  size: { id: line.size_id, name: line.size },
+  quantity: line.quantity,
+});
+
+const cartTotal = (items) =>
+  items.reduce((sum, item) => sum + (item.price || 0) * item.quantity, 0);
 
 const initialState = {
   items: [],
   total: 0,
+  validation: null,
+  validating: false,
 };
 
 const cartSlice = createSlice({
@@ -12,7 +49,7 @@ const cartSlice = createSlice({
     addItem: (state, action) => {
       const { id, size } = action.payload;
       const existingItem = state.items.find(
-        item => item.id === id && item.size === size
+        item => item.id === id && item.size?.id === size?.id
       );
 
       if (existingItem) {
@@ -21,40 +58,55 @@ const cartSlice = createSlice({
         state.items.push({ ...action.payload, quantity: 1 });
       }
 
-      state.total = state.items.reduce(
-        (sum, item) => sum + item.price * item.quantity,
-        0
-      );
+      state.total = cartTotal(state.items);
     },
     removeItem: (state, action) => {
       const { id, size } = action.payload;
       state.items = state.items.filter(
-        item => !(item.id === id && item.size === size)
-      );
-      state.total = state.items.reduce(
-        (sum, item) => sum + item.price * item.quantity,
-        0
+        item => !(item.id === id && item.size?.id === size?.id)
       );
+      state.total = cartTotal(state.items);
     },
     updateQuantity: (state, action) => {
       const { id, size, quantity } = action.payload;
       const item = state.items.find(
-        item => item.id === id && item.size === size
+        item => item.id === id && item.size?.id === size?.id
       );
 
       if (item) {
         item.quantity = quantity;
-        state.total = state.items.reduce(
-          (sum, item) => sum + item.price * item.quantity,
-          0
-        );
+        state.total = cartTotal(state.items);
       }
     },
     clearCart: (state) => {
       state.items = [];
       state.total = 0;
+      state.validation = null;
     },
   },
+  extraReducers: (builder) => {
+    builder
+      .addCase(validateCart.pending, (state) => {
+        state.validating = true;
+      })
+      .addCase(validateCart.fulfilled, (state, action) => {
+        state.validating = false;
+        state.validation = action.payload;
+      })
+      .addCase(validateCart.rejected, (state) => {
+        state.validating = false;
+      })
+      // The server merged the guest cart into the saved one; start from that
+      .addCase(login.fulfilled, (state, action) => {
+        const { cart } = action.payload;
+        if (!cart) return;
+        state.items = cart.items
+          .filter((line) => line.status !== 'unavailable')
+          .map(fromServerLine);
+        state.total = cartTotal(state.items);
+        state.validation = cart;
+      });
+  },
 });
 
 export const { addItem, removeItem, updateQuantity, clearCart } = cartSlice.actions;